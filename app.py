@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
 import json
 import logging
@@ -7,14 +8,20 @@ import os.path
 import signal
 import sys
 
+import prometheus_client
 import uvicorn
 from loguru import logger
 
-from xilriws.browser import BrowserAuth, BrowserJoin
+from xilriws.browser import BrowserAuth, BrowserJoin, ChromeDriver, FlightRecorder, RecyclePolicy
+from xilriws.cookie_store import RedisCookieStore, SqliteCookieStore
+from xilriws.debug import IS_DEBUG
 from xilriws.extension_comm import ExtensionComm
-from xilriws.mode import AuthMode, CionMode
+from xilriws.fair_queue import FairQueue
+from xilriws.mode import AuthMode, CionMode, DispatchMode
+from xilriws.mode.basic_mode import BasicMode
 from xilriws.proxy import ProxyDistributor
 from xilriws.proxy_dispenser import ProxyDispenser
+from xilriws.supervisor import Supervisor
 from xilriws.task_creator import task_creator
 
 httpx_logger = logging.getLogger("httpx")
@@ -30,24 +37,62 @@ conn_logger.setLevel(logging.CRITICAL)
 
 logger = logger.bind(name="Xilriws")
 
+# the dispatcher merges the metrics of its workers, the parser can't tell _created series from gauges
+prometheus_client.disable_created_metrics()
+
 if sys.platform != "win32":
     signal.signal(signal.SIGCHLD, signal.SIG_IGN)
 # else:
 #     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
-async def main(cion_mode: bool):
+def _worker_path(path: str | None, worker: int | None) -> str | None:
+    """every worker process keeps its own file next to the configured one"""
+    if not path or worker is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{worker}{extension}"
+
+
+async def main(cion_mode: bool, worker: int | None = None):
+    """worker is set in the processes started by the supervisor, when worker_processes is more than 1"""
     if os.path.exists("config.json"):
         with open("config.json", "r") as f:
             config: dict[str, str | int] = json.load(f)
     else:
         config = {}
 
-    ext_comm = ExtensionComm()
+    worker_processes = config.get("worker_processes", 1)
+    worker_port = config.get("worker_port", 5100)
+    port = config.get("port", 5090)
+    host = config.get("host", "0.0.0.0")
+
+    if worker_processes > 1 and worker is None and not cion_mode:
+        logger.info(f"Starting {worker_processes} worker processes")
+        if sys.platform != "win32":
+            # the supervisor waits for its workers, so they can't be reaped automatically like the browsers are
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        debug = ["--debug"] if IS_DEBUG else []
+        supervisor = Supervisor(
+            [[sys.executable, os.path.abspath(__file__), "--worker", str(i), *debug] for i in range(worker_processes)]
+        )
+        mode = DispatchMode(
+            supervisor,
+            [f"http://127.0.0.1:{worker_port + i}" for i in range(worker_processes)],
+            batch_concurrency=config.get("batch_concurrency", 10),
+        )
+        await serve(mode, host, port)
+        return
+
+    if worker is not None:
+        host = "127.0.0.1"
+        port = worker_port + worker
+
+    ext_comm = ExtensionComm(port=config.get("extension_port", 9091) + (worker or 0))
     task_creator.create_task(ext_comm.start())
 
     extenstion_paths = [
-        config.get("proxy", "/xilriws/xilriws-proxy"),
+        ext_comm.prepare_extension(config.get("proxy", "/xilriws/xilriws-proxy")),
         config.get("targetfp_path", "/xilriws/xilriws-targetfp"),
     ]
 
@@ -57,17 +102,63 @@ async def main(cion_mode: bool):
             BrowserJoin(extension_paths=extenstion_paths, ext_comm=ext_comm)
         )
     else:
-        proxies = ProxyDistributor(ext_comm)
         proxy_dispenser = ProxyDispenser(
-            config.get("proxies_list_path", "/xilriws/proxies.txt")
+            config.get("proxies_list_path", "/xilriws/proxies.txt"),
+            shard=worker or 0,
+            shard_count=worker_processes if worker is not None else 1,
         )
 
-        mode = AuthMode(BrowserAuth(extension_paths=extenstion_paths, ext_comm=ext_comm, proxies=proxies), proxies, proxy_dispenser)
+        recycle_policy = RecyclePolicy(
+            max_sessions=config.get("browser_max_sessions", 60),
+            max_rss_mb=config.get("browser_max_rss_mb", 1500),
+            max_age=config.get("browser_max_age"),
+            max_tabs=config.get("browser_max_tabs", 10),
+        )
+        recorder = FlightRecorder(config.get("flight_recorder_size", 100))
+        browsers = []
+        for _ in range(config.get("browser_workers", 1)):
+            proxies = ProxyDistributor()
+            driver = ChromeDriver(
+                extension_paths=extenstion_paths,
+                ext_comm=ext_comm,
+                proxies=proxies,
+                isolation=config.get("browser_isolation", "tab"),
+                recycle_policy=recycle_policy,
+                profile=config.get("browser_profile", "default"),
+            )
+            browsers.append(BrowserAuth(driver, proxies, recorder=recorder))
+
+        # a shared store is on disk already, there's no need for a snapshot
+        store = None
+        snapshot_path = _worker_path(config.get("cookie_snapshot_path", "cookie_snapshot.json"), worker)
+        cookie_store = config.get("cookie_store", "memory")
+        if cookie_store == "sqlite":
+            store = SqliteCookieStore(config.get("cookie_store_path", "cookies.db"), proxy_dispenser)
+            snapshot_path = None
+        elif cookie_store == "redis":
+            store = RedisCookieStore(config.get("cookie_store_url", "redis://localhost"), proxy_dispenser)
+            snapshot_path = None
+
+        fair_queue = FairQueue(config.get("client_shares"), config.get("client_keys"))
+
+        mode = AuthMode(
+            browsers,
+            proxy_dispenser,
+            max_queue=config.get("auth_queue_size", 500),
+            batch_concurrency=config.get("batch_concurrency", 10),
+            min_storage=config.get("cookie_storage_min", 1),
+            max_storage=config.get("cookie_storage_max", 20),
+            snapshot_path=snapshot_path,
+            store=store,
+            fair_queue=fair_queue,
+            recorder=recorder,
+        )
 
-    await mode.prepare()
+    await serve(mode, host, port)
 
-    port = config.get("port", 5090)
-    host = config.get("host", "0.0.0.0")
+
+async def serve(mode: BasicMode, host: str, port: int):
+    await mode.prepare()
 
     app = mode.get_litestar()
     server_config = uvicorn.Config(app, port=port, host=host, log_config=None)
@@ -79,4 +170,8 @@ async def main(cion_mode: bool):
 
 
 if __name__ == "__main__":
-    asyncio.run(main(cion_mode=False))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", type=int, default=None, help="index of this worker process, set by the supervisor")
+    parser.add_argument("--debug", action="store_true", help="debug logging and visible browsers")
+    args = parser.parse_args()
+    asyncio.run(main(cion_mode=False, worker=args.worker))
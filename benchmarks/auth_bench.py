@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from loguru import logger
+
+from xilriws.browser import BrowserAuth
+from xilriws.constants import AUTH_TIMEOUT
+from xilriws.cookie_store import RedisCookieStore, SqliteCookieStore
+from xilriws.deadline import Deadline
+from xilriws.fair_queue import FairQueue
+from xilriws.mode.auth_mode import AuthResponseStatus
+from xilriws.proxy import ProxyDistributor
+from xilriws.proxy_dispenser import ProxyDispenser
+from xilriws.ptc_auth import InvalidCredentials, PtcAuth, PtcBanned
+from xilriws.reese_cookie import CookieMonster
+
+from . import fake_browser, fake_ptc, fake_redis
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float]) -> dict[str, float | None]:
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "p50": percentile(ms, 50),
+        "p90": percentile(ms, 90),
+        "p99": percentile(ms, 99),
+        "mean": sum(ms) / len(ms) if ms else None,
+        "max": max(ms) if ms else None,
+    }
+
+
+def parse_clients(spec: str) -> tuple[dict[str, float], list[str]]:
+    """the shares of the clients, and the client of each request in turn ("a:1:4" sends 4 requests for every turn)"""
+    shares = {}
+    clients = []
+    for client in spec.split(","):
+        name, share, traffic = client.split(":")
+        shares[name] = float(share)
+        clients += [name] * int(traffic)
+    return shares, clients
+
+
+def by_client(results: list[tuple[str, float]], clients: list[str]) -> dict[str, list[tuple[str, float]]]:
+    grouped: dict[str, list[tuple[str, float]]] = {client: [] for client in clients}
+    for index, result in enumerate(results):
+        grouped[clients[index % len(clients)]].append(result)
+    return grouped
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_one(ptc_auth: PtcAuth, full_url: str, username: str, timeout: float, client: str) -> tuple[str, float]:
+    start = time.perf_counter()
+    try:
+        deadline = Deadline(timeout)
+        await deadline.run(ptc_auth.auth(username, "password", full_url, deadline, client=client))
+        status = AuthResponseStatus.SUCCESS
+    except InvalidCredentials:
+        status = AuthResponseStatus.INVALID
+    except PtcBanned:
+        status = AuthResponseStatus.BANNED
+    except asyncio.TimeoutError:
+        status = AuthResponseStatus.TIMEOUT
+    except Exception:
+        status = AuthResponseStatus.ERROR
+    return status.name, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end PtcAuth benchmark against a local PTC stand-in")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--browsers", type=int, default=1, help="number of fake browsers acquiring cookies")
+    parser.add_argument("--instances", type=int, default=1, help="Xilriws instances, each with its own browsers")
+    parser.add_argument(
+        "--store", choices=("memory", "sqlite", "redis"), default="memory", help="sqlite and redis share the cookies"
+    )
+    parser.add_argument("--redis-url", default=None, help="use a running server instead of a fakeredis stand-in")
+    parser.add_argument("--imbalance", action="store_true", help="send all requests to the first instance")
+    parser.add_argument("--proxies", type=int, default=1000, help="number of local proxies to rotate through")
+    parser.add_argument("--duplicates", type=int, default=1, help="requests per account, sent back to back")
+    parser.add_argument(
+        "--clients",
+        default="other:1:1",
+        help="name:share:traffic of each client, comma separated. traffic is its relative number of requests",
+    )
+    parser.add_argument("--auth-timeout", type=float, default=AUTH_TIMEOUT, help="seconds until a client gives up")
+    parser.add_argument("--ptc-url", default=None, help="use an already running stand-in instead of starting one")
+    parser.add_argument("--log-level", default="CRITICAL")
+    fake_ptc.add_arguments(parser)
+    fake_browser.add_arguments(parser)
+    args, _ = parser.parse_known_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    server = None
+    fake = None
+    base_url = args.ptc_url
+    if not base_url:
+        port = free_port()
+        fake = fake_ptc.FakePtc(fake_ptc.config_from_args(args))
+        server = await fake_ptc.serve(fake, "127.0.0.1", port)
+        base_url = f"http://127.0.0.1:{port}"
+    base_url = base_url.rstrip("/") + "/"
+    full_url = base_url + "oauth2/auth?client_id=bench&response_type=code&state=bench"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("local\n" * args.proxies)
+    try:
+        proxy_dispenser = ProxyDispenser(f.name)
+    finally:
+        os.unlink(f.name)
+
+    shares, clients = parse_clients(args.clients)
+
+    store_dir = tempfile.mkdtemp(prefix="xilriws-bench-")
+    redis_server = None
+    if args.store == "redis" and not args.redis_url:
+        redis_server, args.redis_url = fake_redis.serve()
+    browser_config = fake_browser.config_from_args(args)
+    browsers = []
+    ptc_auths = []
+    for _ in range(args.instances):
+        instance_browsers = [
+            BrowserAuth(fake_browser.FakeBrowser(browser_config), ProxyDistributor()) for _ in range(args.browsers)
+        ]
+        store = None
+        if args.store == "sqlite":
+            store = SqliteCookieStore(os.path.join(store_dir, "cookies.db"), proxy_dispenser)
+        elif args.store == "redis":
+            store = RedisCookieStore(args.redis_url, proxy_dispenser, prefix=f"xilriws-bench-{os.getpid()}")
+        cookie_monster = CookieMonster(instance_browsers, proxy_dispenser, store=store)
+        await cookie_monster.prepare()
+        browsers += instance_browsers
+        ptc_auths.append(PtcAuth(cookie_monster, access_url=base_url, fair_queue=FairQueue(shares)))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int) -> tuple[str, float]:
+        client = clients[index % len(clients)]
+        ptc_auth = ptc_auths[0 if args.imbalance else index % len(ptc_auths)]
+        async with semaphore:
+            username = f"bench{index // args.duplicates}"
+            return await run_one(ptc_auth, full_url, username, args.auth_timeout, client)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited(i) for i in range(args.requests)))
+    duration = time.perf_counter() - start
+
+    statuses = Counter(status for status, _ in results)
+    success_latencies = [latency for status, latency in results if status == AuthResponseStatus.SUCCESS.name]
+
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duration_s": duration,
+        "login_codes_per_s": len(success_latencies) / duration if duration else None,
+        "statuses": dict(statuses),
+        "latency_ms": summarize([latency for _, latency in results]),
+        "success_latency_ms": summarize(success_latencies),
+        "clients": {
+            client: {
+                "statuses": dict(Counter(status for status, _ in client_results)),
+                "latency_ms": summarize([latency for _, latency in client_results]),
+            }
+            for client, client_results in by_client(results, clients).items()
+        },
+        "cookies_acquired": sum(browser.driver.acquired for browser in browsers),
+        "ptc_requests": fake.requests if fake else None,
+        "ptc_connections": fake.connections if fake else None,
+        "config": {key: value for key, value in vars(args).items() if key != "log_level"},
+    }
+    print(json.dumps(report, indent=2))
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    if redis_server:
+        redis_server.shutdown()
+    if server:
+        server.should_exit = True
+        await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import zendriver
+from loguru import logger
+
+from xilriws.browser import ChromeDriver
+from xilriws.browser.browser import ISOLATION_CONTEXT, ISOLATION_TAB, PROFILE_DEFAULT, PROFILE_LEAN
+from xilriws.extension_comm import ExtensionComm
+from xilriws.proxy import ProxyDistributor
+
+from . import fake_ptc
+from .auth_bench import free_port, summarize
+
+
+def _memory(browser: ChromeDriver) -> dict:
+    usage = browser.resource_usage()
+    if not usage:
+        return {}
+    return {"rss_mb": usage.rss / 1024 / 1024, "cpu_s": usage.cpu_seconds, "processes": usage.processes}
+
+
+async def run_browser(isolation: str, profile: str, sessions: int, extension_path: str, page_url: str) -> dict:
+    """
+    start a real browser and open sessions like BrowserAuth does, timing how long it takes to get a clean tab.
+    memory is that of the whole process tree, right after launch and after all sessions
+    """
+    ext_comm = ExtensionComm(port=free_port())
+    server = asyncio.create_task(ext_comm.start())
+    browser = ChromeDriver(
+        extension_paths=[ext_comm.prepare_extension(extension_path)],
+        proxies=ProxyDistributor(),
+        ext_comm=ext_comm,
+        isolation=isolation,
+        profile=profile,
+    )
+
+    start = time.perf_counter()
+    await browser.start_browser()
+    launch = time.perf_counter() - start
+    idle = _memory(browser)
+
+    setups = []
+    totals = []
+    for _ in range(sessions):
+        start = time.perf_counter()
+        await browser.open_session(proxy_changed=False)
+        setups.append(time.perf_counter() - start)
+
+        await browser.tab.get(page_url)
+        await browser.tab.send(zendriver.cdp.network.get_cookies())
+        await browser.close_context()
+        totals.append(time.perf_counter() - start)
+
+    await asyncio.sleep(1)
+    busy = _memory(browser)
+    await browser.stop_browser()
+    server.cancel()
+
+    return {
+        "launch_s": launch,
+        "session_setup_ms": summarize(setups),
+        "session_ms": summarize(totals),
+        "after_launch": idle,
+        "after_sessions": busy,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the browser session isolation modes and launch profiles with a real browser"
+    )
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--isolation", nargs="+", default=[ISOLATION_TAB, ISOLATION_CONTEXT])
+    parser.add_argument("--profile", nargs="+", default=[PROFILE_DEFAULT, PROFILE_LEAN])
+    parser.add_argument("--extension", default="xilriws-proxy", help="path of the proxy extension")
+    parser.add_argument("--log-level", default="CRITICAL")
+    args, _ = parser.parse_known_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    port = free_port()
+    fake = fake_ptc.FakePtc(fake_ptc.FakePtcConfig(latency=0, jitter=0))
+    server = await fake_ptc.serve(fake, "127.0.0.1", port)
+    page_url = f"http://127.0.0.1:{port}/oauth2/auth"
+
+    report = {"sessions": args.sessions, "runs": []}
+    for profile in args.profile:
+        for isolation in args.isolation:
+            result = await run_browser(isolation, profile, args.sessions, args.extension, page_url)
+            report["runs"].append({"profile": profile, "isolation": isolation, **result})
+    print(json.dumps(report, indent=2))
+
+    server.should_exit = True
+    await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import timeit
+
+from xilriws.ptc import ptc_response, ptc_utils
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ptc")
+
+
+def legacy_scan(status_code: int, text: str) -> None:
+    """the string checks the login response used to go through before ptc_response existed"""
+    if status_code == 403 or "Request unsuccessful. Incapsula" in text:
+        ptc_utils.get_imperva_error_code(text)
+        return
+
+    matches = re.search(r"pokemongo://state=(.*?)(?:,code=(.*?))?(?='|$)", text)
+    if matches and matches.group(2):
+        return
+
+    if "error-message" in text:
+        for message in (
+            ptc_response.INCORRECT_CREDENTIALS,
+            ptc_response.ACCOUNT_DISABLED,
+            ptc_response.ACCOUNT_BANNED,
+        ):
+            if message in text:
+                return
+        return
+
+    re.compile(r'name="_csrf" value="(.*?)">').search(text)
+    re.compile(r'name="challenge" value="(.*?)">').search(text)
+
+
+def load_fixtures() -> dict[str, tuple[dict, str]]:
+    with open(os.path.join(FIXTURES, "expected.json")) as f:
+        expected = json.load(f)
+
+    fixtures = {}
+    for name, expectation in expected.items():
+        with open(os.path.join(FIXTURES, name)) as f:
+            fixtures[name] = (expectation, f.read())
+    return fixtures
+
+
+def check(name: str, expectation: dict, result: ptc_response.PtcResponse) -> list[str]:
+    errors = []
+    if type(result).__name__ != expectation["type"]:
+        errors.append(f"{name}: expected {expectation['type']}, got {type(result).__name__}")
+    for key in ("code", "reason"):
+        if key not in expectation:
+            continue
+        value = getattr(result, key, None)
+        value = value.name if isinstance(value, ptc_response.ErrorReason) else value
+        if value != expectation[key]:
+            errors.append(f"{name}: expected {key}={expectation[key]}, got {value}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks ptc_response against the fixture corpus and times it")
+    parser.add_argument("--number", type=int, default=2000, help="classifications per fixture")
+    args, _ = parser.parse_known_args()
+
+    report = {"fixtures": {}, "errors": []}
+    total_new = total_legacy = 0.0
+    for name, (expectation, text) in load_fixtures().items():
+        status_code = expectation["status_code"]
+        report["errors"] += check(name, expectation, ptc_response.classify(status_code, text))
+
+        new = timeit.timeit(lambda: ptc_response.classify(status_code, text), number=args.number) / args.number
+        legacy = timeit.timeit(lambda: legacy_scan(status_code, text), number=args.number) / args.number
+        total_new += new
+        total_legacy += legacy
+        report["fixtures"][name] = {"bytes": len(text), "classify_us": new * 1e6, "legacy_us": legacy * 1e6}
+
+    report["total_classify_us"] = total_new * 1e6
+    report["total_legacy_us"] = total_legacy * 1e6
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
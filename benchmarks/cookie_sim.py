@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from loguru import logger
+
+from xilriws.browser import BrowserAuth, FlightRecorder
+from xilriws.constants import AUTH_TIMEOUT, COOKIE_STORAGE_MAX, COOKIE_STORAGE_MIN, MAX_USES
+from xilriws.deadline import Deadline
+from xilriws.proxy import ProxyDistributor
+from xilriws.proxy_dispenser import ProxyDispenser
+from xilriws.ptc_auth import PtcAuth
+from xilriws.reese_cookie import CookieMonster, ReeseCookie
+
+from . import fake_browser, virtual_time
+from .auth_bench import summarize
+from .proxy_bench import proxy_lines
+
+# how often the pool is looked at for the report, in simulated seconds
+SAMPLE_INTERVAL = 10
+
+
+def poisson_arrivals(rate: float, seconds: float, rng: random.Random) -> list[float]:
+    """seconds since the start at which requests arrive, rate per second on average"""
+    arrivals = []
+    now = rng.expovariate(rate)
+    while now < seconds:
+        arrivals.append(now)
+        now += rng.expovariate(rate)
+    return arrivals
+
+
+def read_trace(path: str) -> list[float]:
+    """one arrival per line, in seconds since the start of the trace"""
+    with open(path, "r") as f:
+        arrivals = sorted(float(line) for line in f if line.strip())
+    return [arrival - arrivals[0] for arrival in arrivals]
+
+
+async def request(ptc_auth: PtcAuth, timeout: float, auth_seconds: float) -> tuple[str, float]:
+    """
+    lease a cookie through PtcAuth's fair queue, like an auth attempt does, and keep it for as long as a login takes.
+    returns the status and the wait
+    """
+    start = time.monotonic()
+    try:
+        cookie = await ptc_auth.lease_cookie(Deadline(timeout))
+    except asyncio.TimeoutError:
+        return "TIMEOUT", time.monotonic() - start
+
+    waited = time.monotonic() - start
+    try:
+        await asyncio.sleep(auth_seconds)
+    finally:
+        ptc_auth.cookie_monster.return_cookie(cookie)
+    return "SUCCESS", waited
+
+
+async def simulate(args: argparse.Namespace, arrivals: list[float], proxy_list: str) -> dict:
+    recorder = FlightRecorder(size=sys.maxsize)
+    drivers = [fake_browser.FakeBrowser(fake_browser.config_from_args(args)) for _ in range(args.browsers)]
+    browsers = [BrowserAuth(driver, ProxyDistributor(), recorder=recorder) for driver in drivers]
+    proxy_dispenser = ProxyDispenser(proxy_list)
+    cookie_monster = CookieMonster(browsers, proxy_dispenser, args.storage_min, args.storage_max)
+    ptc_auth = PtcAuth(cookie_monster)
+
+    retired = 0
+    unused_uses = 0
+
+    def on_retire(cookie: ReeseCookie) -> None:
+        nonlocal retired, unused_uses
+        retired += 1
+        unused_uses += max(0, cookie.remaining_uses)
+
+    cookie_monster.add_retire_listener(on_retire)
+    await cookie_monster.prepare()
+
+    samples: list[tuple[int, int, int]] = []
+
+    async def sample() -> None:
+        while True:
+            samples.append((len(cookie_monster.cookies), cookie_monster.storage_target, cookie_monster.cookies.waiting))
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    sampler = asyncio.create_task(sample())
+
+    start = time.monotonic()
+    tasks = []
+    for arrival in arrivals:
+        delay = start + arrival - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request(ptc_auth, args.auth_timeout, args.auth_seconds)))
+    results = await asyncio.gather(*tasks)
+    simulated = time.monotonic() - start
+    sampler.cancel()
+
+    now = time.time()
+    is_bad = drivers[0].is_bad
+    statuses = Counter(status for status, _ in results)
+    sessions: Counter[str | None] = Counter()
+    for driver in drivers:
+        sessions.update(driver.sessions)
+    return {
+        "simulated_hours": simulated / 3600,
+        "requests": len(results),
+        "statuses": dict(statuses),
+        "cookie_wait_ms": summarize([waited for status, waited in results if status == "SUCCESS"]),
+        "cookies_acquired": sum(driver.acquired for driver in drivers),
+        "cookies_retired": retired,
+        "unused_cookie_uses": unused_uses,
+        "cookie_use_efficiency": 1 - unused_uses / (retired * MAX_USES) if retired else None,
+        "browser_starts": sum(driver.starts for driver in drivers),
+        "seconds_per_cookie": cookie_monster.seconds_per_cookie,
+        "storage": {
+            "mean_size": sum(size for size, _, _ in samples) / len(samples),
+            "mean_target": sum(target for _, target, _ in samples) / len(samples),
+            "max_waiting": max(waiting for _, _, waiting in samples),
+        },
+        "proxies": {
+            "listed": len(proxy_dispenser.proxies),
+            "used": len(sessions),
+            "bad_used": sum(1 for proxy in proxy_dispenser.proxies if proxy.full_url in sessions and is_bad(proxy)),
+            "most_sessions": max(sessions.values(), default=0),
+            "rate_limited_at_end": sum(1 for proxy in proxy_dispenser.proxies if not proxy.is_good(now)),
+        },
+        "acquisitions": recorder.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays hours of auth traffic through CookieMonster and ProxyDispenser with fake browsers, "
+        "in virtual time"
+    )
+    parser.add_argument("--hours", type=float, default=6)
+    parser.add_argument("--rate", type=float, default=0.5, help="auth requests per second")
+    parser.add_argument("--trace", default=None, help="file with the arrival time of a request (seconds) per line")
+    parser.add_argument("--browsers", type=int, default=2)
+    parser.add_argument("--proxies", type=int, default=500)
+    parser.add_argument("--auth-seconds", type=float, default=3, help="seconds a login keeps its cookie")
+    parser.add_argument("--auth-timeout", type=float, default=AUTH_TIMEOUT)
+    parser.add_argument("--storage-min", type=int, default=COOKIE_STORAGE_MIN)
+    parser.add_argument("--storage-max", type=int, default=COOKIE_STORAGE_MAX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="CRITICAL")
+    fake_browser.add_arguments(parser)
+    parser.set_defaults(
+        cookie_latency=8,
+        cookie_jitter=3,
+        browser_start=2,
+        login_error_rate=0.05,
+        proxy_error_rate=0.02,
+        bad_proxies=0.05,
+    )
+    args, _ = parser.parse_known_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    if args.trace:
+        arrivals = read_trace(args.trace)
+    else:
+        arrivals = poisson_arrivals(args.rate, args.hours * 3600, random.Random(args.seed))
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("\n".join(proxy_lines(args.proxies)) + "\n")
+    try:
+        start = time.perf_counter()
+        report = virtual_time.run(simulate(args, arrivals, f.name))
+        real = time.perf_counter() - start
+    finally:
+        os.unlink(f.name)
+
+    report = {
+        "real_seconds": real,
+        "speedup": report["simulated_hours"] * 3600 / real if real else None,
+        **report,
+        "config": {key: value for key, value in vars(args).items() if key != "log_level"},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import random
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import ContextManager
+
+from xilriws.browser.browser import ProxyException
+from xilriws.browser.flight_recorder import Acquisition
+from xilriws.proxy import Proxy
+from xilriws.ptc_auth import LoginException
+
+
+@dataclass
+class FakeBrowserConfig:
+    latency: float = 0.5
+    jitter: float = 0.0
+    start_latency: float = 0.0
+    login_error_rate: float = 0.0
+    proxy_error_rate: float = 0.0
+    bad_proxies: float = 0.0
+    crash_rate: float = 0.0
+    proxy_timeout: float = 20.0
+    seed: int | None = None
+
+
+class FakeBrowser:
+    """
+    Stands in for ChromeDriver behind BrowserAuth: gets cookies after a delay, without Chrome and PTC.
+    A third of the latency is spent loading the page, the rest on the JS check. Sessions fail like they do in
+    Chrome: Imperva turning the proxy away (LoginException, the proxy is rate limited), pages that don't load
+    through the proxy (ProxyException after proxy_timeout) and crashes. Some proxies can be bad, their pages never
+    load. With a seed, every browser rolls the same failures in the same order.
+    """
+
+    __ids = itertools.count()
+
+    def __init__(self, config: FakeBrowserConfig):
+        self.config = config
+        self.browser_id = f"fake-{next(self.__ids)}"
+        self.random = random.Random(f"{config.seed}:{self.browser_id}" if config.seed is not None else None)
+        self.consecutive_failures = 0
+        self.acquisition: Acquisition | None = None
+        self.running = False
+        self.starts = 0
+        self.acquired = 0
+        self.sessions: Counter[str | None] = Counter()
+        """sessions by proxy url"""
+
+    async def start_browser(self) -> None:
+        if self.running:
+            return
+        await self.__delay(self.config.start_latency)
+        self.running = True
+        self.starts += 1
+
+    async def load_cookies(self, proxy: Proxy, proxy_changed: bool) -> dict[str, str]:
+        self.sessions[proxy.full_url] += 1
+
+        with self.phase("page_load"):
+            if self.is_bad(proxy) or self.__roll(self.config.proxy_error_rate):
+                await asyncio.sleep(self.config.proxy_timeout)
+                raise ProxyException(f"Page timed out (Proxy: {proxy.url})")
+            await self.__delay(self.config.latency / 3)
+
+        if self.__roll(self.config.crash_rate):
+            raise RuntimeError("fake browser crashed")
+        if self.__roll(self.config.login_error_rate):
+            proxy.rate_limited()
+            raise LoginException(f"Error code 16 (Request blocked) with (Proxy: {proxy.url})")
+
+        with self.phase("js_check"):
+            await self.__delay(self.config.latency * 2 / 3)
+
+        self.acquired += 1
+        return {"reese84": f"fake-reese-{self.browser_id}-{self.acquired}"}
+
+    async def close_context(self) -> None:
+        pass
+
+    async def stop_browser(self) -> None:
+        self.running = False
+
+    def phase(self, name: str) -> ContextManager[None]:
+        if self.acquisition is None:
+            return nullcontext()
+        return self.acquisition.phase(name)
+
+    def is_bad(self, proxy: Proxy) -> bool:
+        """whether pages never load through the proxy, the same for every browser"""
+        if not self.config.bad_proxies:
+            return False
+        return random.Random(f"{self.config.seed}:{proxy.full_url}").random() < self.config.bad_proxies
+
+    async def __delay(self, seconds: float) -> None:
+        delay = seconds + self.random.uniform(-self.config.jitter, self.config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __roll(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """the seed is the --seed of the benchmark"""
+    group = parser.add_argument_group("fake browser")
+    group.add_argument("--cookie-latency", type=float, default=0.5, help="seconds to get a cookie")
+    group.add_argument("--cookie-jitter", type=float, default=0.0, help="+/- seconds added to the latencies")
+    group.add_argument("--browser-start", type=float, default=0.0, help="seconds to start a browser")
+    group.add_argument(
+        "--login-error-rate", type=float, default=0.0, help="share of sessions Imperva blocks, rate limiting the proxy"
+    )
+    group.add_argument("--proxy-error-rate", type=float, default=0.0, help="share of sessions whose page doesn't load")
+    group.add_argument("--bad-proxies", type=float, default=0.0, help="share of proxies that never load a page")
+    group.add_argument("--crash-rate", type=float, default=0.0, help="share of sessions the browser crashes in")
+    group.add_argument("--proxy-timeout", type=float, default=20.0, help="seconds until a page that doesn't load fails")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeBrowserConfig:
+    return FakeBrowserConfig(
+        latency=args.cookie_latency,
+        jitter=args.cookie_jitter,
+        start_latency=args.browser_start,
+        login_error_rate=args.login_error_rate,
+        proxy_error_rate=args.proxy_error_rate,
+        bad_proxies=args.bad_proxies,
+        crash_rate=args.crash_rate,
+        proxy_timeout=args.proxy_timeout,
+        seed=args.seed,
+    )
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import random
+import secrets
+from dataclasses import dataclass
+
+import uvicorn
+from litestar import Litestar, MediaType, Request, Response, get, post
+
+logging.getLogger("uvicorn").setLevel(logging.CRITICAL)
+logging.getLogger("uvicorn.access").setLevel(logging.CRITICAL)
+logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+
+OAUTH_PAGE = """<html><body>
+<form method="post" action="/login">
+<input type="hidden" name="_csrf" value="{csrf}">
+<input type="hidden" name="challenge" value="{challenge}">
+<input type="text" name="email"><input type="password" name="password">
+<button type="submit">Log In</button>
+</form>
+</body></html>"""
+
+CONSENT_PAGE = """<html><body>
+<form method="post" action="/consent">
+<input type="hidden" name="_csrf" value="{csrf}">
+<input type="hidden" name="challenge" value="{challenge}">
+<button type="submit" name="allow_submit" value="Allow">Allow</button>
+</form>
+</body></html>"""
+
+CODE_PAGE = """<html><head>
+<script>window.location.href = 'pokemongo://state={state},code={code}'</script>
+</head><body></body></html>"""
+
+ERROR_PAGE = """<html><body>
+<div class="error-message">Your username or password is incorrect.</div>
+</body></html>"""
+
+IMPERVA_PAGE = """<html><body>Request unsuccessful. Incapsula incident ID: 0-{incident}
+<iframe id="main-iframe" src="/_Incapsula_Resource?CWUDNSAI=9&xinfo=0-0-0&incident_id=0-{incident}&edet={code}&cinfo=04000000">
+</iframe></body></html>"""
+
+
+@dataclass
+class FakePtcConfig:
+    latency: float = 0.05
+    jitter: float = 0.02
+    consent_rate: float = 0.5
+    error_rate: float = 0.0
+    imperva_rate: float = 0.0
+    banned_rate: float = 0.0
+    imperva_code: str = "15"
+    seed: int | None = None
+
+
+class FakePtc:
+    """Local stand-in for the access.pokemon.com OAUTH -> LOGIN -> CONSENT flow"""
+
+    def __init__(self, config: FakePtcConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.requests: dict[str, int] = {"oauth": 0, "login": 0, "consent": 0}
+        self.clients: set[tuple[str, int]] = set()
+
+    @property
+    def connections(self) -> int:
+        return len(self.clients)
+
+    async def __delay(self) -> None:
+        delay = self.config.latency + self.random.uniform(-self.config.jitter, self.config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __roll(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+    def __html(self, content: str, status_code: int = 200) -> Response[str]:
+        return Response(content, media_type=MediaType.HTML, status_code=status_code)
+
+    def __imperva(self) -> Response[str]:
+        return self.__html(
+            IMPERVA_PAGE.format(incident=self.random.randrange(10**9), code=self.config.imperva_code),
+            status_code=403,
+        )
+
+    def __form(self, template: str) -> Response[str]:
+        return self.__html(template.format(csrf=secrets.token_hex(16), challenge=secrets.token_hex(16)))
+
+    def __code(self) -> Response[str]:
+        return self.__html(CODE_PAGE.format(state=secrets.token_hex(8), code=secrets.token_urlsafe(24)))
+
+    def get_litestar(self) -> Litestar:
+        @get("/oauth2/auth")
+        async def oauth_endpoint(request: Request) -> Response[str]:
+            self.requests["oauth"] += 1
+            self.clients.add(tuple(request.scope["client"]))
+            await self.__delay()
+            if self.__roll(self.config.imperva_rate):
+                return self.__imperva()
+            return self.__form(OAUTH_PAGE)
+
+        @post("/login")
+        async def login_endpoint(request: Request) -> Response[str]:
+            self.requests["login"] += 1
+            self.clients.add(tuple(request.scope["client"]))
+            await self.__delay()
+            if self.__roll(self.config.imperva_rate):
+                return self.__imperva()
+            if self.__roll(self.config.banned_rate):
+                return self.__html("", status_code=418)
+            if self.__roll(self.config.error_rate):
+                return self.__html(ERROR_PAGE)
+            if self.__roll(self.config.consent_rate):
+                return self.__form(CONSENT_PAGE)
+            return self.__code()
+
+        @post("/consent")
+        async def consent_endpoint(request: Request) -> Response[str]:
+            self.requests["consent"] += 1
+            self.clients.add(tuple(request.scope["client"]))
+            await self.__delay()
+            if self.__roll(self.config.imperva_rate):
+                return self.__imperva()
+            return self.__code()
+
+        return Litestar(route_handlers=[oauth_endpoint, login_endpoint, consent_endpoint])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("fake PTC server")
+    group.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    group.add_argument("--jitter", type=float, default=0.02, help="+/- seconds added to the latency")
+    group.add_argument("--consent-rate", type=float, default=0.5, help="share of logins that need a consent")
+    group.add_argument("--error-rate", type=float, default=0.0, help="share of logins that get an error page")
+    group.add_argument("--imperva-rate", type=float, default=0.0, help="share of responses that are a 403 block")
+    group.add_argument("--banned-rate", type=float, default=0.0, help="share of logins that get a 418")
+    group.add_argument("--imperva-code", default="15", help="edet code on 403 pages")
+    group.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> FakePtcConfig:
+    return FakePtcConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        consent_rate=args.consent_rate,
+        error_rate=args.error_rate,
+        imperva_rate=args.imperva_rate,
+        banned_rate=args.banned_rate,
+        imperva_code=args.imperva_code,
+        seed=args.seed,
+    )
+
+
+async def serve(fake_ptc: FakePtc, host: str, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(
+        uvicorn.Config(fake_ptc.get_litestar(), host=host, port=port, log_config=None, access_log=False)
+    )
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the PTC login flow")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5091)
+    add_arguments(parser)
+    args, _ = parser.parse_known_args()
+
+    app = FakePtc(config_from_args(args)).get_litestar()
+    server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_config=None, access_log=False))
+    print(f"Fake PTC on http://{args.host}:{args.port}/oauth2/auth")
+    await server.serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+import threading
+
+from fakeredis import TcpFakeServer
+
+
+def serve(host: str = "127.0.0.1") -> tuple[TcpFakeServer, str]:
+    """
+    start a local stand-in that speaks the redis protocol and runs lua scripts (needs fakeredis[lua]) on a free port.
+    returns the server, stop it with server.shutdown(), and its url
+    """
+    server = TcpFakeServer((host, 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://{host}:{server.server_address[1]}/0"
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+from xilriws.proxy import Proxy
+from xilriws.proxy_dispenser import ProxyDispenser
+
+
+class LegacyProxy:
+    """how proxies were stored before they were slotted: the parsed url and all its parts"""
+
+    def __init__(self, url: str):
+        if "://" not in url:
+            url = "http://" + url
+        self.full_url = urlparse(url)
+        self.host = self.full_url.hostname
+        self.port = self.full_url.port
+        self.scheme = self.full_url.scheme
+        self.username = self.full_url.username
+        self.password = self.full_url.password
+        self.last_limited: float = 0
+        self.invalidated: bool = False
+
+
+def proxy_lines(count: int, offset: int = 0) -> list[str]:
+    return [
+        f"user{index}:password{index}@10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}:{8000 + index % 1000}"
+        for index in range(offset, offset + count)
+    ]
+
+
+def write_list(path: str, lines: list[str]) -> None:
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    # the dispenser notices changes by mtime and size, make sure a rewrite within the same tick counts
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def measure_memory(function) -> tuple[object, int]:
+    tracemalloc.start()
+    try:
+        result = function()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def timed(function) -> float:
+    """milliseconds"""
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+async def time_dispense(dispenser: ProxyDispenser, calls: int, taken: set[Proxy]) -> float:
+    """microseconds per get_auth_proxy"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        await dispenser.get_auth_proxy(taken)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures loading, reloading and using a large proxy list")
+    parser.add_argument("--proxies", type=int, default=100_000)
+    parser.add_argument("--changed", type=float, default=0.01, help="share of the list replaced for the reload")
+    parser.add_argument("--limited", type=float, default=0.5, help="share of the proxies that are rate limited")
+    parser.add_argument("--calls", type=int, default=10_000)
+    args, _ = parser.parse_known_args()
+
+    lines = proxy_lines(args.proxies)
+    report: dict[str, object] = {"proxies": args.proxies}
+
+    legacy, legacy_bytes = measure_memory(lambda: [LegacyProxy(line) for line in lines])
+    del legacy
+    slotted, slotted_bytes = measure_memory(lambda: [Proxy(line) for line in lines])
+    del slotted
+    report["legacy_bytes_per_proxy"] = legacy_bytes / args.proxies
+    report["bytes_per_proxy"] = slotted_bytes / args.proxies
+    report["legacy_parse_ms"] = timed(lambda: [LegacyProxy(line) for line in lines])
+    report["parse_ms"] = timed(lambda: [Proxy(line) for line in lines])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "proxies.txt")
+        write_list(path, lines)
+
+        dispenser, dispenser_bytes = measure_memory(lambda: ProxyDispenser(path))
+        report["dispenser_mb"] = dispenser_bytes / 1024 / 1024
+        report["load_ms"] = timed(lambda: ProxyDispenser(path))
+
+        limited = int(args.proxies * args.limited)
+        for proxy in dispenser.proxies[:limited]:
+            proxy.rate_limited()
+        report["dispense_us"] = asyncio.run(time_dispense(dispenser, args.calls, set()))
+
+        report["unchanged_check_ms"] = timed(dispenser.reload)
+
+        write_list(path, lines)
+        report["touched_reload_ms"] = timed(dispenser.reload)
+
+        changed = int(args.proxies * args.changed)
+        write_list(path, lines[changed:] + proxy_lines(changed, offset=args.proxies))
+        report["changed_reload_ms"] = timed(dispenser.reload)
+        report["cooldowns_kept"] = sum(1 for proxy in dispenser.proxies if proxy.last_limited) == limited - changed
+        report["dispense_after_reload_us"] = asyncio.run(time_dispense(dispenser, args.calls, set()))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from loguru import logger
+
+from xilriws.constants import MAX_USES
+from xilriws.cookie_store import RedisCookieStore, SharedCookieStore, SqliteCookieStore
+from xilriws.proxy_dispenser import ProxyDispenser
+from xilriws.reese_cookie import ReeseCookie
+
+from . import fake_redis
+from .proxy_bench import proxy_lines
+
+
+async def lease_all(store: SharedCookieStore, counts: Counter[str], timeout: float) -> None:
+    """lease and release until the store has nothing left for timeout seconds"""
+    while True:
+        try:
+            cookie = await asyncio.wait_for(store.lease(), timeout)
+        except asyncio.TimeoutError:
+            return
+        counts[cookie.cookies["reese84"]] += 1
+        await asyncio.sleep(0)
+        store.release(cookie)
+
+
+async def run(args: argparse.Namespace, stores: list[SharedCookieStore], proxy_dispenser: ProxyDispenser) -> dict:
+    for store in stores:
+        await store.prepare()
+
+    # the first instance adds all cookies, the others only see them through the store
+    for index in range(args.cookies):
+        proxy = proxy_dispenser.proxies[index % len(proxy_dispenser.proxies)]
+        await stores[0].add(ReeseCookie({"reese84": f"cookie-{index}"}, proxy))
+
+    counts: Counter[str] = Counter()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(lease_all(store, counts, args.idle_timeout) for store in stores for _ in range(args.concurrency))
+    )
+    duration = time.perf_counter() - start - args.idle_timeout
+
+    leases = sum(counts.values())
+    return {
+        "store": args.store,
+        "instances": args.instances,
+        "cookies": args.cookies,
+        "leases": leases,
+        "expected_leases": args.cookies * MAX_USES,
+        "over_leased": sum(max(0, count - MAX_USES) for count in counts.values()),
+        "leases_per_s": leases / duration if duration > 0 else None,
+        "config": {key: value for key, value in vars(args).items() if key != "log_level"},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Several instances lease from one shared cookie store at once, checking no use is counted twice"
+    )
+    parser.add_argument("--store", choices=("sqlite", "redis"), default="redis")
+    parser.add_argument("--redis-url", default=None, help="use a running server instead of a fakeredis stand-in")
+    parser.add_argument("--instances", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent leases per instance")
+    parser.add_argument("--cookies", type=int, default=50)
+    parser.add_argument("--idle-timeout", type=float, default=1, help="seconds without a lease until an instance stops")
+    parser.add_argument("--log-level", default="CRITICAL")
+    args, _ = parser.parse_known_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("\n".join(proxy_lines(10)) + "\n")
+    try:
+        proxy_dispenser = ProxyDispenser(f.name)
+    finally:
+        os.unlink(f.name)
+
+    store_dir = tempfile.mkdtemp(prefix="xilriws-bench-")
+    redis_server = None
+    try:
+        if args.store == "sqlite":
+            stores = [
+                SqliteCookieStore(os.path.join(store_dir, "cookies.db"), proxy_dispenser)
+                for _ in range(args.instances)
+            ]
+            report = await run(args, stores, proxy_dispenser)
+        else:
+            if not args.redis_url:
+                redis_server, args.redis_url = fake_redis.serve()
+            prefix = f"xilriws-bench-{os.getpid()}"
+            stores = [RedisCookieStore(args.redis_url, proxy_dispenser, prefix=prefix) for _ in range(args.instances)]
+            report = await run(args, stores, proxy_dispenser)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        if redis_server:
+            redis_server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if report["over_leased"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
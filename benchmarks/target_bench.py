@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+from loguru import logger
+
+from xilriws.constants import COOKIE_STORAGE_MAX, COOKIE_STORAGE_MIN, MAX_USES
+from xilriws.cookie_store import CookieStore, RedisCookieStore, SharedCookieStore, SqliteCookieStore
+from xilriws.deadline import Deadline
+from xilriws.proxy_dispenser import ProxyDispenser
+from xilriws.ptc_auth import PtcAuth
+from xilriws.reese_cookie import CookieMonster
+
+from . import fake_redis
+from .proxy_bench import proxy_lines
+
+
+async def run(
+    args: argparse.Namespace,
+    proxy_dispenser: ProxyDispenser,
+    store: CookieStore | None,
+    other: SharedCookieStore | None,
+) -> dict:
+    cookie_monster = CookieMonster([], proxy_dispenser, args.storage_min, args.storage_max, store=store)
+    ptc_auth = PtcAuth(cookie_monster)
+    await cookie_monster.prepare()
+    if other is not None:
+        await other.prepare()
+
+    # there are no cookies, so one request leases and the others queue for their turn behind it
+    deadline = Deadline(60)
+    tasks = [
+        asyncio.create_task(ptc_auth.lease_cookie(deadline, f"client-{index % args.clients}"))
+        for index in range(args.requests)
+    ]
+    await asyncio.sleep(0.1)
+
+    report = {
+        "store": args.store,
+        "requests": args.requests,
+        "queued": ptc_auth.fair_queue.waiting,
+        "waiting": cookie_monster.cookies.waiting,
+        "storage_target": cookie_monster.storage_target,
+        "expected_target": min(args.storage_max, max(args.storage_min, math.ceil((args.requests + 1) / MAX_USES))),
+    }
+    if other is not None:
+        # the first instance reports its waiting requests, the other one reads them
+        await cookie_monster.cookies.sweep()
+        await other.sweep()
+        report["waiting_seen_by_other"] = other.waiting
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    report["config"] = {key: value for key, value in vars(args).items() if key != "log_level"}
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Many requests queue for a cookie at once, checking the storage target and waiting count them"
+    )
+    parser.add_argument("--store", choices=("memory", "sqlite", "redis"), default="memory")
+    parser.add_argument("--redis-url", default=None, help="use a running server instead of a fakeredis stand-in")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=4, help="clients the requests come from")
+    parser.add_argument("--storage-min", type=int, default=COOKIE_STORAGE_MIN)
+    parser.add_argument("--storage-max", type=int, default=COOKIE_STORAGE_MAX)
+    parser.add_argument("--log-level", default="CRITICAL")
+    args, _ = parser.parse_known_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("\n".join(proxy_lines(10)) + "\n")
+    try:
+        proxy_dispenser = ProxyDispenser(f.name)
+    finally:
+        os.unlink(f.name)
+
+    store_dir = tempfile.mkdtemp(prefix="xilriws-bench-")
+    redis_server = None
+    try:
+        if args.store == "memory":
+            report = await run(args, proxy_dispenser, None, None)
+        elif args.store == "sqlite":
+            path = os.path.join(store_dir, "cookies.db")
+            stores = [SqliteCookieStore(path, proxy_dispenser) for _ in range(2)]
+            report = await run(args, proxy_dispenser, *stores)
+        else:
+            if not args.redis_url:
+                redis_server, args.redis_url = fake_redis.serve()
+            prefix = f"xilriws-bench-{os.getpid()}"
+            stores = [RedisCookieStore(args.redis_url, proxy_dispenser, prefix=prefix) for _ in range(2)]
+            report = await run(args, proxy_dispenser, *stores)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        if redis_server:
+            redis_server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if (
+        report["waiting"] < args.requests
+        or report["storage_target"] < report["expected_target"]
+        or report.get("waiting_seen_by_other", args.requests) < args.requests
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
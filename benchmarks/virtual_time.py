@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import selectors
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Coroutine, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class VirtualClock:
+    """time that only moves on when the event loop has nothing left to do until its next timer"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.epoch = time.time()
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.epoch + self.now
+
+
+class _VirtualSelector:
+    """
+    polls the real selector without blocking. if nothing happened, the loop would sleep until its next timer,
+    the clock skips ahead to it instead
+    """
+
+    def __init__(self, selector: selectors.BaseSelector, clock: VirtualClock):
+        self.selector = selector
+        self.clock = clock
+
+    def select(self, timeout: float | None = None) -> list:
+        events = self.selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # no timers left, only real I/O (like the executor shutting down) can wake the loop
+            return self.selector.select(None)
+        self.clock.now += timeout
+        return []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        super().__init__(_VirtualSelector(selectors.DefaultSelector(), clock))
+
+    def time(self) -> float:
+        return self.clock.now
+
+    def run_in_executor(self, executor: Any, func: Callable[..., T], *args: Any) -> asyncio.Future[T]:
+        """
+        runs func right away instead of in a thread. a thread would take real time, which the clock could skip past
+        while waiting, and the results would depend on how fast the machine is
+        """
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+@contextmanager
+def patched_time(clock: VirtualClock) -> Iterator[None]:
+    """time.time, time.monotonic and time.perf_counter follow the clock, for everything that reads them"""
+    originals = time.time, time.monotonic, time.perf_counter
+    time.time = clock.time
+    time.monotonic = clock.monotonic
+    time.perf_counter = clock.monotonic
+    try:
+        yield
+    finally:
+        time.time, time.monotonic, time.perf_counter = originals
+
+
+def run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    run coroutine in virtual time: sleeps and timeouts take no real time, as long as nothing waits for real I/O.
+    the clock starts at the current time
+    """
+    clock = VirtualClock()
+    with patched_time(clock):
+        loop = VirtualTimeLoop(clock)
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            try:
+                _cancel_all_tasks(loop)
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
+
+def _cancel_all_tasks(loop: asyncio.AbstractEventLoop) -> None:
+    """like asyncio.run does on the way out, the background tasks of the simulation are still running"""
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
@@ -1,4 +1,4 @@
-const ws = new WebSocket('ws://127.0.0.1:9091');
+const ws = new WebSocket(XILRIWS_WS_URL);
 
 let currentProxyCreds = {
     "username": null,
@@ -36,21 +36,22 @@ ws.onmessage = (event) => {
     const message = JSON.parse(event.data)
     const action = message.action
     const data = message.data
+    const id = message.id
 
     if (action === 'setProxy') {
         currentProxyCreds = {
             username: data.username,
             password: data.password
         }
-        startProxy(data.host, data.port, data.scheme)
+        startProxy(data.host, data.port, data.scheme, id)
     }
 }
 
-function sendWs(action, detail = null) {
-    ws.send(JSON.stringify({action: action, detail: detail}))
+function sendWs(action, detail = null, id = null) {
+    ws.send(JSON.stringify({action: action, detail: detail, id: id}))
 }
 
-function startProxy(host, port, scheme) {
+function startProxy(host, port, scheme, id) {
     const proxyConfig = {
         mode: 'fixed_servers',
         rules: {
@@ -65,7 +66,7 @@ function startProxy(host, port, scheme) {
     chrome.proxy.settings.set(
         {value: proxyConfig},
         () => {
-            sendWs('finish:setProxy', host + ':' + port)
+            sendWs('finish:setProxy', host + ':' + port, id)
         },
     )
 }
@@ -0,0 +1 @@
+const XILRIWS_WS_URL = 'ws://127.0.0.1:9091'
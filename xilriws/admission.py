@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import math
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator
+
+from loguru import logger
+from prometheus_client import Counter, Gauge
+
+from .constants import AUTH_TIMEOUT, MAX_USES
+
+if TYPE_CHECKING:
+    from .reese_cookie import CookieMonster
+
+logger = logger.bind(name="Admission")
+
+# bound by AuthMode to its AdmissionControl, there's one per process
+ADMISSION_QUEUE_DEPTH = Gauge("xilriws_admission_queue_depth", "Auth requests that are admitted and not done yet")
+ADMISSION_ESTIMATED_WAIT = Gauge("xilriws_admission_estimated_wait_seconds", "Estimated wait for a cookie")
+ADMISSION_REJECTIONS = Counter(
+    "xilriws_admission_rejections", "Auth requests that were turned away immediately", ("reason",)
+)
+
+QUEUE_FULL = "queue_full"
+TOO_SLOW = "too_slow"
+
+
+class AdmissionRejected(Exception):
+    """the request can't be served in time, tell the client to come back later"""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionControl:
+    """
+    Caps the auth requests in front of PtcAuth.auth. Requests are rejected right away if max_depth requests are
+    admitted already (429), or if the cookie storage can't serve them before max_wait based on how fast the browsers
+    refill it (503). It only counts the admitted requests, the order they get cookies in is up to PtcAuth's FairQueue.
+    """
+
+    def __init__(self, cookie_monster: CookieMonster, max_depth: int, max_wait: float = AUTH_TIMEOUT):
+        self.cookie_monster = cookie_monster
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self.depth = 0
+
+    def estimate_wait(self) -> float:
+        """seconds until one more request would get a cookie. 0 if there's no refill rate to go by yet"""
+        cookies = self.cookie_monster.cookies
+        # admitted requests that don't hold a cookie yet are ahead of this one
+        waiting = max(0, self.depth - cookies.leased)
+        missing_uses = waiting + 1 - cookies.remaining_uses()
+        if missing_uses <= 0:
+            return 0.0
+
+        refill_rate = self.cookie_monster.refill_rate()
+        if not refill_rate:
+            return 0.0
+
+        return missing_uses / (refill_rate * MAX_USES)
+
+    def check(self) -> None:
+        if self.depth >= self.max_depth:
+            self.__reject(429, QUEUE_FULL)
+
+        if self.estimate_wait() > self.max_wait:
+            self.__reject(503, TOO_SLOW)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        self.check()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+
+    def __reject(self, status_code: int, reason: str):
+        retry_after = max(1, math.ceil(self.estimate_wait()))
+        ADMISSION_REJECTIONS.labels(reason=reason).inc()
+        raise AdmissionRejected(status_code, retry_after, reason)
@@ -1,3 +1,6 @@
 from .browser import Browser
-from .browser_auth import BrowserAuth
+from .browser_auth import BrowserAuth, ChromeDriver
 from .browser_join import BrowserJoin, CionResponse
+from .driver import BrowserDriver
+from .flight_recorder import FlightRecorder
+from .resources import RecyclePolicy
@@ -1,39 +1,172 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import os
+import random
 import re
+import shutil
 import sys
-from typing import Callable
+import tempfile
+import time
+from typing import Any, Callable
 
 import zendriver
 from loguru import logger
+from prometheus_client import Counter, Gauge
 
 from xilriws.debug import IS_DEBUG
-from xilriws.extension_comm import ExtensionComm
-from xilriws.proxy import ProxyDistributor
+from xilriws.extension_comm import ExtensionClient, ExtensionComm
+from xilriws.proxy import Proxy
 from xilriws.ptc_auth import LoginException
 from xilriws.ptc.ptc_utils import USER_AGENT
+from xilriws.task_creator import task_creator
+
+from . import fingerprint
+from .resources import RECYCLE_MEMORY, ProcessTreeUsage, RecyclePolicy, find_child_process, read_process_tree
 
 logger = logger.bind(name="Browser")
 HEADLESS = not IS_DEBUG
 
+# the standby browser is launched once the browser is this close to a limit of its RecyclePolicy
+STANDBY_AT = 0.9
+# /proc is read at most this often per browser
+USAGE_INTERVAL = 1
+
+COOKIE_RECHECK = 0.3
+
+# tab: one browser context for everything, the extension purges cookies when a tab is closed
+# context: every acquisition gets a fresh browser context, which is thrown away afterwards
+ISOLATION_TAB = "tab"
+ISOLATION_CONTEXT = "context"
+
+# extensions don't run in browser contexts, so what the proxy extension blocks is blocked through CDP there
+CONTEXT_BLOCKED_URLS = [
+    "*://gstatic.com/*",
+    "*://fonts.googleapis.com/*",
+    "*://optimizationguide-pa.googleapis.com/*",
+    "*://*.launchdarkly.com/*",
+    "*://*.browser-intake-datadoghq.com/*",
+    "*://join.pokemon.com/manifest.json",
+    "*://access.pokemon.com/scripts/login-util.js*",
+    "*://access.pokemon.com/scripts/screen-name-script.js*",
+    "*://access.pokemon.com/scripts/set-state-script.js*",
+    *(f"*://*/*.{extension}*" for extension in ("woff", "ttf", "css", "png", "jpg", "jpeg", "svg", "ico")),
+]
+
+
+# default: chrome as it comes, apart from the features that are disabled for every browser
+# lean: fewer processes, no gpu and the profile on tmpfs, for nodes that run many browsers
+PROFILE_DEFAULT = "default"
+PROFILE_LEAN = "lean"
+
+LEAN_PROFILE_DIR = "/dev/shm"
+LEAN_ARGS = [
+    "--renderer-process-limit=2",
+    "--in-process-gpu",
+    "--disable-gpu",
+    "--disable-gpu-compositing",
+    # webgl is part of the fingerprint, so the software rasterizer that backs it without a gpu stays
+    "--disk-cache-size=4194304",
+    "--media-cache-size=1048576",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-client-side-phishing-detection",
+    "--disable-sync",
+    "--mute-audio",
+]
+# run the network and audio services in the browser process instead of utility processes of their own
+LEAN_ENABLED_FEATURES = ["NetworkServiceInProcess", "NetworkServiceInProcess2"]
+LEAN_DISABLED_FEATURES = ["AudioServiceOutOfProcess", "SpareRendererForSitePerProcess", "PaintHolding"]
+
+BROWSER_RSS = Gauge("xilriws_browser_rss_bytes", "Resident memory of the browser's process tree", ("browser",))
+BROWSER_CPU = Gauge(
+    "xilriws_browser_cpu_seconds", "CPU time the browser's process tree used since it started", ("browser",)
+)
+BROWSER_PROCESSES = Gauge("xilriws_browser_processes", "Processes in the browser's process tree", ("browser",))
+BROWSER_AGE = Gauge("xilriws_browser_age_seconds", "Time since the browser was launched", ("browser",))
+BROWSER_TABS = Gauge("xilriws_browser_tabs", "Open tabs in the browser", ("browser",))
+BROWSER_SESSIONS = Gauge("xilriws_browser_sessions", "Sessions since the browser was launched", ("browser",))
+BROWSER_RECYCLES = Counter("xilriws_browser_recycles", "Planned browser restarts", ("reason",))
+
 
 class ProxyException(Exception):
     pass
 
 
 class Browser:
-    browser: zendriver.Browser | None = None
-    tab: zendriver.Tab | None = None
-    consecutive_failures = 0
-    last_cookies: list[zendriver.cdp.network.CookieParam] | None = None
-    session_count = 0
-    first_run = True
-
-    def __init__(self, extension_paths: list[str], ext_comm: ExtensionComm):
+    __ids = itertools.count()
+
+    def __init__(
+        self,
+        extension_paths: list[str],
+        ext_comm: ExtensionComm,
+        isolation: str = ISOLATION_TAB,
+        recycle_policy: RecyclePolicy | None = None,
+        profile: str = PROFILE_DEFAULT,
+    ):
         self.extension_paths: list[str] = extension_paths
         self.ext_comm = ext_comm
+        self.isolation = isolation
+        self.recycle_policy = recycle_policy or RecyclePolicy()
+        self.profile = profile
+
+        self.browser: zendriver.Browser | None = None
+        self.tab: zendriver.Tab | None = None
+        self.ext_client: ExtensionClient | None = None
+        self.context_id: zendriver.cdp.browser.BrowserContextID | None = None
+        self.home_tab: zendriver.Tab | None = None
+        self.consecutive_failures = 0
+        self.last_cookies: list[zendriver.cdp.network.CookieParam] | None = None
+        self.session_count = 0
+        self.launched_at = time.monotonic()
+        self.first_run = True
+        self.standby: asyncio.Task[tuple[zendriver.Browser, ExtensionClient, zendriver.Tab | None]] | None = None
+        self.fingerprint_script: str | None = None
+        """the fingerprint extension as a script, for browser contexts that run without extensions"""
+        if isolation == ISOLATION_CONTEXT:
+            extension_path = fingerprint.find_extension(extension_paths)
+            if extension_path is None:
+                raise ValueError(
+                    f"browser_isolation {ISOLATION_CONTEXT} needs the {fingerprint.EXTENSION_NAME} extension"
+                )
+            self.fingerprint_script = fingerprint.build_script(extension_path)
+        self.__pid: int | None = None
+        self.__usage: ProcessTreeUsage | None = None
+        self.__usage_read_at = 0.0
+
+        browser_id = str(next(self.__ids))
+        self.browser_id = browser_id
+        BROWSER_RSS.labels(browser=browser_id).set_function(lambda: self.__metric_usage("rss"))
+        BROWSER_CPU.labels(browser=browser_id).set_function(lambda: self.__metric_usage("cpu_seconds"))
+        BROWSER_PROCESSES.labels(browser=browser_id).set_function(lambda: self.__metric_usage("processes"))
+        BROWSER_AGE.labels(browser=browser_id).set_function(lambda: self.age if self.browser else 0)
+        BROWSER_TABS.labels(browser=browser_id).set_function(lambda: self.tab_count)
+        BROWSER_SESSIONS.labels(browser=browser_id).set_function(lambda: self.session_count)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.launched_at
+
+    @property
+    def tab_count(self) -> int:
+        if not self.browser:
+            return 0
+        return len(self.browser.tabs)
+
+    def resource_usage(self) -> ProcessTreeUsage | None:
+        """memory and cpu of the running browser, None if there is none or /proc can't be read"""
+        if not self.browser or not self.__pid:
+            return None
+
+        now = time.monotonic()
+        if now - self.__usage_read_at >= USAGE_INTERVAL:
+            self.__usage = read_process_tree(self.__pid)
+            self.__usage_read_at = now
+        return self.__usage
+
+    def __metric_usage(self, field: str) -> float:
+        usage = self.resource_usage()
+        return getattr(usage, field) if usage else 0
 
     async def start_browser(self):
         if self.consecutive_failures >= 30:
@@ -47,90 +180,173 @@ class Browser:
         if self.browser:
             self.session_count += 1
 
-            if self.session_count % 60 == 0:
-                logger.info("Time for a browser restart")
-                await self.stop_browser()
+            usage = self.resource_usage()
+            progress, reason = self.recycle_policy.usage(
+                sessions=self.session_count,
+                rss=usage.rss if usage else None,
+                age=self.age,
+                tabs=self.tab_count,
+            )
+            if progress >= STANDBY_AT:
+                self.__prepare_standby()
+
+            # over the memory limit, waiting for the standby is better than the browser growing any further
+            if progress >= 1 and (self.standby.done() or reason == RECYCLE_MEMORY):
+                logger.info(f"Time for a browser restart ({reason} limit reached)")
+                BROWSER_RECYCLES.labels(reason=reason).inc()
+                await self.__retire_browser()
             elif not await self.health_check():
                 logger.info("Browser seems stale. Restarting")
-                await self.stop_browser()
+                await self.__retire_browser()
 
         if not self.browser:
-            config = zendriver.Config(headless=HEADLESS, browser_executable_path=self.__find_chrome_executable())
-            config.add_argument(f"--user-agent={USER_AGENT}")
-            if not IS_DEBUG:
-                config.add_argument("--window-size=1,1")
-
-            disabled_features = [
-                "OptimizationHints",
-                "OptimizationHintsFetching",
-                "OptimizationHintsFetchingAnonymousDataConsent",
-                "ContextMenuPerformanceInfoAndRemoteHintFetching",
-                "OptimizationTargetPrediction",
-                "OptimizationGuideModelDownloading",
-                "OptimizationGuidePageContentExtraction",
-                "OptimizationHintsComponent",
-                "OptimizationHintsFetchingSRP",
-                "OptimizationPersonalizedHintsFetching",
-                "OptimizationGuideModelExecution",
-                "Translate",
-                "BackForwardCache",
-                "AcceptCHFrame",
-                "MediaRouter",
-                "DialMediaRouteProvider"
-            ]
-            config.add_argument(f"--disable-features={','.join(disabled_features)}")
-            config.add_argument("--disable-hang-monitor")
-            config.add_argument("--disable-background-networking")
-            config.add_argument("--disable-breakpad")
-            config.add_argument("--disable-default-apps")
-            config.add_argument("--disable-renderer-backgrounding")
-            config.add_argument("--no-first-run")
+            if self.standby:
+                await self.__use_standby()
 
+        if not self.browser:
+            self.browser, self.ext_client, self.tab = await self.__launch()
+            self.__reset_launch_state()
+
+    def __prepare_standby(self) -> None:
+        """launch the browser that takes over on the next restart in the background"""
+        if self.standby is None:
+            logger.info("Preparing a standby browser")
+            self.standby = asyncio.create_task(self.__launch())
+
+    async def __use_standby(self) -> None:
+        """switch to the standby browser. if it failed to launch, there's no browser afterwards"""
+        standby, self.standby = self.standby, None
+        try:
+            self.browser, self.ext_client, self.tab = await standby
+        except Exception as e:
+            logger.warning(f"Standby browser didn't start ({str(e)}), starting a new one")
+            return
 
-            try:
-                for path in self.extension_paths:
-                    config.add_extension(path)
+        logger.info("Switched to the standby browser")
+        self.__reset_launch_state()
 
-                self.browser = await zendriver.start(config)
+    def __reset_launch_state(self) -> None:
+        """a browser was launched or the standby took over, nothing of the previous browser applies anymore"""
+        self.first_run = True
+        self.context_id = None
+        self.home_tab = None
+        self.session_count = 0
+        self.launched_at = time.monotonic()
+        # zendriver keeps the process to itself, every browser has its own profile to tell it apart by
+        self.__pid = find_child_process(f"--user-data-dir={self.browser.config.user_data_dir}")
+        self.__usage = None
+        self.__usage_read_at = 0.0
+
+    async def __retire_browser(self) -> None:
+        """
+        stop the current browser and switch to the standby. if the standby is ready, the restart only costs the
+        shutdown, if it's still launching, that's waited for
+        """
+        if self.standby:
+            browser = self.browser
+            self.browser = None
+            await self.__use_standby()
+            task_creator.create_task(self.__stop(browser))
+        else:
+            await self.stop_browser()
+
+    async def __launch(self) -> tuple[zendriver.Browser, ExtensionClient, zendriver.Tab | None]:
+        config = zendriver.Config(
+            headless=HEADLESS,
+            browser_executable_path=self.__find_chrome_executable(),
+            user_data_dir=self.__lean_profile_dir() if self.profile == PROFILE_LEAN else None,
+        )
+        config.add_argument(f"--user-agent={USER_AGENT}")
+        if not IS_DEBUG:
+            config.add_argument("--window-size=1,1")
+
+        disabled_features = [
+            "OptimizationHints",
+            "OptimizationHintsFetching",
+            "OptimizationHintsFetchingAnonymousDataConsent",
+            "ContextMenuPerformanceInfoAndRemoteHintFetching",
+            "OptimizationTargetPrediction",
+            "OptimizationGuideModelDownloading",
+            "OptimizationGuidePageContentExtraction",
+            "OptimizationHintsComponent",
+            "OptimizationHintsFetchingSRP",
+            "OptimizationPersonalizedHintsFetching",
+            "OptimizationGuideModelExecution",
+            "Translate",
+            "BackForwardCache",
+            "AcceptCHFrame",
+            "MediaRouter",
+            "DialMediaRouteProvider"
+        ]
+        if self.profile == PROFILE_LEAN:
+            for argument in LEAN_ARGS:
+                config.add_argument(argument)
+            config.add_argument(f"--enable-features={','.join(LEAN_ENABLED_FEATURES)}")
+            disabled_features += LEAN_DISABLED_FEATURES
+        config.add_argument(f"--disable-features={','.join(disabled_features)}")
+        config.add_argument("--disable-hang-monitor")
+        config.add_argument("--disable-background-networking")
+        config.add_argument("--disable-breakpad")
+        config.add_argument("--disable-default-apps")
+        config.add_argument("--disable-renderer-backgrounding")
+        config.add_argument("--no-first-run")
+
+        browser: zendriver.Browser | None = None
+        tab: zendriver.Tab | None = None
+        try:
+            for path in self.extension_paths:
+                config.add_extension(path)
+
+            async with self.ext_comm.start_lock:
+                self.ext_comm.discard_unclaimed()
+                browser = await zendriver.start(config)
                 full_command = f"{config.browser_executable_path} {' '.join(config())}"
                 logger.info(f"Starting browser: `{full_command}`")
 
-                if "brave" in self.browser.config.browser_executable_path.lower():
-                    self.tab = await self.browser.get("brave://settings/shields")
-                    await self.__set_setting(
-                        shadow_roots=[
-                            "settings-ui",
-                            "settings-main",
-                            "settings-basic-page",
-                            "settings-default-brave-shields-page",
-                        ],
-                        element_id="fingerprintingSelectControlType",
-                        new_value="allow",
-                        tab=self.tab,
-                    )
-
-                    await self.tab.get("brave://settings/privacy")
-                    await self.__set_setting(
-                        shadow_roots=[
-                            "settings-ui",
-                            "settings-main",
-                            "settings-basic-page",
-                            "settings-privacy-page",
-                            "settings-brave-personalization-options",
-                            "settings-dropdown-menu",
-                        ],
-                        element_id="dropdownMenu",
-                        new_value="disable_non_proxied_udp",
-                        tab=self.tab,
-                    )
-            except Exception as e:
-                full_command = f"{config.browser_executable_path} {' '.join(config())}"
-                logger.error(str(e))
-                logger.error(
-                    f"Error while starting the browser. Please confirm you can start it manually by running "
-                    f"`{full_command}`"
+                ext_client = await self.ext_comm.claim_client()
+
+            if "brave" in browser.config.browser_executable_path.lower():
+                tab = await browser.get("brave://settings/shields")
+                await self.__set_setting(
+                    shadow_roots=[
+                        "settings-ui",
+                        "settings-main",
+                        "settings-basic-page",
+                        "settings-default-brave-shields-page",
+                    ],
+                    element_id="fingerprintingSelectControlType",
+                    new_value="allow",
+                    tab=tab,
+                )
+
+                await tab.get("brave://settings/privacy")
+                await self.__set_setting(
+                    shadow_roots=[
+                        "settings-ui",
+                        "settings-main",
+                        "settings-basic-page",
+                        "settings-privacy-page",
+                        "settings-brave-personalization-options",
+                        "settings-dropdown-menu",
+                    ],
+                    element_id="dropdownMenu",
+                    new_value="disable_non_proxied_udp",
+                    tab=tab,
                 )
-                raise e
+
+            return browser, ext_client, tab
+        except Exception as e:
+            if browser:
+                await self.__stop(browser)
+            elif config.uses_custom_data_dir:
+                shutil.rmtree(config.user_data_dir, ignore_errors=True)
+            full_command = f"{config.browser_executable_path} {' '.join(config())}"
+            logger.error(str(e))
+            logger.error(
+                f"Error while starting the browser. Please confirm you can start it manually by running "
+                f"`{full_command}`"
+            )
+            raise e
 
     async def __set_setting(self, shadow_roots: list[str], element_id: str, new_value: str, tab: zendriver.Tab):
         await tab.wait_for(shadow_roots[0])
@@ -162,28 +378,74 @@ class Browser:
         except Exception:
             return False
 
-    async def get_cookies(self) -> dict[str, str]:
-        reese_value: str | None = None
-        attempts = 10
-        while not reese_value and attempts > 0:
-            attempts -= 1
-
-            cookies = await self.tab.send(zendriver.cdp.network.get_cookies())
-            for cookie in cookies:
-                if cookie.name == "reese84":
-                    logger.info("Got cookies")
-                    reese_value = cookie.value
-                    continue
+    async def get_cookies(self, timeout: float = 3) -> dict[str, str]:
+        # wake up as soon as a response sets the reese cookie. imperva's script may also set it from JS, which
+        # doesn't show up in network events, so it's checked again every COOKIE_RECHECK seconds anyway
+        cookie_set = asyncio.Event()
 
-            if not reese_value:
-                await self.tab.wait(0.3)
-            else:
-                self.last_cookies = cookies
+        def on_response(event: zendriver.cdp.network.ResponseReceivedExtraInfo):
+            for name, value in event.headers.items():
+                if name.lower() == "set-cookie" and "reese84=" in value:
+                    cookie_set.set()
 
-        if not reese_value:
-            raise LoginException("Didn't find reese cookie in browser")
-
-        return {c.name: c.value for c in self.last_cookies}
+        self.tab.add_handler(zendriver.cdp.network.ResponseReceivedExtraInfo, on_response)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                cookies = await self.tab.send(zendriver.cdp.network.get_cookies())
+                if any(cookie.name == "reese84" for cookie in cookies):
+                    logger.info("Got cookies")
+                    self.last_cookies = cookies
+                    return {c.name: c.value for c in cookies}
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise LoginException("Didn't find reese cookie in browser")
+
+                cookie_set.clear()
+                try:
+                    await asyncio.wait_for(cookie_set.wait(), min(remaining, COOKIE_RECHECK))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.tab.remove_handlers(zendriver.cdp.network.ResponseReceivedExtraInfo, on_response)
+
+    async def reload(self, timeout: float = 20) -> None:
+        """reload the tab and wait until the new document is parsed"""
+        loaded = asyncio.get_running_loop().create_future()
+
+        def on_loaded(event: zendriver.cdp.page.DomContentEventFired):
+            if not loaded.done():
+                loaded.set_result(True)
+
+        self.tab.add_handler(zendriver.cdp.page.DomContentEventFired, on_loaded)
+        try:
+            await self.tab.reload()
+            await asyncio.wait_for(loaded, timeout)
+        except asyncio.TimeoutError:
+            logger.debug("Didn't see the reloaded page load, continuing anyway")
+        finally:
+            self.tab.remove_handlers(zendriver.cdp.page.DomContentEventFired, on_loaded)
+
+    async def wait_in_page(self, expression: Callable[[float], str], timeout: float) -> Any:
+        """
+        evaluate a JS promise (see xilriws.js.observe) that's given the remaining timeout, and wait for its result.
+        if the page navigates away in the meantime, it's evaluated again in the new document
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = max(0.0, deadline - loop.time())
+            try:
+                return await asyncio.wait_for(
+                    self.tab.evaluate(expression(remaining), await_promise=True), remaining + 5
+                )
+            except zendriver.core.connection.ProtocolException as e:
+                if loop.time() >= deadline:
+                    raise asyncio.TimeoutError() from e
+                logger.debug(f"Page changed while waiting ({str(e)}), trying again")
+                await self.tab.sleep(0.1)
 
     async def get_js_check_handler(self, url: str) -> tuple[asyncio.Future, Callable]:
         js_future = asyncio.get_running_loop().create_future()
@@ -211,6 +473,87 @@ class Browser:
             self.tab = tab
         await self.tab.sleep(0.4)
 
+    async def new_context(self, proxy: Proxy | None) -> None:
+        """
+        open a tab in a new browser context. it has its own cookies and storage, and uses the proxy and the
+        fingerprint script without going through the extensions
+        """
+        await self.close_context()
+
+        proxy_server = None
+        if proxy and proxy.host:
+            proxy_server = f"{proxy.scheme}://{proxy.host}:{proxy.port}"
+
+        self.context_id = await self.browser.connection.send(
+            zendriver.cdp.target.create_browser_context(dispose_on_detach=True, proxy_server=proxy_server)
+        )
+        target_id = await self.browser.connection.send(
+            zendriver.cdp.target.create_target("about:blank", browser_context_id=self.context_id)
+        )
+        self.home_tab = self.tab
+        self.tab = next(
+            filter(
+                lambda item: item.type_ == "page" and item.target_id == target_id,
+                self.browser.targets,
+            )
+        )
+
+        # the script runs at document start in every frame of the tab, like the extension's content scripts. each
+        # context gets a seed of its own, like each tab does from the extension
+        seed = str(random.randrange(1, 2**31 - 1))
+        await self.tab.send(zendriver.cdp.page.enable())
+        await self.tab.send(
+            zendriver.cdp.page.add_script_to_evaluate_on_new_document(
+                self.fingerprint_script.replace(fingerprint.SEED_PLACEHOLDER, seed)
+            )
+        )
+        await self.tab.send(zendriver.cdp.network.enable())
+        await self.tab.send(zendriver.cdp.network.set_blocked_ur_ls(CONTEXT_BLOCKED_URLS))
+        if proxy and proxy.username:
+            await self.__answer_proxy_auth(proxy)
+
+    async def close_context(self) -> None:
+        """throw away the current browser context, including its tab and cookies"""
+        if self.context_id is None:
+            return
+
+        context_id, self.context_id = self.context_id, None
+        self.tab, self.home_tab = self.home_tab, None
+        if not self.browser:
+            return
+
+        try:
+            await self.browser.connection.send(zendriver.cdp.target.dispose_browser_context(context_id))
+        except Exception as e:
+            logger.debug(f"{str(e)} while disposing browser context")
+
+    async def __answer_proxy_auth(self, proxy: Proxy) -> None:
+        tab = self.tab
+
+        async def on_request(event: zendriver.cdp.fetch.RequestPaused):
+            await tab.send(zendriver.cdp.fetch.continue_request(event.request_id))
+
+        async def on_auth(event: zendriver.cdp.fetch.AuthRequired):
+            response = zendriver.cdp.fetch.AuthChallengeResponse(
+                "ProvideCredentials", username=proxy.username, password=proxy.password
+            )
+            await tab.send(zendriver.cdp.fetch.continue_with_auth(event.request_id, response))
+
+        tab.add_handler(zendriver.cdp.fetch.RequestPaused, on_request)
+        tab.add_handler(zendriver.cdp.fetch.AuthRequired, on_auth)
+        await tab.send(zendriver.cdp.fetch.enable(handle_auth_requests=True))
+
+    async def set_last_cookies(self) -> None:
+        """carry the cookies of the last acquisition over"""
+        if not self.last_cookies:
+            return
+        if self.context_id is not None:
+            await self.tab.send(
+                zendriver.cdp.storage.set_cookies(self.last_cookies, browser_context_id=self.context_id)
+            )
+        else:
+            await self.browser.cookies.set_all(self.last_cookies)
+
     async def new_private_window(self):
         context_id = await self.browser.connection.send(zendriver.cdp.target.create_browser_context())
         target_id = await self.browser.connection.send(
@@ -263,10 +606,32 @@ class Browser:
                 logger.info(f"Canvas fingerprint: {line}")
 
     async def stop_browser(self):
-        await self.browser.stop()
+        await self.__stop(self.browser)
         self.first_run = True
+        self.context_id = None
+        self.home_tab = None
         self.tab = None
         self.browser = None
+        self.ext_client = None
+
+    def __lean_profile_dir(self) -> str | None:
+        """a profile on tmpfs. None leaves it to zendriver, which puts its temporary profile on disk"""
+        if os.path.isdir(LEAN_PROFILE_DIR) and os.access(LEAN_PROFILE_DIR, os.W_OK):
+            return tempfile.mkdtemp(prefix="xilriws-profile-", dir=LEAN_PROFILE_DIR)
+        logger.warning(f"{LEAN_PROFILE_DIR} isn't available, the browser profile stays on disk")
+        return None
+
+    async def __stop(self, browser: zendriver.Browser | None) -> None:
+        if not browser:
+            return
+        try:
+            await browser.stop()
+        except Exception as e:
+            logger.warning(f"{str(e)} while stopping the browser")
+
+        # zendriver only removes the profiles it created itself, the lean ones are ours
+        if browser.config.uses_custom_data_dir:
+            await asyncio.to_thread(shutil.rmtree, browser.config.user_data_dir, ignore_errors=True)
 
     def __find_chrome_executable(self, return_all=False):
         candidates = []
@@ -1,147 +1,226 @@
 from __future__ import annotations
 
 import asyncio
+from contextlib import nullcontext
+from typing import ContextManager
 
 import zendriver
 from loguru import logger
 
 from xilriws.constants import ACCESS_URL
-from xilriws.extension_comm import FINISH_COOKIE_PURGE, ExtensionComm, FINISH_PROXY
-from xilriws.proxy import ProxyDistributor
+from xilriws.extension_comm import FINISH_COOKIE_PURGE, ExtensionComm
+from xilriws.js import observe
+from xilriws.proxy import Proxy, ProxyDistributor
 from xilriws.ptc import ptc_utils
 from xilriws.ptc_auth import LoginException
 from xilriws.reese_cookie import ReeseCookie
 
-from .browser import Browser, ProxyException
+from .browser import ISOLATION_CONTEXT, ISOLATION_TAB, PROFILE_DEFAULT, Browser, ProxyException
+from .driver import BrowserDriver
+from .flight_recorder import (
+    OUTCOME_BROWSER_ERROR,
+    OUTCOME_ERROR,
+    OUTCOME_LOGIN_ERROR,
+    OUTCOME_PROXY_ERROR,
+    OUTCOME_SUCCESS,
+    Acquisition,
+    FlightRecorder,
+)
+from .resources import RecyclePolicy
 
 logger = logger.bind(name="Browser")
 
 
-class BrowserAuth(Browser):
-    def __init__(self, extension_paths: list[str], proxies: ProxyDistributor, ext_comm: ExtensionComm):
-        super().__init__(extension_paths=extension_paths, ext_comm=ext_comm)
+class ChromeDriver(Browser):
+    """gets cookies in a real Chrome, see BrowserDriver"""
+
+    def __init__(
+        self,
+        extension_paths: list[str],
+        proxies: ProxyDistributor,
+        ext_comm: ExtensionComm,
+        isolation: str = ISOLATION_TAB,
+        recycle_policy: RecyclePolicy | None = None,
+        profile: str = PROFILE_DEFAULT,
+    ):
+        super().__init__(
+            extension_paths=extension_paths,
+            ext_comm=ext_comm,
+            isolation=isolation,
+            recycle_policy=recycle_policy,
+            profile=profile,
+        )
         self.proxies = proxies
+        self.acquisition: Acquisition | None = None
 
-    async def get_reese_cookie(self, proxy_changed: bool) -> ReeseCookie | None:
-        proxy = self.proxies.next_proxy
+    async def load_cookies(self, proxy: Proxy, proxy_changed: bool) -> dict[str, str]:
+        js_future, js_check_handler = await self.get_js_check_handler(ACCESS_URL)
+        await self.open_session(proxy_changed)
 
-        try:
-            await self.start_browser()
-        except Exception as e:
-            logger.exception("Exception while starting browser", e)
-            return None
+        # if IS_DEBUG:
+        #     await self.log_ip()
+
+        self.tab.add_handler(zendriver.cdp.network.ResponseReceived, js_check_handler)
+        self.tab.add_handler(zendriver.cdp.network.ResponseReceived, self.acquisition.on_response)
+        logger.info("Opening PTC")
 
         try:
-            js_future, js_check_handler = await self.get_js_check_handler(ACCESS_URL)
-            cookie_future = await self.ext_comm.add_listener(FINISH_COOKIE_PURGE)
+            with self.phase("page_load"):
+                await asyncio.wait_for(self.tab.get(url=ACCESS_URL + "login"), timeout=20)
+                html = await asyncio.wait_for(self.tab.get_content(), timeout=20)
+        except asyncio.TimeoutError:
+            raise ProxyException(f"Page timed out (Proxy: {proxy.url})")
 
-            await self.new_tab()
-            if proxy_changed:
-                await self.change_proxy()
+        if "neterror" in html.lower():
+            raise ProxyException(f"Page couldn't be reached (Proxy: {proxy.url})")
 
-            if not self.first_run and cookie_future and not cookie_future.done():
+        imp_code, imp_reason = ptc_utils.get_imperva_error_code(html)
+        if imp_code not in ("15", "?"):
+            proxy.rate_limited()
+            raise LoginException(f"Error code {imp_code} ({imp_reason}) with (Proxy: {proxy.url})")
+        else:
+            logger.info("Successfully got error 15 page")
+            if not js_future.done():
                 try:
-                    await asyncio.wait_for(cookie_future, 2)
+                    logger.info("Waiting for JS check")
+                    with self.phase("js_check"):
+                        await asyncio.wait_for(js_future, timeout=100)
+                    self.tab.handlers.clear()
+                    self.tab.add_handler(zendriver.cdp.network.ResponseReceived, self.acquisition.on_response)
+                    logger.info("JS check done. reloading")
                 except asyncio.TimeoutError:
-                    logger.info("Didn't get confirmation that cookies were cleared, continuing anyway")
+                    raise LoginException("Timeout on JS challenge")
+            else:
+                logger.debug("JS check already done, continuing")
+
+            logger.debug("Reloading now")
+            with self.phase("reload"):
+                await self.reload()
+
+            # Wait until the page says "log in" or shows an imperva error code. Without this, it would often log
+            # an error code "?". These seem to have been imperva error pages that weren't loaded properly.
+            with self.phase("reload_wait"):
+                new_html = await self.wait_in_page(
+                    lambda remaining: observe.wait_for_content(["log in", r"edet=\d+&"], remaining), timeout=5
+                )
+            if "log in" not in new_html.lower():
+                logger.debug(new_html)
+                proxy.rate_limited()
+                imp_code, imp_reason = ptc_utils.get_imperva_error_code(new_html)
+                if imp_code != "?":
+                    raise LoginException(f"Didn't pass JS check. Code {imp_code} ({imp_reason})")
+                raise LoginException("Timed out while waiting for reload to finish")
 
-            self.first_run = False
+            logger.info("Finished reloading")
 
-            if self.last_cookies:
-                await self.browser.cookies.set_all(self.last_cookies)
+        logger.info("Getting cookies from browser")
+        with self.phase("cookie_extraction"):
+            all_cookies = await self.get_cookies()
+        with self.phase("close"):
+            await self.close_context()
+        return all_cookies
+
+    def phase(self, name: str) -> ContextManager[None]:
+        """time a phase of the current acquisition for the flight recorder"""
+        if self.acquisition is None:
+            return nullcontext()
+        return self.acquisition.phase(name)
+
+    async def open_session(self, proxy_changed: bool) -> None:
+        """get a clean tab for the next acquisition, using the next proxy"""
+        if self.isolation == ISOLATION_CONTEXT:
+            with self.phase("tab_open"):
+                await self.new_context(self.proxies.next_proxy)
+        else:
+            cookie_future = self.ext_client.add_listener(FINISH_COOKIE_PURGE)
+
+            with self.phase("tab_open"):
+                await self.new_tab()
+            # a browser that was just (re)started has no proxy set yet, even if it's the same as before
+            if proxy_changed or self.first_run:
+                with self.phase("proxy_switch"):
+                    await self.change_proxy()
+
+            if not self.first_run and cookie_future and not cookie_future.done():
+                try:
+                    with self.phase("cookie_purge"):
+                        await asyncio.wait_for(cookie_future, 2)
+                except asyncio.TimeoutError:
+                    logger.info("Didn't get confirmation that cookies were cleared, continuing anyway")
 
-            # if IS_DEBUG:
-            #     await self.log_ip()
+        self.first_run = False
+        with self.phase("cookie_restore"):
+            await self.set_last_cookies()
 
-            self.tab.add_handler(zendriver.cdp.network.ResponseReceived, js_check_handler)
-            logger.info("Opening PTC")
+    async def change_proxy(self):
+        proxy_future = await self.proxies.change_proxy(self.ext_client)
 
+        if proxy_future:
             try:
-                await asyncio.wait_for(self.tab.get(url=ACCESS_URL + "login"), timeout=20)
-                html = await asyncio.wait_for(self.tab.get_content(), timeout=20)
+                await asyncio.wait_for(proxy_future, 2)
             except asyncio.TimeoutError:
-                raise ProxyException(f"Page timed out (Proxy: {proxy.url})")
+                logger.info("Didn't get confirmation that proxy changed, continuing anyway")
 
-            if "neterror" in html.lower():
-                raise ProxyException(f"Page couldn't be reached (Proxy: {proxy.url})")
 
-            imp_code, imp_reason = ptc_utils.get_imperva_error_code(html)
-            if imp_code not in ("15", "?"):
-                proxy.rate_limited()
-                raise LoginException(f"Error code {imp_code} ({imp_reason}) with (Proxy: {proxy.url})")
-            else:
-                logger.info("Successfully got error 15 page")
-                if not js_future.done():
-                    try:
-                        logger.info("Waiting for JS check")
-                        await asyncio.wait_for(js_future, timeout=100)
-                        self.tab.handlers.clear()
-                        logger.info("JS check done. reloading")
-                    except asyncio.TimeoutError:
-                        raise LoginException("Timeout on JS challenge")
-                else:
-                    logger.debug("JS check already done, continuing")
-
-                logger.debug("Reloading now")
-                await self.tab.reload()
-
-                attempts = 0
-                finished_reloading = False
-                while attempts < 10 and not finished_reloading:
-                    # This while loop checks the html until it finds "log in" or an imperva error code.
-                    # Before adding it, it would often log an error code "?". These seem to have been imperva
-                    # error pages that weren't loaded properly. But to make absolutely sure, we'll just retry.
-                    attempts += 1
-                    logger.debug(f"Checking reload content #{attempts}")
-
-                    new_html = await self.tab.get_content()
-                    if "log in" not in new_html.lower():
-                        logger.debug(new_html)
-                        proxy.rate_limited()
-                        imp_code, imp_reason = ptc_utils.get_imperva_error_code(new_html)
-                        if imp_code != "?":
-                            raise LoginException(f"Didn't pass JS check. Code {imp_code} ({imp_reason})")
-
-                        await self.tab.sleep(0.5)
-                    else:
-                        logger.info("Finished reloading")
-                        finished_reloading = True
-
-                if not finished_reloading:
-                    raise LoginException("Timed out while waiting for reload to finish")
-
-            logger.info("Getting cookies from browser")
-            all_cookies = await self.get_cookies()
+class BrowserAuth:
+    """
+    Gets cookies for CookieMonster with a browser driver, handles its failures and records every acquisition in
+    the flight recorder
+    """
 
-            self.consecutive_failures = 0
-            return ReeseCookie(all_cookies, proxy)
+    def __init__(self, driver: BrowserDriver, proxies: ProxyDistributor, recorder: FlightRecorder | None = None):
+        self.driver = driver
+        self.proxies = proxies
+        self.recorder = recorder if recorder is not None else FlightRecorder()
+
+    async def get_reese_cookie(self, proxy_changed: bool) -> ReeseCookie | None:
+        proxy = self.proxies.next_proxy
+        acquisition = self.recorder.start(self.driver.browser_id, proxy.url if proxy and proxy.host else None)
+        self.driver.acquisition = acquisition
+        try:
+            cookie, outcome, error = await self.__get_reese_cookie(proxy, proxy_changed)
+            acquisition.finish(outcome, error)
+            return cookie
+        except BaseException as e:
+            acquisition.finish(OUTCOME_ERROR, str(e) or type(e).__name__)
+            raise
+        finally:
+            self.driver.acquisition = None
+
+    async def __get_reese_cookie(
+        self, proxy: Proxy, proxy_changed: bool
+    ) -> tuple[ReeseCookie | None, str, str | None]:
+        """the cookie (if there is one), the outcome and error for the flight recorder"""
+        driver = self.driver
+        try:
+            with driver.acquisition.phase("browser_start"):
+                await driver.start_browser()
+        except Exception as e:
+            logger.exception("Exception while starting browser", e)
+            return None, OUTCOME_BROWSER_ERROR, str(e)
+
+        try:
+            all_cookies = await driver.load_cookies(proxy, proxy_changed)
+            driver.consecutive_failures = 0
+            return ReeseCookie(all_cookies, proxy), OUTCOME_SUCCESS, None
         except LoginException as e:
             logger.error(f"{str(e)} while getting cookie")
-            self.consecutive_failures += 1
-            return None
+            driver.consecutive_failures += 1
+            await driver.close_context()
+            return None, OUTCOME_LOGIN_ERROR, str(e)
         except ProxyException as e:
             # proxy.invalidate()
             proxy.rate_limited()
             logger.error(f"{str(e)} while getting cookie")
-            await self.stop_browser()
-            return None
+            await driver.stop_browser()
+            return None, OUTCOME_PROXY_ERROR, str(e)
         except Exception as e:
             logger.exception("Exception in browser", e)
+            error = str(e) or type(e).__name__
 
         logger.error(
             "Error while getting cookie from browser, it will be restarted next time"
         )
-        self.consecutive_failures += 1
-        await self.stop_browser()
-        return None
-
-    async def change_proxy(self):
-        proxy_future = await self.ext_comm.add_listener(FINISH_PROXY)
-        # TODO: add try/except and restart the browser
-        used_proxy = await self.proxies.change_proxy()
-
-        if used_proxy:
-            try:
-                await asyncio.wait_for(proxy_future, 2)
-            except asyncio.TimeoutError:
-                logger.info("Didn't get confirmation that proxy changed, continuing anyway")
+        driver.consecutive_failures += 1
+        await driver.stop_browser()
+        return None, OUTCOME_ERROR, error
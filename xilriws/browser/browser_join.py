@@ -8,8 +8,8 @@ import zendriver
 from loguru import logger
 
 from xilriws.constants import JOIN_URL
-from xilriws.extension_comm import FINISH_PROXY, FINISH_COOKIE_PURGE
-from xilriws.js import load, recaptcha
+from xilriws.extension_comm import FINISH_COOKIE_PURGE
+from xilriws.js import load, observe, recaptcha
 from xilriws.proxy import Proxy
 from xilriws.ptc import ptc_utils
 from xilriws.ptc_auth import LoginException
@@ -37,13 +37,11 @@ class BrowserJoin(Browser):
         try:
             timestamp = int(time.time())
             js_future, js_check_handler = await self.get_js_check_handler(JOIN_URL)
-            cookie_future = await self.ext_comm.add_listener(FINISH_COOKIE_PURGE)
+            cookie_future = self.ext_client.add_listener(FINISH_COOKIE_PURGE)
 
             await self.new_tab()
 
-            proxy_future = await self.ext_comm.add_listener(FINISH_PROXY)
-
-            await self.ext_comm.send(
+            proxy_future = await self.ext_client.request(
                 "setProxy",
                 {
                     "host": proxy.host,
@@ -83,20 +81,20 @@ class BrowserJoin(Browser):
             except asyncio.TimeoutError:
                 raise LoginException("Timeout on JS challenge")
 
-            await self.tab.reload()
+            await self.reload()
 
             logger.debug("Waiting for imperva or recaptcha iframe")
-            found_captcha = False
-            found_error = False
-            loop = asyncio.get_running_loop()
-            start_time = loop.time()
-            while not found_captcha and not found_error and start_time + 100 > loop.time():
-                try:
-                    found_captcha = await self.tab.query_selector("iframe[title='reCAPTCHA']")
-                    found_error = await self.tab.query_selector("iframe#main-iframe")
-                except Exception as e:
-                    # this is handles by the while loop
-                    logger.debug(f"Exception in query_selector: {e}")
+            try:
+                found = await self.wait_in_page(
+                    lambda remaining: observe.wait_for_selectors(
+                        ["iframe[title='reCAPTCHA']", "iframe#main-iframe"], remaining
+                    ),
+                    timeout=100,
+                )
+            except asyncio.TimeoutError:
+                found = -1
+            found_captcha = found == 0
+            found_error = found == 1
 
             if found_error:
                 # TODO check for error 16, mark proxies as dead
@@ -127,7 +125,7 @@ class BrowserJoin(Browser):
                 create_tokens=recaptcha_tokens["create"],
                 activate_tokens=recaptcha_tokens["activate"],
                 timestamp=timestamp,
-                proxy=proxy.full_url.geturl(),
+                proxy=proxy.full_url,
             )
         except LoginException as e:
             logger.error(f"{str(e)} while getting tokens")
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Protocol
+
+if TYPE_CHECKING:
+    from xilriws.proxy import Proxy
+
+    from .flight_recorder import Acquisition
+
+
+class BrowserDriver(Protocol):
+    """
+    The browser BrowserAuth gets its cookies with. ChromeDriver drives a real Chrome, benchmarks.fake_browser
+    simulates one so CookieMonster can be load tested without Chrome and PTC.
+
+    load_cookies raises LoginException if PTC or Imperva turned the session away (rate limiting the proxy if it's
+    the proxy's fault) and ProxyException if the page couldn't be loaded through the proxy. BrowserAuth closes the
+    session after a LoginException and stops the browser after anything else, start_browser starts it again.
+    """
+
+    browser_id: str
+    consecutive_failures: int
+    acquisition: Acquisition | None
+    """the acquisition that's running, its phases are recorded in the flight recorder"""
+
+    async def start_browser(self) -> None:
+        pass
+
+    async def load_cookies(self, proxy: Proxy, proxy_changed: bool) -> dict[str, str]:
+        """open a session through proxy, pass the JS check and return the cookies, the session is closed afterwards"""
+        pass
+
+    async def close_context(self) -> None:
+        pass
+
+    async def stop_browser(self) -> None:
+        pass
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+
+EXTENSION_NAME = "xilriws-targetfp"
+# in the order they import each other
+MODULES = ("funcToString", "utils", "screen", "general", "canvas", "webgl")
+SEED_PLACEHOLDER = "__XILRIWS_SEED__"
+
+_STATIC_IMPORT = re.compile(r'^import \* as (\w+) from "\./(\w+)\.js"$', re.MULTILINE)
+_DYNAMIC_IMPORT = re.compile(r'await import\("\./(\w+)\.js"\)')
+_EXPORT = re.compile(r"^export function (\w+)", re.MULTILINE)
+_TAB_ID = 'await chrome.runtime.sendMessage("getTabId")'
+
+
+def find_extension(extension_paths: list[str]) -> str | None:
+    """the path of the fingerprint extension among the browser's extensions"""
+    for path in extension_paths:
+        try:
+            with open(os.path.join(path, "manifest.json"), "r") as f:
+                if json.load(f).get("name") == EXTENSION_NAME:
+                    return path
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def build_script(extension_path: str) -> str:
+    """
+    the fingerprint extension as a single script for Page.addScriptToEvaluateOnNewDocument, since extensions don't
+    run in browser contexts. its modules are inlined, and the content script uses SEED_PLACEHOLDER as the seed
+    instead of asking the extension's background for the tab id
+    """
+
+    def read(name: str) -> str:
+        with open(os.path.join(extension_path, f"{name}.js"), "r") as f:
+            return f.read()
+
+    parts = ["(() => {", "const __targetfp = {}"]
+    for module in MODULES:
+        source = read(module)
+        exports = _EXPORT.findall(source)
+        source = _STATIC_IMPORT.sub(r'const \1 = __targetfp["\2"]', source)
+        source = _EXPORT.sub(r"function \1", source)
+        parts.append(f'__targetfp["{module}"] = (() => {{\n{source}\nreturn {{{", ".join(exports)}}}\n}})()')
+
+    content_script = read("contentScript")
+    if _TAB_ID not in content_script:
+        raise ValueError(f"{EXTENSION_NAME}'s contentScript.js doesn't get the tab id like expected")
+    parts.append(content_script.replace(_TAB_ID, SEED_PLACEHOLDER))
+    parts.append(_DYNAMIC_IMPORT.sub(r'__targetfp["\1"]', read("inject")))
+    parts.append("})()")
+    return "\n".join(parts)
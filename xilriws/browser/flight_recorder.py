@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Iterator
+
+import zendriver
+from prometheus_client import Histogram
+
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60, 100)
+
+ACQUISITION_PHASE_SECONDS = Histogram(
+    "xilriws_acquisition_phase_seconds",
+    "Duration of each phase of getting a cookie in the browser",
+    ("phase",),
+    buckets=PHASE_BUCKETS,
+)
+ACQUISITION_SECONDS = Histogram(
+    "xilriws_acquisition_seconds",
+    "Duration of getting a cookie in the browser, by outcome",
+    ("outcome",),
+    buckets=PHASE_BUCKETS,
+)
+
+# responses kept per acquisition, the first ones are the interesting ones (the page and imperva's script)
+MAX_RESPONSES = 40
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_LOGIN_ERROR = "login_error"
+OUTCOME_PROXY_ERROR = "proxy_error"
+OUTCOME_BROWSER_ERROR = "browser_error"
+OUTCOME_ERROR = "error"
+
+
+@dataclass
+class Phase:
+    name: str
+    offset: float
+    """seconds since the acquisition started"""
+    duration: float
+    failed: bool = False
+
+
+@dataclass
+class ResponseTiming:
+    """a response the tab received, with chrome's timings of the request in ms (None for steps that didn't happen)"""
+
+    url: str
+    status: int
+    resource_type: str
+    offset: float
+    """seconds since the acquisition started, when the response headers arrived"""
+    connection_reused: bool
+    proxy: float | None
+    dns: float | None
+    connect: float | None
+    ssl: float | None
+    send: float | None
+    wait: float | None
+    """time to first byte, from sending the request until the headers arrived"""
+
+
+def _span(start: float, end: float) -> float | None:
+    if start < 0 or end < 0:
+        return None
+    return round(end - start, 1)
+
+
+@dataclass
+class Acquisition:
+    """the timeline of getting one cookie in a browser"""
+
+    id: int
+    browser: str
+    proxy: str | None
+    started_at: float
+    """unix time"""
+    phases: list[Phase] = field(default_factory=list)
+    responses: list[ResponseTiming] = field(default_factory=list)
+    outcome: str | None = None
+    """None while it's running"""
+    error: str | None = None
+    duration: float | None = None
+
+    def __post_init__(self):
+        self.__started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.__started
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        offset = self.elapsed
+        phase = Phase(name=name, offset=offset, duration=0)
+        self.phases.append(phase)
+        try:
+            yield
+        except BaseException:
+            phase.failed = True
+            raise
+        finally:
+            phase.duration = self.elapsed - offset
+            ACQUISITION_PHASE_SECONDS.labels(phase=name).observe(phase.duration)
+
+    def on_response(self, event: zendriver.cdp.network.ResponseReceived) -> None:
+        if len(self.responses) >= MAX_RESPONSES:
+            return
+
+        response = event.response
+        timing = response.timing
+        self.responses.append(
+            ResponseTiming(
+                url=response.url[:200],
+                status=response.status,
+                resource_type=event.type_.value if event.type_ else "",
+                offset=self.elapsed,
+                connection_reused=response.connection_reused,
+                proxy=_span(timing.proxy_start, timing.proxy_end) if timing else None,
+                dns=_span(timing.dns_start, timing.dns_end) if timing else None,
+                connect=_span(timing.connect_start, timing.connect_end) if timing else None,
+                ssl=_span(timing.ssl_start, timing.ssl_end) if timing else None,
+                send=_span(timing.send_start, timing.send_end) if timing else None,
+                wait=_span(timing.send_end, timing.receive_headers_end) if timing else None,
+            )
+        )
+
+    def finish(self, outcome: str, error: str | None = None) -> None:
+        self.outcome = outcome
+        self.error = error
+        self.duration = self.elapsed
+        ACQUISITION_SECONDS.labels(outcome=outcome).observe(self.duration)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class FlightRecorder:
+    """
+    Keeps the timelines of the last `size` cookie acquisitions of all browsers, including the ones that are still
+    running, to see where the time goes when getting cookies slows down
+    """
+
+    def __init__(self, size: int = 100):
+        self.acquisitions: deque[Acquisition] = deque(maxlen=size)
+        self.__ids = itertools.count(1)
+
+    def start(self, browser: str, proxy: str | None) -> Acquisition:
+        acquisition = Acquisition(id=next(self.__ids), browser=browser, proxy=proxy, started_at=time.time())
+        self.acquisitions.append(acquisition)
+        return acquisition
+
+    def recent(self, limit: int | None = None) -> list[dict]:
+        """the latest acquisitions first"""
+        acquisitions = list(reversed(self.acquisitions))
+        if limit is not None:
+            acquisitions = acquisitions[:limit]
+        return [acquisition.to_dict() for acquisition in acquisitions]
+
+    def summary(self) -> dict:
+        """outcomes, and the time spent in each phase over the recorded acquisitions, the phase that took longest first"""
+        outcomes: dict[str, int] = {}
+        durations: dict[str, list[float]] = {}
+        for acquisition in self.acquisitions:
+            if acquisition.outcome is None:
+                continue
+            outcomes[acquisition.outcome] = outcomes.get(acquisition.outcome, 0) + 1
+            for phase in acquisition.phases:
+                durations.setdefault(phase.name, []).append(phase.duration)
+
+        total = sum(sum(values) for values in durations.values())
+        phases = {}
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            values.sort()
+            phases[name] = {
+                "count": len(values),
+                "share": sum(values) / total if total else 0,
+                "mean_ms": sum(values) / len(values) * 1000,
+                "p50_ms": values[len(values) // 2] * 1000,
+                "p90_ms": values[min(len(values) - 1, int(len(values) * 0.9))] * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return {"acquisitions": sum(outcomes.values()), "outcomes": outcomes, "phases": phases}
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+RECYCLE_SESSIONS = "sessions"
+RECYCLE_MEMORY = "memory"
+RECYCLE_AGE = "age"
+RECYCLE_TABS = "tabs"
+
+
+@dataclass
+class ProcessTreeUsage:
+    rss: int
+    """resident memory in bytes"""
+    cpu_seconds: float
+    processes: int
+
+
+def child_processes(pid: int) -> list[int]:
+    """the direct children of a process, from /proc/<pid>/task/*/children. empty if there's no /proc"""
+    children = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return children
+
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                children += [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+    return children
+
+
+def find_child_process(argument: str) -> int | None:
+    """the child process of this one that has argument on its command line"""
+    for child in child_processes(os.getpid()):
+        try:
+            with open(f"/proc/{child}/cmdline", "rb") as f:
+                arguments = f.read().split(b"\0")
+        except OSError:
+            continue
+        if argument.encode() in arguments:
+            return child
+    return None
+
+
+def read_process_tree(pid: int) -> ProcessTreeUsage | None:
+    """
+    memory and cpu time of a process and all its descendants (for chrome: zygotes, renderers, gpu and utility
+    processes), read from /proc. only the tree itself is read, through the children of every process, so it's cheap
+    enough for the event loop. None if the process doesn't exist or there's no /proc
+    """
+    ticks = 0
+    pages = 0
+    processes = 0
+
+    tree = [pid]
+    for process in tree:
+        try:
+            with open(f"/proc/{process}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            if process == pid:
+                return None
+            continue
+
+        # the process name comes in parentheses and may contain spaces, the fields after it start with the state
+        fields = stat[stat.rindex(b")") + 2 :].split()
+        ticks += int(fields[11]) + int(fields[12])
+        pages += int(fields[21])
+        processes += 1
+        tree.extend(child_processes(process))
+
+    return ProcessTreeUsage(rss=pages * PAGE_SIZE, cpu_seconds=ticks / CLOCK_TICKS, processes=processes)
+
+
+@dataclass
+class RecyclePolicy:
+    """when a browser is restarted. a limit of None is never reached"""
+
+    max_sessions: int | None = 60
+    max_rss_mb: float | None = 1500
+    max_age: float | None = None
+    """seconds"""
+    max_tabs: int | None = 10
+
+    def usage(self, sessions: int, rss: int | None, age: float, tabs: int) -> tuple[float, str]:
+        """how close the browser is to being restarted (1 = a limit is reached), and the reason"""
+        ratios = [
+            (sessions / self.max_sessions if self.max_sessions else 0, RECYCLE_SESSIONS),
+            (rss / (self.max_rss_mb * 1024 * 1024) if self.max_rss_mb and rss else 0, RECYCLE_MEMORY),
+            (age / self.max_age if self.max_age else 0, RECYCLE_AGE),
+            (tabs / self.max_tabs if self.max_tabs else 0, RECYCLE_TABS),
+        ]
+        return max(ratios)
@@ -6,4 +6,7 @@ JOIN_URL = "https://join.pokemon.com/"
 EXPIRATION = 18 * 60
 MAX_USES = 7
 COOKIE_STORAGE = 2
+COOKIE_STORAGE_MIN = 1
+COOKIE_STORAGE_MAX = 20
+DEMAND_WINDOW = 60
 AUTH_TIMEOUT = 60
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import TYPE_CHECKING, Callable
+
+from .cookie_store import CookieStore
+
+if TYPE_CHECKING:
+    from .reese_cookie import ReeseCookie
+
+
+class CookiePool(CookieStore):
+    """
+    Cookies ordered by expiration. lease() hands out the cookie that expires first and counts the use right away,
+    so concurrent auths never pile onto a cookie that has no uses left. Cookies that are used up, expired or removed
+    leave the pool immediately, their heap entries are dropped lazily.
+    Once a cookie is out of the pool and not leased anymore, it's retired and the retire listeners are called.
+    This is the store of a single instance, see SqliteCookieStore for one that's shared.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, int, ReeseCookie]] = []
+        self.cookies: set[ReeseCookie] = set()
+        self.cond = asyncio.Condition()
+        self.retire_listeners: list[Callable[[ReeseCookie], None]] = []
+        self.leased = 0
+        self.local_waiting = 0
+        self.queued: Callable[[], int] = lambda: 0
+        self.__counter = itertools.count()
+
+    def __len__(self):
+        return len(self.cookies)
+
+    def __bool__(self):
+        return bool(len(self))
+
+    def __iter__(self):
+        return iter(self.cookies)
+
+    @property
+    def waiting(self) -> int:
+        return self.local_waiting + self.queued()
+
+    async def add(self, cookie: ReeseCookie) -> None:
+        async with self.cond:
+            self.cookies.add(cookie)
+            heapq.heappush(self.heap, (cookie.expiration, next(self.__counter), cookie))
+            self.cond.notify_all()
+
+    async def remove(self, cookie: ReeseCookie) -> None:
+        self.__discard(cookie)
+
+    async def lease(self) -> ReeseCookie:
+        cookie = self.__take()
+        if cookie:
+            return cookie
+
+        async with self.cond:
+            cookie = self.__take()
+            self.local_waiting += 1
+            try:
+                while not cookie:
+                    await self.cond.wait()
+                    cookie = self.__take()
+            finally:
+                self.local_waiting -= 1
+            return cookie
+
+    def release(self, cookie: ReeseCookie) -> None:
+        cookie.in_flight -= 1
+        self.leased -= 1
+        if not cookie.in_flight and cookie not in self.cookies:
+            self.__retire(cookie)
+
+    async def sweep(self) -> int:
+        """drop expired cookies from the pool, returns how many were removed"""
+        before = len(self.cookies)
+        self.__drop_stale(time.time())
+        return before - len(self.cookies)
+
+    def remaining_uses(self) -> int:
+        return sum(cookie.remaining_uses for cookie in self.cookies)
+
+    def next_expiration(self) -> float | None:
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def __drop_stale(self, now: float) -> None:
+        while self.heap:
+            expiration, _, cookie = self.heap[0]
+            if cookie in self.cookies and expiration > now:
+                return
+            heapq.heappop(self.heap)
+            self.__discard(cookie)
+
+    def __discard(self, cookie: ReeseCookie) -> None:
+        if cookie not in self.cookies:
+            return
+        self.cookies.remove(cookie)
+        if not cookie.in_flight:
+            self.__retire(cookie)
+
+    def __retire(self, cookie: ReeseCookie) -> None:
+        for listener in self.retire_listeners:
+            listener(cookie)
+
+    def __take(self) -> ReeseCookie | None:
+        self.__drop_stale(time.time())
+        if not self.heap:
+            return None
+
+        cookie = self.heap[0][2]
+        cookie.use()
+        cookie.in_flight += 1
+        self.leased += 1
+        if not cookie.is_good():
+            heapq.heappop(self.heap)
+            self.__discard(cookie)
+        return cookie
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+from loguru import logger
+
+from .constants import MAX_USES
+from .proxy import proxy_url
+
+if TYPE_CHECKING:
+    from .proxy_dispenser import ProxyDispenser
+    from .reese_cookie import ReeseCookie
+
+logger = logger.bind(name="Cookie")
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_INTERVAL = 1
+
+# cookies that expire this soon aren't worth restoring
+MIN_REMAINING_SECONDS = 30
+
+
+class CookieSnapshot:
+    """
+    The cookie storage on disk, so a restarted Xilriws can serve logins before its browsers got new cookies.
+    Changes are written at most once every SNAPSHOT_INTERVAL seconds, and once more on shutdown.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.changed = asyncio.Event()
+
+    def mark_changed(self) -> None:
+        self.changed.set()
+
+    def load(self, proxy_dispenser: ProxyDispenser) -> list[ReeseCookie]:
+        """cookies from the snapshot that are still good, and whose proxy is still configured and not limited"""
+        from .reese_cookie import ReeseCookie
+
+        try:
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.warning(f"Couldn't read cookie snapshot {self.path}: {str(e)}")
+            return []
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return []
+
+        proxies = {proxy_url(proxy): proxy for proxy in proxy_dispenser.proxies}
+        now = time.time()
+        cookies = []
+        for entry in snapshot.get("cookies", []):
+            proxy = proxies.get(entry["proxy"])
+            if proxy is None or not proxy.is_good():
+                continue
+            if entry["expiration"] - now < MIN_REMAINING_SECONDS or entry["uses"] >= MAX_USES:
+                continue
+
+            cookie = ReeseCookie(entry["cookies"], proxy)
+            cookie.expiration = entry["expiration"]
+            cookie.uses = entry["uses"]
+            cookies.append(cookie)
+
+        return cookies
+
+    def save(self, cookies: Iterable[ReeseCookie]) -> None:
+        try:
+            self.__write(self.__serialize(cookies))
+        except Exception as e:
+            logger.warning(f"Couldn't write cookie snapshot {self.path}: {str(e)}")
+
+    async def save_task(self, get_cookies: Callable[[], Iterable[ReeseCookie]]):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+
+            try:
+                await asyncio.to_thread(self.__write, self.__serialize(get_cookies()))
+            except Exception as e:
+                logger.warning(f"Couldn't write cookie snapshot {self.path}: {str(e)}")
+
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+    def __serialize(self, cookies: Iterable[ReeseCookie]) -> dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "cookies": [
+                {
+                    "cookies": cookie.cookies,
+                    "proxy": proxy_url(cookie.proxy),
+                    "expiration": cookie.expiration,
+                    "uses": cookie.uses,
+                }
+                for cookie in cookies
+            ],
+        }
+
+    def __write(self, snapshot: dict[str, Any]) -> None:
+        # write next to the snapshot and swap it in, so a crash never leaves a half-written file behind
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".cookie-snapshot-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,542 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import socket
+import sqlite3
+import time
+import uuid
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Protocol, TypeVar
+
+import redis.asyncio
+from loguru import logger
+
+from .constants import MAX_USES
+from .proxy import Proxy, proxy_url
+from .task_creator import task_creator
+
+if TYPE_CHECKING:
+    from .proxy_dispenser import ProxyDispenser
+    from .reese_cookie import ReeseCookie
+
+logger = logger.bind(name="Cookie")
+
+T = TypeVar("T")
+
+# how often the shared store is read for cookies other instances added, and for the size of the storage
+REFRESH_INTERVAL = 0.2
+# instances that haven't reported their waiting requests for this long are gone
+INSTANCE_TIMEOUT = 5
+
+# the redis scripts run atomically. a cookie is spread over one hash per field (and the expirations sorted set), all
+# keyed by its id. its proxy is an empty string if it has none
+_REDIS_FORGET = """
+local function forget(id)
+    redis.call("ZREM", KEYS[1], id)
+    for i = 2, 5 do
+        redis.call("HDEL", KEYS[i], id)
+    end
+end
+"""
+
+# KEYS: expirations, uses, proxies, nodes, cookies. ARGV: now, max uses, node
+_REDIS_LEASE = (
+    _REDIS_FORGET
+    + """
+local max_uses = tonumber(ARGV[2])
+for _, id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], "(" .. ARGV[1], "+inf")) do
+    local uses = tonumber(redis.call("HGET", KEYS[2], id))
+    local proxy = redis.call("HGET", KEYS[3], id)
+    if uses and uses < max_uses and (proxy ~= "" or redis.call("HGET", KEYS[4], id) == ARGV[3]) then
+        uses = uses + 1
+        local row = {id, redis.call("HGET", KEYS[5], id), proxy, redis.call("ZSCORE", KEYS[1], id), uses}
+        if uses >= max_uses then
+            forget(id)
+        else
+            redis.call("HSET", KEYS[2], id, uses)
+        end
+        return row
+    end
+end
+return nil
+"""
+)
+
+# KEYS: expirations, uses, proxies, nodes, cookies. ARGV: now, max uses
+_REDIS_SWEEP = (
+    _REDIS_FORGET
+    + """
+local removed = 0
+for _, id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])) do
+    forget(id)
+    removed = removed + 1
+end
+local uses = redis.call("HGETALL", KEYS[2])
+for i = 1, #uses, 2 do
+    if tonumber(uses[i + 1]) >= tonumber(ARGV[2]) then
+        forget(uses[i])
+        removed = removed + 1
+    end
+end
+return removed
+"""
+)
+
+# KEYS: expirations, uses, proxies, nodes, waiting, seen. ARGV: now, instance, waiting, instance timeout, node
+_REDIS_STATE = """
+redis.call("HSET", KEYS[5], ARGV[2], ARGV[3])
+redis.call("ZADD", KEYS[6], ARGV[1], ARGV[2])
+local gone = redis.call("ZRANGEBYSCORE", KEYS[6], "-inf", "(" .. (tonumber(ARGV[1]) - tonumber(ARGV[4])))
+for _, instance in ipairs(gone) do
+    redis.call("HDEL", KEYS[5], instance)
+    redis.call("ZREM", KEYS[6], instance)
+end
+
+local other_waiting = 0
+local waiting = redis.call("HGETALL", KEYS[5])
+for i = 1, #waiting, 2 do
+    if waiting[i] ~= ARGV[2] then
+        other_waiting = other_waiting + tonumber(waiting[i + 1])
+    end
+end
+
+local rows = {}
+local cookies = redis.call("ZRANGEBYSCORE", KEYS[1], "(" .. ARGV[1], "+inf", "WITHSCORES")
+for i = 1, #cookies, 2 do
+    local id = cookies[i]
+    if redis.call("HGET", KEYS[3], id) ~= "" or redis.call("HGET", KEYS[4], id) == ARGV[5] then
+        table.insert(rows, {id, cookies[i + 1], redis.call("HGET", KEYS[2], id)})
+    end
+end
+return {other_waiting, rows}
+"""
+
+
+class CookieStore(Protocol):
+    """
+    Where CookieMonster keeps its cookies. lease() hands out a cookie and counts the use right away, release() gives
+    it back once the request is done. Once a cookie left the store and isn't leased anymore, the retire listeners
+    are called. leased counts the cookies this instance holds, waiting the requests that wait for one (of all
+    instances that share the store). That includes the requests queued() counts, which wait for their turn to lease.
+    """
+
+    retire_listeners: list[Callable[[ReeseCookie], None]]
+    leased: int
+    waiting: int
+    queued: Callable[[], int]
+
+    def __len__(self) -> int:
+        pass
+
+    def __bool__(self) -> bool:
+        return bool(len(self))
+
+    def __iter__(self) -> Iterator[ReeseCookie]:
+        pass
+
+    async def prepare(self) -> None:
+        pass
+
+    async def add(self, cookie: ReeseCookie) -> None:
+        pass
+
+    async def remove(self, cookie: ReeseCookie) -> None:
+        pass
+
+    async def lease(self) -> ReeseCookie:
+        pass
+
+    def release(self, cookie: ReeseCookie) -> None:
+        pass
+
+    async def sweep(self) -> int:
+        """drop expired cookies from the store, returns how many were removed"""
+        pass
+
+    def add_change_listener(self, listener: Callable[[], None]) -> None:
+        """listener is called when the store changed without this instance doing anything"""
+        pass
+
+    def remaining_uses(self) -> int:
+        pass
+
+    def next_expiration(self) -> float | None:
+        pass
+
+
+class SharedCookieStore(CookieStore):
+    """
+    Cookies in a store shared by several Xilriws instances. Leasing counts the use in the store itself, so a use is
+    never counted twice. Cookies without a proxy only work from the IP of the instance that got them, so they're only
+    leased by that one (identified by its hostname). Every instance also reports its waiting requests, so the browsers
+    of idle instances help out busy ones.
+
+    Size, remaining uses and next expiration are read every REFRESH_INTERVAL seconds, which is also when waiting
+    requests notice cookies from other instances. Subclasses implement the storage itself.
+    """
+
+    def __init__(self, proxy_dispenser: ProxyDispenser, node: str | None = None):
+        self.proxy_dispenser = proxy_dispenser
+        self.node = node or socket.gethostname()
+        self.instance = uuid.uuid4().hex
+        self.retire_listeners: list[Callable[[ReeseCookie], None]] = []
+        self.change_listeners: list[Callable[[], None]] = []
+        self.leased = 0
+        self.local_waiting = 0
+        self.other_waiting = 0
+        self.queued: Callable[[], int] = lambda: 0
+        self.cond = asyncio.Condition()
+
+        # cookies this instance leased, by id. they're kept while they're in the store, so their sessions are reused
+        self.local: dict[str, ReeseCookie] = {}
+        self.ids: dict[ReeseCookie, str] = {}
+        self.proxies: dict[str | None, Proxy] = {}
+        self.proxies_generation = -1
+
+        self.size = 0
+        self.available_uses = 0
+        self.earliest_expiration: float | None = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def waiting(self) -> int:
+        return self.local_waiting + self.queued() + self.other_waiting
+
+    def __iter__(self):
+        return iter(list(self.local.values()))
+
+    async def prepare(self) -> None:
+        await self._connect()
+        await self.__refresh()
+        task_creator.create_task(self.refresh_task())
+
+    async def add(self, cookie: ReeseCookie) -> None:
+        cookie_id = uuid.uuid4().hex
+        await self._insert(cookie_id, cookie)
+        self.local[cookie_id] = cookie
+        self.ids[cookie] = cookie_id
+        self.size += 1
+        self.available_uses += cookie.remaining_uses
+        if self.earliest_expiration is None or cookie.expiration < self.earliest_expiration:
+            self.earliest_expiration = cookie.expiration
+
+        async with self.cond:
+            self.cond.notify_all()
+
+    async def remove(self, cookie: ReeseCookie) -> None:
+        cookie_id = self.ids.get(cookie)
+        if cookie_id is None:
+            return
+        await self._delete(cookie_id)
+        self.__forget(cookie_id)
+
+    async def lease(self) -> ReeseCookie:
+        cookie = await self.__take()
+        if cookie:
+            return cookie
+
+        async with self.cond:
+            self.local_waiting += 1
+            try:
+                cookie = await self.__take()
+                while not cookie:
+                    await self.cond.wait()
+                    cookie = await self.__take()
+            finally:
+                self.local_waiting -= 1
+            return cookie
+
+    def release(self, cookie: ReeseCookie) -> None:
+        cookie.in_flight -= 1
+        self.leased -= 1
+        cookie_id = self.ids.get(cookie)
+        if not cookie.in_flight and (cookie_id is None or not cookie.is_good()):
+            self.__forget(cookie_id, cookie)
+
+    async def sweep(self) -> int:
+        removed = await self._delete_stale()
+        await self.__refresh()
+        return removed
+
+    def remaining_uses(self) -> int:
+        return self.available_uses
+
+    def add_change_listener(self, listener: Callable[[], None]) -> None:
+        self.change_listeners.append(listener)
+
+    def next_expiration(self) -> float | None:
+        return self.earliest_expiration
+
+    async def refresh_task(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.__refresh()
+            except Exception as e:
+                logger.warning(f"Couldn't read the cookie store: {str(e)}")
+                continue
+
+            if self.local_waiting and self.available_uses > 0:
+                async with self.cond:
+                    self.cond.notify_all()
+
+            for listener in self.change_listeners:
+                listener()
+
+    @abstractmethod
+    async def _connect(self) -> None:
+        pass
+
+    @abstractmethod
+    async def _insert(self, cookie_id: str, cookie: ReeseCookie) -> None:
+        pass
+
+    @abstractmethod
+    async def _delete(self, cookie_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def _delete_stale(self) -> int:
+        """delete expired and used up cookies, returns how many were deleted"""
+        pass
+
+    @abstractmethod
+    async def _lease_one(self) -> tuple[str, str, str | None, float, int] | None:
+        """
+        the usable cookie that expires first with its use counted, as (id, cookies json, proxy, expiration, uses).
+        deleted if that was its last use
+        """
+        pass
+
+    @abstractmethod
+    async def _read_state(self, waiting: int) -> tuple[list[tuple[str, float, int]], int]:
+        """
+        report our waiting requests, and read the cookies we can use as (id, expiration, uses) and the waiting
+        requests of the others
+        """
+        pass
+
+    async def __take(self) -> ReeseCookie | None:
+        if self.available_uses <= 0:
+            return None
+
+        row = await self._lease_one()
+        if row is None:
+            # nothing left for us, wait for the next refresh or a cookie of our own before asking again
+            self.available_uses = 0
+            return None
+
+        cookie_id, cookies, proxy, expiration, uses = row
+        cookie = self.local.get(cookie_id)
+        if cookie is None:
+            from .reese_cookie import ReeseCookie
+
+            cookie = ReeseCookie(json.loads(cookies), self.__proxy(proxy))
+            cookie.expiration = expiration
+            self.local[cookie_id] = cookie
+            self.ids[cookie] = cookie_id
+
+        cookie.uses = uses
+        cookie.in_flight += 1
+        self.leased += 1
+        # a refresh that ran meanwhile may have counted this use already
+        self.available_uses = max(0, self.available_uses - 1)
+        if uses >= MAX_USES:
+            self.ids.pop(cookie, None)
+            self.local.pop(cookie_id, None)
+            self.size = max(0, self.size - 1)
+        return cookie
+
+    async def __refresh(self) -> None:
+        rows, self.other_waiting = await self._read_state(self.local_waiting + self.queued())
+        self.size = len(rows)
+        self.available_uses = sum(max(0, MAX_USES - uses) for _, _, uses in rows)
+        self.earliest_expiration = min((expiration for _, expiration, _ in rows), default=None)
+
+        # cookies another instance used up or removed are gone for us too
+        stored = {cookie_id: uses for cookie_id, _, uses in rows}
+        for cookie_id, cookie in list(self.local.items()):
+            if cookie_id in stored:
+                cookie.uses = stored[cookie_id]
+            else:
+                self.__forget(cookie_id)
+
+    def __forget(self, cookie_id: str | None, cookie: ReeseCookie | None = None) -> None:
+        if cookie_id is not None:
+            cookie = self.local.pop(cookie_id, None)
+        if cookie is None:
+            return
+        self.ids.pop(cookie, None)
+        if not cookie.in_flight:
+            for listener in self.retire_listeners:
+                listener(cookie)
+
+    def __proxy(self, url: str | None) -> Proxy:
+        """the configured proxy with that url, so rate limits are noticed. proxies of other instances are added"""
+        if self.proxies_generation != self.proxy_dispenser.generation:
+            self.proxies = {proxy_url(proxy): proxy for proxy in self.proxy_dispenser.proxies}
+            self.proxies_generation = self.proxy_dispenser.generation
+        proxy = self.proxies.get(url)
+        if proxy is None:
+            proxy = Proxy(url)
+            self.proxies[url] = proxy
+        return proxy
+
+
+class SqliteCookieStore(SharedCookieStore):
+    """
+    Cookies in a SQLite database in WAL mode, shared by all Xilriws instances on this host that use the same file.
+    Leasing takes the write lock (BEGIN IMMEDIATE). The database is only touched from one thread.
+    """
+
+    def __init__(self, path: str, proxy_dispenser: ProxyDispenser, node: str | None = None):
+        super().__init__(proxy_dispenser, node)
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cookie-store")
+        self.db: sqlite3.Connection | None = None
+
+    async def _connect(self) -> None:
+        await self.__run(self.__connect)
+
+    async def _insert(self, cookie_id: str, cookie: ReeseCookie) -> None:
+        await self.__run(
+            self.__execute,
+            "INSERT INTO cookies (id, cookies, proxy, node, expiration, uses) VALUES (?, ?, ?, ?, ?, ?)",
+            (cookie_id, json.dumps(cookie.cookies), proxy_url(cookie.proxy), self.node, cookie.expiration, cookie.uses),
+        )
+
+    async def _delete(self, cookie_id: str) -> None:
+        await self.__run(self.__execute, "DELETE FROM cookies WHERE id = ?", (cookie_id,))
+
+    async def _delete_stale(self) -> int:
+        return await self.__run(
+            self.__execute, "DELETE FROM cookies WHERE expiration <= ? OR uses >= ?", (time.time(), MAX_USES)
+        )
+
+    async def _lease_one(self) -> tuple[str, str, str | None, float, int] | None:
+        return await self.__run(self.__lease_row)
+
+    async def _read_state(self, waiting: int) -> tuple[list[tuple[str, float, int]], int]:
+        return await self.__run(self.__read_state, waiting)
+
+    async def __run(self, function: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    # everything below runs in the executor thread
+
+    def __connect(self) -> None:
+        self.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cookies ("
+            "id TEXT PRIMARY KEY, cookies TEXT NOT NULL, proxy TEXT, node TEXT NOT NULL, "
+            "expiration REAL NOT NULL, uses INTEGER NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS cookies_expiration ON cookies (expiration)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS instances (id TEXT PRIMARY KEY, waiting INTEGER NOT NULL, seen REAL NOT NULL)"
+        )
+
+    def __read_state(self, waiting: int) -> tuple[list[tuple[str, float, int]], int]:
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO instances (id, waiting, seen) VALUES (?, ?, ?)", (self.instance, waiting, now)
+        )
+        self.db.execute("DELETE FROM instances WHERE seen < ?", (now - INSTANCE_TIMEOUT,))
+        other_waiting = self.db.execute(
+            "SELECT COALESCE(SUM(waiting), 0) FROM instances WHERE id != ?", (self.instance,)
+        ).fetchone()[0]
+        rows = self.db.execute(
+            "SELECT id, expiration, uses FROM cookies WHERE (proxy IS NOT NULL OR node = ?) AND expiration > ?",
+            (self.node, now),
+        ).fetchall()
+        return rows, other_waiting
+
+    def __execute(self, query: str, parameters: tuple) -> int:
+        return self.db.execute(query, parameters).rowcount
+
+    def __lease_row(self) -> tuple[str, str, str | None, float, int] | None:
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT id, cookies, proxy, expiration, uses FROM cookies "
+                "WHERE expiration > ? AND uses < ? AND (proxy IS NOT NULL OR node = ?) "
+                "ORDER BY expiration LIMIT 1",
+                (time.time(), MAX_USES, self.node),
+            ).fetchone()
+            if row is not None:
+                uses = row[4] + 1
+                if uses >= MAX_USES:
+                    self.db.execute("DELETE FROM cookies WHERE id = ?", (row[0],))
+                else:
+                    self.db.execute("UPDATE cookies SET uses = ? WHERE id = ?", (uses, row[0]))
+                row = (*row[:4], uses)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return row
+
+
+class RedisCookieStore(SharedCookieStore):
+    """
+    Cookies in Redis (or a server that speaks its protocol, like Valkey), shared by all Xilriws instances that use the
+    same server, on any host. Leasing and reading the state are Lua scripts, which Redis runs atomically. All keys
+    start with prefix, so several setups can share a server.
+    """
+
+    def __init__(self, url: str, proxy_dispenser: ProxyDispenser, node: str | None = None, prefix: str = "xilriws"):
+        super().__init__(proxy_dispenser, node)
+        self.url = url
+        self.redis = redis.asyncio.from_url(url, decode_responses=True)
+        self.cookie_keys = [f"{prefix}:{name}" for name in ("expirations", "uses", "proxies", "nodes", "cookies")]
+        self.instance_keys = [f"{prefix}:waiting", f"{prefix}:seen"]
+        self.lease_script = self.redis.register_script(_REDIS_LEASE)
+        self.sweep_script = self.redis.register_script(_REDIS_SWEEP)
+        self.state_script = self.redis.register_script(_REDIS_STATE)
+
+    async def _connect(self) -> None:
+        # loaded up front instead of on the first NOSCRIPT. after a restart of the server, they're loaded again then
+        for script in (self.lease_script, self.sweep_script, self.state_script):
+            await self.redis.script_load(script.script)
+
+    async def _insert(self, cookie_id: str, cookie: ReeseCookie) -> None:
+        expirations, uses, proxies, nodes, cookies = self.cookie_keys
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.zadd(expirations, {cookie_id: cookie.expiration})
+            pipeline.hset(uses, cookie_id, cookie.uses)
+            pipeline.hset(proxies, cookie_id, proxy_url(cookie.proxy) or "")
+            pipeline.hset(nodes, cookie_id, self.node)
+            pipeline.hset(cookies, cookie_id, json.dumps(cookie.cookies))
+            await pipeline.execute()
+
+    async def _delete(self, cookie_id: str) -> None:
+        expirations, *hashes = self.cookie_keys
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.zrem(expirations, cookie_id)
+            for key in hashes:
+                pipeline.hdel(key, cookie_id)
+            await pipeline.execute()
+
+    async def _delete_stale(self) -> int:
+        return await self.sweep_script(keys=self.cookie_keys, args=[repr(time.time()), MAX_USES])
+
+    async def _lease_one(self) -> tuple[str, str, str | None, float, int] | None:
+        row = await self.lease_script(keys=self.cookie_keys, args=[repr(time.time()), MAX_USES, self.node])
+        if row is None:
+            return None
+        cookie_id, cookies, proxy, expiration, uses = row
+        return cookie_id, cookies, proxy or None, float(expiration), int(uses)
+
+    async def _read_state(self, waiting: int) -> tuple[list[tuple[str, float, int]], int]:
+        expirations, uses, proxies, nodes, _ = self.cookie_keys
+        other_waiting, rows = await self.state_script(
+            keys=[expirations, uses, proxies, nodes, *self.instance_keys],
+            args=[repr(time.time()), self.instance, waiting, INSTANCE_TIMEOUT, self.node],
+        )
+        return [(cookie_id, float(expiration), int(uses)) for cookie_id, expiration, uses in rows], int(other_waiting)
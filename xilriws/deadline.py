@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """the request ran out of time, it's answered like any other timeout"""
+
+    pass
+
+
+class Deadline:
+    """
+    The point in time an auth request has to be answered by. It's passed down from the endpoint, so every stage
+    only waits as long as there's time left, and retries that can't finish anymore aren't started.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """whether something that takes this long can still finish"""
+        return self.remaining() > seconds
+
+    def timeout(self, limit: float) -> float:
+        """the timeout of a stage that normally has limit seconds, shortened to the time that's left"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline exceeded")
+        return min(limit, remaining)
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """await something that has no timeout of its own, but not longer than the time that's left"""
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("deadline exceeded") from None
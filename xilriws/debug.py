@@ -1,8 +1,8 @@
 import argparse
 
 
-parser = argparse.ArgumentParser()
+parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument("--debug", action="store_true")
-args = parser.parse_args()
+args, _ = parser.parse_known_args()
 
 IS_DEBUG = args.debug
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import json
-from typing import Any, Literal
+import os
+import shutil
+import tempfile
+from typing import Any
 
 import websockets
 from loguru import logger
@@ -12,59 +16,147 @@ logger = logger.bind(name="ExtComm")
 FINISH_PROXY = "finish:setProxy"
 FINISH_COOKIE_PURGE = "finish:cookiePurge"
 
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9091
+CLAIM_TIMEOUT = 15
+
+
+class ExtensionNotConnected(Exception):
+    """the browser's extension didn't connect to the websocket server"""
+
+    pass
+
+
+class ExtensionClient:
+    """
+    The websocket connection of the extension in one browser. Requests carry an id which the extension sends back
+    with its reply, events without an id (like the cookie purge) resolve the listeners of this client only.
+    """
+
+    def __init__(self, websocket: websockets.WebSocketServerProtocol, message_ids: itertools.count):
+        self.websocket = websocket
+        self.message_ids = message_ids
+        self.pending: dict[int, asyncio.Future] = {}
+        self.listeners: dict[str, list[asyncio.Future]] = {}
+        self.closed = False
+
+    async def request(self, action: str, data: dict[str, Any] | None = None) -> asyncio.Future:
+        """send a message and return a future that's resolved with the detail of the matching reply"""
+        message_id = next(self.message_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        future.add_done_callback(lambda _: self.pending.pop(message_id, None))
+
+        message = json.dumps({"id": message_id, "action": action, "data": data})
+        logger.debug(f"Sending WS data: {message}")
+        try:
+            await self.websocket.send(message)
+        except Exception:
+            future.cancel()
+            raise
+        return future
+
+    def add_listener(self, action: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.listeners.setdefault(action, []).append(future)
+        return future
+
+    def handle(self, data: dict[str, Any]) -> None:
+        detail = data.get("detail")
+        message_id = data.get("id")
+
+        if message_id is not None:
+            future = self.pending.pop(message_id, None)
+            if future and not future.done():
+                future.set_result(detail)
+            return
+
+        for future in self.listeners.pop(data["action"], []):
+            if not future.done():
+                future.set_result(detail)
+
 
 class ExtensionComm:
-    def __init__(self):
-        self.clients: set[websockets.WebSocketServerProtocol] = set()
-        self.futures: dict[str, list[asyncio.Future]] = {}
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.clients: set[ExtensionClient] = set()
+        self.unclaimed: list[ExtensionClient] = []
+        self.new_client = asyncio.Condition()
+        self.message_ids = itertools.count(1)
+
+        # browsers start one at a time, so the extension that connects during a start belongs to that browser
+        self.start_lock = asyncio.Lock()
+        self.copy_dir: str | None = None
+        """where prepare_extension copies extensions to, removed when the server stops"""
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
 
     async def echo(self, websocket: websockets.WebSocketServerProtocol):
-        self.clients.add(websocket)
+        client = ExtensionClient(websocket, self.message_ids)
+        self.clients.add(client)
+        async with self.new_client:
+            self.unclaimed.append(client)
+            self.new_client.notify_all()
+
         try:
             async for message in websocket:
                 logger.debug(f"Received WS data: {message}")
-                data = json.loads(message)
-                action = data["action"]
-                detail = data["detail"]
-
-                futures = self.futures.get(action)
-                if not futures:
-                    continue
-
-                for future in futures:
-                    try:
-                        future.set_result(detail)
-                    except asyncio.InvalidStateError:
-                        continue
-                del self.futures[action]
+                client.handle(json.loads(message))
 
             await websocket.wait_closed()
-        except websockets.exceptions.ConnectionClosedError:
-            self.clients.remove(websocket)
+        except websockets.exceptions.ConnectionClosed:
+            pass
         except Exception as e:
             logger.exception("Error in WS server", e)
         finally:
-            self.clients.remove(websocket)
-
-    async def send(self, action: str, data: dict[str, Any] | None = None):
-        message = json.dumps(
-            {
-                "action": action,
-                "data": data
-            }
-        )
-        logger.debug(f"Sending WS data: {message}")
-        for client in self.clients:
-            await client.send(message)
+            client.closed = True
+            self.clients.discard(client)
+            if client in self.unclaimed:
+                self.unclaimed.remove(client)
 
-    async def add_listener(self, action: str) -> asyncio.Future:
-        future = asyncio.get_running_loop().create_future()
-        if action in self.futures:
-            self.futures[action].append(future)
-        else:
-            self.futures[action] = [future]
-        return future
+    def discard_unclaimed(self) -> None:
+        """forget connections that no browser claimed, they can't belong to the browser that starts next"""
+        self.unclaimed.clear()
+
+    async def claim_client(self, timeout: float = CLAIM_TIMEOUT) -> ExtensionClient:
+        async def _claim() -> ExtensionClient:
+            async with self.new_client:
+                while not self.unclaimed:
+                    await self.new_client.wait()
+                return self.unclaimed.pop(0)
+
+        try:
+            return await asyncio.wait_for(_claim(), timeout)
+        except asyncio.TimeoutError:
+            raise ExtensionNotConnected(f"The proxy extension didn't connect to {self.url} within {timeout}s")
+
+    def prepare_extension(self, path: str) -> str:
+        """
+        the extension reads the websocket url from its config.js. if we're not on the default port, use a copy of the
+        extension that points to ours
+        """
+        if self.host == DEFAULT_HOST and self.port == DEFAULT_PORT:
+            return path
+
+        if self.copy_dir is None:
+            self.copy_dir = tempfile.mkdtemp(prefix="xilriws-ext-")
+        copy_path = os.path.join(self.copy_dir, os.path.basename(os.path.normpath(path)))
+        shutil.copytree(path, copy_path)
+        with open(os.path.join(copy_path, "config.js"), "w") as f:
+            f.write(f"const XILRIWS_WS_URL = '{self.url}'\n")
+        return copy_path
 
     async def start(self):
-        async with websockets.serve(self.echo, "127.0.0.1", 9091):
-            await asyncio.Future()
+        try:
+            async with websockets.serve(self.echo, self.host, self.port):
+                await asyncio.Future()
+        finally:
+            self.remove_copies()
+
+    def remove_copies(self) -> None:
+        if self.copy_dir is not None:
+            shutil.rmtree(self.copy_dir, ignore_errors=True)
+            self.copy_dir = None
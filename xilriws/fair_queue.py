@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Awaitable, Callable, Mapping, TypeVar
+
+from prometheus_client import Counter, Histogram
+
+T = TypeVar("T")
+
+CLIENT_HEADER = "X-Xilriws-Client"
+# requests without a known client share this one
+OTHER_CLIENT = "other"
+
+CLIENT_QUEUE_WAIT = Histogram(
+    "xilriws_client_queue_wait_seconds",
+    "Time auth requests of each client waited for their turn to lease a cookie",
+    ("client",),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+CLIENT_LEASES = Counter("xilriws_client_leases", "Cookie leases handed to each client", ("client",))
+
+
+class FairQueue:
+    """
+    Weighted fair queuing of cookie leases across API clients. Requests take turns leasing a cookie, one at a time,
+    and while several clients are waiting they get turns in proportion to their shares, no matter how many requests
+    each of them sends. A client that's been quiet doesn't save up turns for later.
+
+    Every client waits in a queue of its own. The first request in each queue is tagged with a virtual finish time
+    (start-time fair queuing): the finish time of its client's last turn, or the current virtual time if that's later,
+    plus 1 / share. The turn goes to the lowest finish time. Requests that give up before they got a cookie don't
+    count.
+    """
+
+    def __init__(self, shares: Mapping[str, float] | None = None, keys: Mapping[str, str] | None = None):
+        """
+        shares are by client name, clients that aren't listed share OTHER_CLIENT (with a share of 1 if it's not
+        listed either). keys map API keys to client names, with keys clients can only identify with their key
+        """
+        self.shares = dict(shares or {})
+        self.keys = dict(keys or {})
+        self.virtual_time = 0.0
+        self.finish: dict[str, float] = {}
+        """finish time of each client's last turn"""
+        self.queues: dict[str, deque[asyncio.Future]] = {}
+        self.heads: list[tuple[float, int, float, str]] = []
+        """(finish, order, start, client) of the first request of every client that's waiting"""
+        self.tagged: set[str] = set()
+        """clients with an entry in heads"""
+        self.serving: str | None = None
+        """whose turn it is, its next request is tagged once the turn is over"""
+        self.busy = False
+        self.__order = itertools.count()
+
+    def client_of(self, header: str | None) -> str:
+        """
+        the client a request belongs to, by the value of its CLIENT_HEADER. once keys are configured, only a key
+        identifies a client, otherwise anyone could claim a client's share by sending its name
+        """
+        if header:
+            client = self.keys.get(header) if self.keys else header
+            if client in self.shares:
+                return client
+        return OTHER_CLIENT
+
+    def share(self, client: str) -> float:
+        return self.shares.get(client, 1.0)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for queue in self.queues.values() for turn in queue if not turn.done())
+
+    async def run(self, client: str, function: Callable[[], Awaitable[T]]) -> T:
+        """wait for the client's turn, then run function (which leases the cookie) before the next one's turn"""
+        queued = time.monotonic()
+        if self.busy:
+            turn = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(client, deque()).append(turn)
+            if client not in self.tagged and client != self.serving:
+                self.__tag(client)
+            try:
+                previous = await turn
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled():
+                    # the turn came right as the request gave up, pass it on
+                    self.__end_turn(client, turn.result(), used=False)
+                raise
+        else:
+            self.busy = True
+            previous = self.finish.get(client, 0.0)
+            start = max(self.virtual_time, previous)
+            self.__take_turn(client, start, start + 1 / self.__share(client))
+
+        CLIENT_QUEUE_WAIT.labels(client=client).observe(time.monotonic() - queued)
+        used = False
+        try:
+            result = await function()
+            used = True
+            CLIENT_LEASES.labels(client=client).inc()
+            return result
+        finally:
+            self.__end_turn(client, previous, used)
+
+    def __share(self, client: str) -> float:
+        return max(self.share(client), 1e-6)
+
+    def __tag(self, client: str) -> None:
+        """queue the first waiting request of client for a turn"""
+        start = max(self.virtual_time, self.finish.get(client, 0.0))
+        heapq.heappush(self.heads, (start + 1 / self.__share(client), next(self.__order), start, client))
+        self.tagged.add(client)
+
+    def __take_turn(self, client: str, start: float, finish: float) -> None:
+        self.virtual_time = max(self.virtual_time, start)
+        self.finish[client] = finish
+        self.serving = client
+
+    def __end_turn(self, client: str, previous: float, used: bool) -> None:
+        if not used:
+            # a turn that didn't get a cookie (like when the request ran out of time meanwhile) doesn't count
+            self.finish[client] = previous
+        self.serving = None
+
+        # the client's next request is only tagged now, with the finish time of this turn
+        queue = self.queues.get(client)
+        if queue is not None:
+            self.__drop_given_up(client)
+            if client in self.queues and client not in self.tagged:
+                self.__tag(client)
+        self.__next()
+
+    def __drop_given_up(self, client: str) -> None:
+        queue = self.queues[client]
+        while queue and queue[0].done():
+            queue.popleft()
+        if not queue:
+            del self.queues[client]
+
+    def __next(self) -> None:
+        while self.heads:
+            finish, _, start, client = heapq.heappop(self.heads)
+            self.tagged.discard(client)
+            self.__drop_given_up(client)
+            if client not in self.queues:
+                continue
+
+            previous = self.finish.get(client, 0.0)
+            self.__take_turn(client, start, finish)
+            self.queues[client].popleft().set_result(previous)
+            if not self.queues[client]:
+                del self.queues[client]
+            return
+        self.busy = False
@@ -0,0 +1,56 @@
+import json
+
+# resolves with the index of the first selector that matches an element, or -1 after timeout ms
+SELECTORS_SRC = """
+(selectors, timeout) => new Promise(resolve => {
+    const find = () => selectors.findIndex(selector => document.querySelector(selector));
+    const found = find();
+    if (found !== -1) {
+        return resolve(found);
+    }
+    const observer = new MutationObserver(() => {
+        const found = find();
+        if (found !== -1) {
+            observer.disconnect();
+            clearTimeout(timer);
+            resolve(found);
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+    const timer = setTimeout(() => {
+        observer.disconnect();
+        resolve(-1);
+    }, timeout);
+})
+"""
+
+# resolves with the page's html once it matches one of the patterns, or with the html it has after timeout ms
+CONTENT_SRC = """
+(patterns, timeout) => new Promise(resolve => {
+    const regexes = patterns.map(pattern => new RegExp(pattern, "i"));
+    const matches = () => regexes.some(regex => regex.test(document.documentElement.outerHTML));
+    if (matches()) {
+        return resolve(document.documentElement.outerHTML);
+    }
+    const observer = new MutationObserver(() => {
+        if (matches()) {
+            observer.disconnect();
+            clearTimeout(timer);
+            resolve(document.documentElement.outerHTML);
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, characterData: true, attributes: true});
+    const timer = setTimeout(() => {
+        observer.disconnect();
+        resolve(document.documentElement.outerHTML);
+    }, timeout);
+})
+"""
+
+
+def wait_for_selectors(selectors: list[str], timeout: float) -> str:
+    return f"({SELECTORS_SRC})({json.dumps(selectors)}, {int(timeout * 1000)})"
+
+
+def wait_for_content(patterns: list[str], timeout: float) -> str:
+    return f"({CONTENT_SRC})({json.dumps(patterns)}, {int(timeout * 1000)})"
@@ -1,2 +1,3 @@
 from .cion_mode import CionMode
 from .auth_mode import AuthMode
+from .dispatch_mode import DispatchMode
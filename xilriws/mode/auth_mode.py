@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+import json
+from dataclasses import asdict, dataclass
 from enum import Enum
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable
 
-from litestar import Litestar, Request, Response, post
+from litestar import Litestar, Request, Response, get, post
 from litestar.di import Provide
+from litestar.response import Stream
 from litestar.status_codes import (
     HTTP_200_OK,
     HTTP_400_BAD_REQUEST,
@@ -14,10 +18,14 @@ from litestar.status_codes import (
     HTTP_408_REQUEST_TIMEOUT,
 )
 from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, generate_latest
 
-from xilriws.browser import Browser
-from xilriws.constants import AUTH_TIMEOUT
-from xilriws.proxy import ProxyDistributor
+from xilriws.browser import BrowserAuth, FlightRecorder
+from xilriws.admission import ADMISSION_ESTIMATED_WAIT, ADMISSION_QUEUE_DEPTH, AdmissionControl, AdmissionRejected
+from xilriws.constants import AUTH_TIMEOUT, COOKIE_STORAGE_MAX, COOKIE_STORAGE_MIN
+from xilriws.cookie_store import CookieStore
+from xilriws.deadline import Deadline
+from xilriws.fair_queue import CLIENT_HEADER, OTHER_CLIENT, FairQueue
 from xilriws.proxy_dispenser import ProxyDispenser
 from xilriws.ptc_auth import InvalidCredentials, LoginException, PtcAuth, PtcBanned
 from xilriws.reese_cookie import CookieMonster
@@ -26,6 +34,8 @@ from .basic_mode import BasicMode
 
 logger = logger.bind(name="Xilriws")
 
+AUTH_RESPONSES = Counter("xilriws_auth_responses", "Responses of the login-code endpoint", ("status",))
+
 
 @dataclass
 class AuthRequest:
@@ -40,6 +50,7 @@ class AuthResponseStatus(Enum):
     INVALID = 3
     BANNED = 4
     TIMEOUT = 5
+    BUSY = 6
 
 
 @dataclass
@@ -49,24 +60,87 @@ class AuthResponse:
 
 
 @post("/api/v1/login-code")
-async def auth_endpoint(request: Request, ptc_auth: PtcAuth, data: AuthRequest) -> Response[AuthResponse]:
+async def auth_endpoint(
+    request: Request, ptc_auth: PtcAuth, admission: AdmissionControl, data: AuthRequest
+) -> Response[AuthResponse]:
+    client = ptc_auth.fair_queue.client_of(request.headers.get(CLIENT_HEADER))
+    return await login(ptc_auth, admission, data, client)
+
+
+@post("/api/v1/login-codes")
+async def batch_auth_endpoint(
+    request: Request, ptc_auth: PtcAuth, admission: AdmissionControl, batch_concurrency: int, data: list[AuthRequest]
+) -> Stream:
+    """
+    auth a list of accounts. results are streamed as NDJSON in the order they finish, each line is an AuthResponse
+    with the index of its request in the list
+    """
+    client = ptc_auth.fair_queue.client_of(request.headers.get(CLIENT_HEADER))
+    return Stream(
+        stream_logins(partial(login, ptc_auth, admission, client=client), batch_concurrency, data),
+        media_type="application/x-ndjson",
+        status_code=HTTP_200_OK,
+    )
+
+
+async def stream_logins(
+    login_function: Callable[[AuthRequest], Awaitable[Response[AuthResponse]]],
+    concurrency: int,
+    requests: list[AuthRequest],
+) -> AsyncIterator[str]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _login(index: int, data: AuthRequest) -> tuple[int, Response[AuthResponse]]:
+        async with semaphore:
+            return index, await login_function(data)
+
+    tasks = [asyncio.create_task(_login(index, data)) for index, data in enumerate(requests)]
     try:
-        login_code = await asyncio.wait_for(ptc_auth.auth(data.username, data.password, data.url), timeout=AUTH_TIMEOUT)
+        for next_done in asyncio.as_completed(tasks):
+            index, response = await next_done
+            yield json.dumps({"index": index, **asdict(response.content)}) + "\n"
+    finally:
+        # the client went away, don't keep authing for nobody
+        for task in tasks:
+            task.cancel()
+
+
+async def login(
+    ptc_auth: PtcAuth, admission: AdmissionControl, data: AuthRequest, client: str = OTHER_CLIENT
+) -> Response[AuthResponse]:
+    try:
+        deadline = Deadline(AUTH_TIMEOUT)
+        async with admission.admit():
+            login_code = await deadline.run(
+                ptc_auth.auth(data.username, data.password, data.url, deadline, client=client)
+            )
 
         logger.success("200 OK: successful auth")
+        AUTH_RESPONSES.labels(status=AuthResponseStatus.SUCCESS.name).inc()
         return Response(
             AuthResponse(login_code=login_code, status=AuthResponseStatus.SUCCESS.name), status_code=HTTP_200_OK
         )
     except InvalidCredentials:
         logger.warning("400 Bad Request: Invalid credentials")
+        AUTH_RESPONSES.labels(status=AuthResponseStatus.INVALID.name).inc()
         return Response(AuthResponse(status=AuthResponseStatus.INVALID.name), status_code=HTTP_400_BAD_REQUEST)
+    except AdmissionRejected as e:
+        logger.warning(f"{e.status_code}: {str(e)}")
+        AUTH_RESPONSES.labels(status=AuthResponseStatus.BUSY.name).inc()
+        return Response(
+            AuthResponse(status=AuthResponseStatus.BUSY.name),
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except PtcBanned:
         logger.warning("418: account is ptc-banned")
+        AUTH_RESPONSES.labels(status=AuthResponseStatus.BANNED.name).inc()
         return Response(AuthResponse(status=AuthResponseStatus.BANNED.name), status_code=HTTP_418_IM_A_TEAPOT)
     except LoginException as e:
         logger.error(f"Error: {str(e)}")
     except asyncio.TimeoutError:
         logger.error("408: Exceeded timeout")
+        AUTH_RESPONSES.labels(status=AuthResponseStatus.TIMEOUT.name).inc()
         return Response(
             AuthResponse(status=AuthResponseStatus.TIMEOUT.name),
             status_code=HTTP_408_REQUEST_TIMEOUT,
@@ -75,9 +149,40 @@ async def auth_endpoint(request: Request, ptc_auth: PtcAuth, data: AuthRequest)
         logger.exception(e)
 
     logger.warning("500 Internal Server Error: Additional output above")
+    AUTH_RESPONSES.labels(status=AuthResponseStatus.ERROR.name).inc()
     return Response(AuthResponse(status=AuthResponseStatus.ERROR.name), status_code=HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@get("/metrics")
+async def metrics_endpoint() -> Response[bytes]:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@dataclass
+class WorkerStatus:
+    remaining_uses: int
+    """uses left on the cookies in storage"""
+    waiting: int
+    """auth requests waiting for a cookie"""
+    queue_depth: int
+
+
+@get("/api/v1/status")
+async def status_endpoint(cookie_monster: CookieMonster, admission: AdmissionControl) -> WorkerStatus:
+    """how many auth requests this instance can serve right away, for the dispatcher in front of worker processes"""
+    return WorkerStatus(
+        remaining_uses=cookie_monster.cookies.remaining_uses(),
+        waiting=cookie_monster.cookies.waiting,
+        queue_depth=admission.depth,
+    )
+
+
+@get("/debug/acquisitions")
+async def acquisitions_endpoint(recorder: FlightRecorder, limit: int = 20) -> dict:
+    """timelines of the latest cookie acquisitions of the browsers, and which phases they spent their time in"""
+    return {"summary": recorder.summary(), "acquisitions": recorder.recent(limit)}
+
+
 @dataclass
 class ActivateRequest:
     email: str
@@ -103,9 +208,28 @@ async def activate_endpoint(data: ActivateRequest) -> ActivateResponse:
 
 
 class AuthMode(BasicMode):
-    def __init__(self, browser: Browser, proxies: ProxyDistributor, proxy_dispenser: ProxyDispenser):
-        self.cookie_monster = CookieMonster(browser, proxies, proxy_dispenser)
-        self.ptc_auth = PtcAuth(self.cookie_monster)
+    def __init__(
+        self,
+        browsers: list[BrowserAuth],
+        proxy_dispenser: ProxyDispenser,
+        max_queue: int = 500,
+        batch_concurrency: int = 10,
+        min_storage: int = COOKIE_STORAGE_MIN,
+        max_storage: int = COOKIE_STORAGE_MAX,
+        snapshot_path: str | None = None,
+        store: CookieStore | None = None,
+        fair_queue: FairQueue | None = None,
+        recorder: FlightRecorder | None = None,
+    ):
+        self.cookie_monster = CookieMonster(
+            browsers, proxy_dispenser, min_storage, max_storage, snapshot_path=snapshot_path, store=store
+        )
+        self.ptc_auth = PtcAuth(self.cookie_monster, fair_queue=fair_queue)
+        self.admission = AdmissionControl(self.cookie_monster, max_depth=max_queue)
+        ADMISSION_QUEUE_DEPTH.set_function(lambda: self.admission.depth)
+        ADMISSION_ESTIMATED_WAIT.set_function(self.admission.estimate_wait)
+        self.batch_concurrency = batch_concurrency
+        self.recorder = recorder if recorder is not None else FlightRecorder()
 
     async def prepare(self) -> None:
         await self.cookie_monster.prepare()
@@ -113,8 +237,34 @@ class AuthMode(BasicMode):
     async def _get_ptc_auth(self):
         return self.ptc_auth
 
+    async def _get_admission(self):
+        return self.admission
+
+    async def _get_batch_concurrency(self):
+        return self.batch_concurrency
+
+    async def _get_cookie_monster(self):
+        return self.cookie_monster
+
+    async def _get_recorder(self):
+        return self.recorder
+
     def get_litestar(self) -> Litestar:
         return Litestar(
-            route_handlers=[auth_endpoint, activate_endpoint],
-            dependencies={"ptc_auth": Provide(self._get_ptc_auth)}
+            route_handlers=[
+                auth_endpoint,
+                batch_auth_endpoint,
+                activate_endpoint,
+                metrics_endpoint,
+                status_endpoint,
+                acquisitions_endpoint,
+            ],
+            on_shutdown=[self.cookie_monster.save_snapshot],
+            dependencies={
+                "ptc_auth": Provide(self._get_ptc_auth),
+                "admission": Provide(self._get_admission),
+                "batch_concurrency": Provide(self._get_batch_concurrency),
+                "cookie_monster": Provide(self._get_cookie_monster),
+                "recorder": Provide(self._get_recorder),
+            },
         )
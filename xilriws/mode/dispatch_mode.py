@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import asdict
+from functools import partial
+from typing import Iterable
+
+import httpx
+from litestar import Litestar, Request, Response, get, post
+from litestar.di import Provide
+from litestar.response import Stream
+from litestar.status_codes import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_503_SERVICE_UNAVAILABLE
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, generate_latest
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.registry import Collector
+
+from xilriws.constants import AUTH_TIMEOUT
+from xilriws.fair_queue import CLIENT_HEADER
+from xilriws.single_flight import SingleFlight
+from xilriws.supervisor import SUPERVISOR_REGISTRY, Supervisor
+from xilriws.task_creator import task_creator
+
+from .auth_mode import AuthRequest, AuthResponse, AuthResponseStatus, activate_endpoint, stream_logins
+from .basic_mode import BasicMode
+
+logger = logger.bind(name="Dispatcher")
+
+STATUS_INTERVAL = 0.5
+# what clients are told to wait when no worker is up
+NO_WORKER_RETRY_AFTER = 5
+
+DISPATCHED_REQUESTS = Counter(
+    "xilriws_dispatched_requests",
+    "Auth requests forwarded to each worker process",
+    ("worker",),
+    registry=SUPERVISOR_REGISTRY,
+)
+DISPATCH_COALESCED = Counter(
+    "xilriws_dispatch_coalesced",
+    "Auth requests that got the result of an identical one that was dispatched already",
+    registry=SUPERVISOR_REGISTRY,
+)
+WORKER_READY_USES = Gauge(
+    "xilriws_worker_ready_uses",
+    "Cookie uses each worker process had ready at its last status",
+    ("worker",),
+    registry=SUPERVISOR_REGISTRY,
+)
+
+
+class Worker:
+    """A worker process as seen by the dispatcher, refreshed from its status endpoint"""
+
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        self.alive = False
+        self.ready_uses = 0
+        self.waiting = 0
+        self.dispatched = 0
+        """requests sent since the last status, they aren't part of it yet"""
+        self.in_flight = 0
+        WORKER_READY_USES.labels(worker=str(index)).set_function(lambda: self.ready_uses)
+
+    @property
+    def score(self) -> int:
+        return self.ready_uses - self.waiting - self.dispatched
+
+
+class Dispatcher:
+    """
+    Spreads auth requests across worker processes, each with its own browsers and cookie storage. A request goes to
+    the worker with the most cookie uses ready that aren't spoken for yet.
+    """
+
+    def __init__(self, workers: list[Worker]):
+        self.workers = workers
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(AUTH_TIMEOUT + 5, connect=2))
+        self.in_flight: SingleFlight[tuple[str, str, str], Response[AuthResponse]] = SingleFlight()
+
+    async def prepare(self) -> None:
+        for worker in self.workers:
+            task_creator.create_task(self.__watch(worker))
+
+    async def login(self, data: AuthRequest, client: str | None = None) -> Response[AuthResponse]:
+        """client is the request's CLIENT_HEADER, it's passed on so the workers lease cookies fairly"""
+        # duplicates could go to different workers, so they're coalesced here already
+        key = (data.username, data.password, data.url)
+        if key in self.in_flight:
+            logger.info(f"Auth for {data.username} is running already, waiting for its result")
+            DISPATCH_COALESCED.inc()
+        return await self.in_flight.run(key, partial(self.__forward, data, client))
+
+    async def __forward(self, data: AuthRequest, client: str | None) -> Response[AuthResponse]:
+        request_headers = {CLIENT_HEADER: client} if client else {}
+        tried: set[Worker] = set()
+        while worker := self.__pick(exclude=tried):
+            tried.add(worker)
+            worker.dispatched += 1
+            worker.in_flight += 1
+            DISPATCHED_REQUESTS.labels(worker=str(worker.index)).inc()
+            try:
+                response = await self.client.post(
+                    f"{worker.url}/api/v1/login-code", json=asdict(data), headers=request_headers
+                )
+                content = AuthResponse(**response.json())
+            except httpx.ConnectError:
+                # the request never reached the worker, so another one can take it
+                logger.warning(f"Worker {worker.index} isn't reachable")
+                worker.alive = False
+                continue
+            except (httpx.HTTPError, ValueError, TypeError) as e:
+                logger.error(f"Worker {worker.index} didn't answer properly: {str(e)}")
+                return Response(
+                    AuthResponse(status=AuthResponseStatus.ERROR.name), status_code=HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            finally:
+                worker.in_flight -= 1
+
+            headers = {}
+            if "Retry-After" in response.headers:
+                headers["Retry-After"] = response.headers["Retry-After"]
+            return Response(content, status_code=response.status_code, headers=headers)
+
+        logger.warning("503: no worker is available")
+        return Response(
+            AuthResponse(status=AuthResponseStatus.BUSY.name),
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(NO_WORKER_RETRY_AFTER)},
+        )
+
+    async def render_metrics(self) -> bytes:
+        """own metrics and those of all workers, with a worker label added to the latter"""
+        texts = await asyncio.gather(*(self.__get_metrics(worker) for worker in self.workers))
+        registry = CollectorRegistry(auto_describe=False)
+        worker_texts = [(str(worker.index), text) for worker, text in zip(self.workers, texts) if text]
+        registry.register(WorkerMetrics(worker_texts))
+        return generate_latest(SUPERVISOR_REGISTRY) + generate_latest(registry)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def __pick(self, exclude: set[Worker]) -> Worker | None:
+        candidates = [worker for worker in self.workers if worker.alive and worker not in exclude]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda worker: (worker.score, -worker.in_flight))
+
+    async def __get_metrics(self, worker: Worker) -> str | None:
+        try:
+            response = await self.client.get(f"{worker.url}/metrics", timeout=5)
+            return response.text
+        except httpx.HTTPError:
+            return None
+
+    async def __watch(self, worker: Worker) -> None:
+        while True:
+            try:
+                response = await self.client.get(f"{worker.url}/api/v1/status", timeout=STATUS_INTERVAL * 4)
+                status = response.json()
+                worker.ready_uses = status["remaining_uses"]
+                worker.waiting = status["waiting"]
+                worker.dispatched = 0
+                if not worker.alive:
+                    logger.info(f"Worker {worker.index} is up")
+                worker.alive = True
+            except (httpx.HTTPError, ValueError, KeyError):
+                worker.alive = False
+
+            await asyncio.sleep(STATUS_INTERVAL)
+
+
+class WorkerMetrics(Collector):
+    """
+    the metric families of all workers merged into one each, with the worker as a label of every sample. texts are
+    (worker, /metrics text) pairs
+    """
+
+    def __init__(self, texts: list[tuple[str, str]]):
+        self.texts = texts
+
+    def collect(self) -> Iterable[Metric]:
+        families: dict[str, Metric] = {}
+        for worker, text in self.texts:
+            try:
+                worker_families = list(text_string_to_metric_families(text))
+            except ValueError as e:
+                logger.warning(f"Couldn't parse the metrics of worker {worker}: {e}")
+                continue
+
+            for family in worker_families:
+                merged = families.get(family.name)
+                if merged is None:
+                    merged = Metric(family.name, family.documentation, family.type, family.unit)
+                    families[family.name] = merged
+                for sample in family.samples:
+                    merged.samples.append(sample._replace(labels={"worker": worker, **sample.labels}))
+        return families.values()
+
+
+@post("/api/v1/login-code")
+async def dispatch_auth_endpoint(request: Request, dispatcher: Dispatcher, data: AuthRequest) -> Response[AuthResponse]:
+    return await dispatcher.login(data, request.headers.get(CLIENT_HEADER))
+
+
+@post("/api/v1/login-codes")
+async def dispatch_batch_auth_endpoint(
+    request: Request, dispatcher: Dispatcher, batch_concurrency: int, data: list[AuthRequest]
+) -> Stream:
+    """like the batch endpoint of a worker, but every account is dispatched on its own"""
+    return Stream(
+        stream_logins(partial(dispatcher.login, client=request.headers.get(CLIENT_HEADER)), batch_concurrency, data),
+        media_type="application/x-ndjson",
+        status_code=HTTP_200_OK,
+    )
+
+
+@get("/metrics")
+async def dispatch_metrics_endpoint(dispatcher: Dispatcher) -> Response[bytes]:
+    return Response(await dispatcher.render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+class DispatchMode(BasicMode):
+    """the front of several worker processes that run AuthMode, started and kept alive by the supervisor"""
+
+    def __init__(self, supervisor: Supervisor, worker_urls: list[str], batch_concurrency: int = 10):
+        self.supervisor = supervisor
+        self.dispatcher = Dispatcher([Worker(index, url) for index, url in enumerate(worker_urls)])
+        self.batch_concurrency = batch_concurrency
+
+    async def prepare(self) -> None:
+        task_creator.create_task(self.supervisor.run())
+        await self.dispatcher.prepare()
+
+    async def shutdown(self) -> None:
+        await self.supervisor.stop()
+        await self.dispatcher.close()
+
+    async def _get_dispatcher(self):
+        return self.dispatcher
+
+    async def _get_batch_concurrency(self):
+        return self.batch_concurrency
+
+    def get_litestar(self) -> Litestar:
+        return Litestar(
+            route_handlers=[
+                dispatch_auth_endpoint,
+                dispatch_batch_auth_endpoint,
+                activate_endpoint,
+                dispatch_metrics_endpoint,
+            ],
+            on_shutdown=[self.shutdown],
+            dependencies={
+                "dispatcher": Provide(self._get_dispatcher),
+                "batch_concurrency": Provide(self._get_batch_concurrency),
+            },
+        )
@@ -1,45 +1,72 @@
 from __future__ import annotations
 
+import asyncio
+import math
 import time
 from copy import copy
 from typing import TYPE_CHECKING
-from urllib.parse import ParseResult, urlparse
+from urllib.parse import SplitResult, urlsplit
 
 from loguru import logger
 
 if TYPE_CHECKING:
-    from .extension_comm import ExtensionComm
+    from .extension_comm import ExtensionClient
 
 
 PROXY_TIMEOUT = 60 * 60
 
 
 class Proxy:
-    def __init__(self, url: str | None):
-        if isinstance(url, str):
-            if "://" not in url:
-                url = "http://" + url
-            url = urlparse(url)
-        elif url is None:
-            url = urlparse(url)
+    """
+    A configured proxy. Only the url and the cooldown state are stored, so even very long proxy lists stay small,
+    the parts of the url are parsed when they're needed (when switching a browser to the proxy)
+    """
 
-        self.full_url: ParseResult = url
+    __slots__ = ("full_url", "last_limited", "invalidated")
 
-        self.host = url.hostname
-        self.port = url.port
-        self.scheme = url.scheme
-        self.username = url.username
-        self.password = url.password
+    def __init__(self, url: str | None):
+        self.full_url: str | None = normalize_url(url) if url else None
+        """None for the local IP"""
+        if self.full_url is not None:
+            # fail early on urls that can't be used, like an invalid port
+            urlsplit(self.full_url).port
 
         self.last_limited: float = 0
         self.invalidated: bool = False
 
+    @property
+    def host(self) -> str | None:
+        return self.__parts().hostname
+
+    @property
+    def port(self) -> int | None:
+        return self.__parts().port
+
+    @property
+    def scheme(self) -> str:
+        return self.__parts().scheme
+
+    @property
+    def username(self) -> str | None:
+        return self.__parts().username
+
+    @property
+    def password(self) -> str | None:
+        return self.__parts().password
+
     @property
     def url(self):
         return f"{self.host}:{self.port}"
 
-    def is_good(self):
-        return not self.invalidated and self.last_limited + PROXY_TIMEOUT < time.time()
+    @property
+    def available_at(self) -> float:
+        """when the proxy can be used again, inf if it never can"""
+        if self.invalidated:
+            return math.inf
+        return self.last_limited + PROXY_TIMEOUT
+
+    def is_good(self, now: float | None = None):
+        return self.available_at < (time.time() if now is None else now)
 
     def rate_limited(self):
         self.last_limited = time.time()
@@ -47,15 +74,32 @@ class Proxy:
     def invalidate(self):
         self.invalidated = True
 
+    def __parts(self) -> SplitResult:
+        return urlsplit(self.full_url or "")
+
+
+
+def normalize_url(url: str) -> str:
+    """proxies without a scheme are http proxies"""
+    if "://" not in url:
+        return "http://" + url
+    return url
+
+
+def proxy_url(proxy: Proxy) -> str | None:
+    """identifies the proxy across restarts and instances, None for the local IP"""
+    if not proxy.host:
+        return None
+    return proxy.full_url
+
 
 logger = logger.bind(name="Proxy")
 
 
 class ProxyDistributor:
-    def __init__(self, ext_comm: ExtensionComm):
+    def __init__(self):
         self.next_proxy: Proxy | None = None
         self.current_proxy: Proxy | None = None
-        self.ext_comm = ext_comm
 
     def set_next_proxy(self, proxy: Proxy) -> bool:
         if self.current_proxy and self.current_proxy.host == proxy.host and self.current_proxy.port == proxy.port:
@@ -64,7 +108,8 @@ class ProxyDistributor:
         self.next_proxy = proxy
         return True
 
-    async def change_proxy(self, proxy: Proxy | None = None) -> bool:
+    async def change_proxy(self, client: ExtensionClient, proxy: Proxy | None = None) -> asyncio.Future | None:
+        """tell the browser's extension to use the next proxy. returns a future for its confirmation"""
         if proxy is not None:
             self.set_next_proxy(proxy)
 
@@ -72,14 +117,14 @@ class ProxyDistributor:
             self.current_proxy = copy(self.next_proxy)
 
         if self.current_proxy is None:
-            return False
+            return None
 
         if not self.current_proxy.host:
-            return False
+            return None
 
         logger.info(f"Switching to Proxy {self.current_proxy.host}:{self.current_proxy.port}")
 
-        await self.ext_comm.send(
+        return await client.request(
             "setProxy",
             {
                 "host": self.current_proxy.host,
@@ -89,4 +134,3 @@ class ProxyDistributor:
                 "username": self.current_proxy.username,
             }
         )
-        return True
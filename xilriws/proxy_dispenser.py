@@ -1,51 +1,243 @@
 from __future__ import annotations
 
-from .proxy import Proxy, ProxyDistributor
-from loguru import logger
-import time
 import asyncio
+import bisect
+import heapq
+import math
+import os
+import time
+
+from loguru import logger
+
+from .proxy import Proxy, ProxyDistributor, normalize_url
 
 logger = logger.bind(name="Proxy Dispenser")
 AUTH_TIMEOUT = 60 * 60
 
+# the rotation moves on to the next proxy after this many auth proxies were handed out
+ROTATE_AFTER = 100
+# how often to look again when all proxies are invalid
+NO_PROXY_RETRY = 5
+# how often the list file is checked for changes
+RELOAD_INTERVAL = 10
+
 
 class ProxyDispenser:
-    def __init__(self, list_path: str):
+    """
+    Hands out proxies for cookie acquisition, starting at a position in the list that moves on every ROTATE_AFTER
+    uses. Usable proxies are kept in a sorted index, the ones that are cooling down in a heap ordered by the time
+    they're usable again. Proxies get rate limited outside of the dispenser, that's noticed once they'd be handed out.
+
+    The list is read again when the file changes. Proxies that are still listed keep their cooldown.
+    """
+
+    def __init__(self, list_path: str, shard: int = 0, shard_count: int = 1):
+        """
+        with several worker processes, each one only uses every shard_count-th proxy starting at shard, so their
+        rate limits don't get in each other's way. if there are fewer proxies than shards, all of them are used
+        """
+        self.list_path = list_path
+        self.shard = shard
+        self.shard_count = shard_count
         self.proxies: list[Proxy] = []
-        with open(list_path, "r") as f:
-            for proxy_url in f.readlines():
-                if not proxy_url:
-                    continue
+        self.generation = 0
+        """counts the times the list changed, for anyone who keeps proxies by url"""
+        self.changed = asyncio.Event()
+        self.__file_state: tuple[float, int] | None = None
+
+        self.current_auth_index = 0
+        self.current_proxy_uses = 0
+        self.available: list[int] = []
+        """indices of proxies that were usable when last looked at, sorted"""
+        self.cooling: list[tuple[float, int]] = []
+        """(available_at, index) of the proxies that aren't usable"""
+
+        self.reload()
+
+    def reload(self) -> bool:
+        """read the list again if the file changed since the last time. returns whether the proxies changed"""
+        loaded = self.__load()
+        if loaded is None:
+            return False
+        self.__apply(*loaded)
+        return True
+
+    async def reload_task(self):
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            try:
+                # reading and parsing a large list takes a while, the event loop only has to swap it in
+                loaded = await asyncio.to_thread(self.__load)
+                if loaded is not None:
+                    self.__apply(*loaded)
+            except Exception as e:
+                logger.error(f"{str(e)} while reloading proxies")
+
+    def __load(self) -> tuple[tuple[float, int], list[Proxy], set[Proxy]] | None:
+        """
+        the file state, the proxies and which of them are new, if the file changed. only reads the current proxies,
+        so it can run in another thread
+        """
+        try:
+            stat = os.stat(self.list_path)
+            file_state = (stat.st_mtime, stat.st_size)
+            if file_state == self.__file_state:
+                return None
+            with open(self.list_path, "r") as f:
+                lines = f.readlines()
+        except OSError as e:
+            if not self.proxies:
+                raise
+            logger.warning(f"Couldn't read {self.list_path}, keeping the current proxies: {str(e)}")
+            return None
+
+        # proxies that are still listed are kept, with their cooldown. the same url may be listed several times
+        previous: dict[str | None, list[Proxy]] = {}
+        for proxy in reversed(self.proxies):
+            previous.setdefault(proxy.full_url, []).append(proxy)
+
+        proxies: list[Proxy] = []
+        new_proxies: set[Proxy] = set()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
 
-                proxy_url = proxy_url.strip()
+            url = None if line.lower() == "local" else normalize_url(line)
+            kept = previous.get(url)
+            if kept:
+                proxies.append(kept.pop())
+                continue
 
-                if proxy_url.lower() == "local":
-                    proxy_url = None
+            try:
+                proxy = Proxy(url)
+            except Exception as e:
+                logger.error(f"There was a problem parsing proxy {line}: {str(e)}")
+                continue
+            proxies.append(proxy)
+            new_proxies.add(proxy)
 
-                try:
-                    self.proxies.append(Proxy(proxy_url))
-                except Exception as e:
-                    logger.error(f"There was a problem parsing proxy {proxy_url}: {str(e)}")
+        if len(proxies) >= self.shard_count:
+            proxies = proxies[self.shard :: self.shard_count]
 
-        if not self.proxies:
+        if not proxies:
             logger.warning("No configured proxies! Using local IP only")
-            self.proxies.append(Proxy(None))
+            proxies.append(Proxy(None))
 
+        return file_state, proxies, new_proxies
+
+    def __apply(self, file_state: tuple[float, int], proxies: list[Proxy], new_proxies: set[Proxy]) -> None:
+        if self.__file_state is not None:
+            added = sum(1 for proxy in proxies if proxy in new_proxies)
+            removed = len(self.proxies) - (len(proxies) - added)
+            logger.info(f"Reloaded {len(proxies)} proxies ({added} added, {removed} removed)")
+
+        self.__file_state = file_state
+        self.__use(proxies)
+
+    def __use(self, proxies: list[Proxy]) -> None:
+        current = self.proxies[self.current_auth_index] if self.proxies else None
+        self.proxies = proxies
+        self.generation += 1
+
+        # stay at the same proxy in the rotation if it's still there
         self.current_auth_index = 0
-        self.current_proxy_uses = 0
+        if current is not None:
+            for index, proxy in enumerate(proxies):
+                if proxy is current:
+                    self.current_auth_index = index
+                    break
 
-    async def get_auth_proxy(self) -> Proxy:
+        now = time.time()
+        self.available = []
+        self.cooling = []
+        for index, proxy in enumerate(self.proxies):
+            if proxy.is_good(now):
+                self.available.append(index)
+            else:
+                self.cooling.append((proxy.available_at, index))
+        heapq.heapify(self.cooling)
+
+        # waiters look again, there may be usable proxies now
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def get_auth_proxy(self, taken: set[Proxy] | None = None) -> Proxy:
+        """
+        taken are proxies that are currently used by other browsers. they're only handed out again if there's
+        no other proxy available
+        """
         self.current_proxy_uses += 1
-        if self.current_proxy_uses > 100:
+        if self.current_proxy_uses > ROTATE_AFTER:
             self.current_auth_index = (self.current_auth_index + 1) % len(self.proxies)
             self.current_proxy_uses = 0
 
         while True:
-            for i, proxy in enumerate(self.proxies):
-                if i >= self.current_auth_index and proxy.is_good():
-                    return proxy
+            now = time.time()
+            self.__wake_up(now)
 
-            logger.error("No free Proxies!")
-            self.current_auth_index = 0
-            self.current_proxy_uses = 0
-            await asyncio.sleep(5)
+            proxy = self.__pick(now, taken)
+            if proxy is not None:
+                return proxy
+
+            next_available = self.cooling[0][0] if self.cooling else math.inf
+            if next_available == math.inf:
+                logger.error("No usable proxies left!")
+                await self.__wait(NO_PROXY_RETRY)
+                continue
+
+            logger.error(f"No free Proxies! The next one is usable in {next_available - now:.0f}s")
+            await self.__wait(max(0.0, next_available - now))
+
+    async def __wait(self, timeout: float) -> None:
+        """sleep for timeout, or until the list changed"""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def __pick(self, now: float, taken: set[Proxy] | None) -> Proxy | None:
+        """the first usable proxy from the current position on, wrapping around. a taken one only if that's all"""
+        shared_proxy: Proxy | None = None
+        position = bisect.bisect_left(self.available, self.current_auth_index)
+
+        while self.available:
+            if position >= len(self.available):
+                position = 0
+            index = self.available[position]
+            proxy = self.proxies[index]
+
+            if not proxy.is_good(now):
+                # limited since it was last looked at. neighbours often are too (like after a ban wave), they're
+                # dropped in one go since every removal moves the rest of the list
+                end = position + 1
+                while end < len(self.available) and not self.proxies[self.available[end]].is_good(now):
+                    end += 1
+                for stale in self.available[position:end]:
+                    self.__cool_down(stale)
+                del self.available[position:end]
+                continue
+
+            if not taken or proxy not in taken:
+                return proxy
+            if shared_proxy is None:
+                shared_proxy = proxy
+            elif proxy is shared_proxy:
+                # went around once, everything is taken
+                break
+            position += 1
+
+        return shared_proxy
+
+    def __wake_up(self, now: float) -> None:
+        """move the proxies whose cooldown is over back to the usable ones"""
+        while self.cooling and self.cooling[0][0] < now:
+            _, index = heapq.heappop(self.cooling)
+            if self.proxies[index].is_good(now):
+                bisect.insort(self.available, index)
+            else:
+                # limited again while cooling down
+                self.__cool_down(index)
+
+    def __cool_down(self, index: int) -> None:
+        heapq.heappush(self.cooling, (self.proxies[index].available_at, index))
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from enum import Enum
+
+from .ptc_utils import get_imperva_error_code
+
+INCAPSULA_MARKER = "Request unsuccessful. Incapsula"
+INCORRECT_CREDENTIALS = "Your username or password is incorrect."
+ACCOUNT_DISABLED = "your account has been disabled for"
+ACCOUNT_BANNED = (
+    "We are unable to log you in to this account. Please contact Customer Service for additional details."
+)
+
+LOGIN_CODE_PREFIX = "pokemongo://state="
+CSRF_PREFIX = 'name="_csrf" value="'
+CHALLENGE_PREFIX = 'name="challenge" value="'
+
+# markers are located with str.find, the regexes only run anchored at the position that was found
+LOGIN_CODE_REGEX = re.compile(r"pokemongo://state=(.*?)(?:,code=(.*?))?(?='|$)")
+CSRF_REGEX = re.compile(r'name="_csrf" value="(.*?)">')
+CHALLENGE_REGEX = re.compile(r'name="challenge" value="(.*?)">')
+
+
+class ErrorReason(Enum):
+    INCORRECT_CREDENTIALS = 1
+    ACCOUNT_DISABLED = 2
+    ACCOUNT_BANNED = 3
+    UNKNOWN = 4
+
+
+@dataclass
+class PtcResponse:
+    status_code: int
+    text: str
+
+
+@dataclass
+class ImpervaBlock(PtcResponse):
+    code: str
+    reason: str
+
+
+@dataclass
+class Banned(PtcResponse):
+    """418 from PTC"""
+
+    pass
+
+
+@dataclass
+class UnexpectedStatus(PtcResponse):
+    pass
+
+
+@dataclass
+class Form:
+    csrf: str
+    challenge: str
+
+
+@dataclass
+class ErrorPage(PtcResponse):
+    reason: ErrorReason
+    form: Form | None
+
+
+@dataclass
+class LoginForm(PtcResponse):
+    """a page with a form to post to, like the login or consent page"""
+
+    form: Form
+
+
+@dataclass
+class LoginCode(PtcResponse):
+    code: str
+
+
+@dataclass
+class UnknownPage(PtcResponse):
+    pass
+
+
+def _find_form(text: str) -> Form | None:
+    csrf = _find_value(text, CSRF_PREFIX, CSRF_REGEX)
+    if csrf is None:
+        return None
+    challenge = _find_value(text, CHALLENGE_PREFIX, CHALLENGE_REGEX)
+    if challenge is None:
+        return None
+    return Form(csrf, challenge)
+
+
+def _find_value(text: str, prefix: str, regex: re.Pattern) -> str | None:
+    pos = text.find(prefix)
+    if pos == -1:
+        return None
+    match = regex.match(text, pos)
+    return match.group(1) if match else None
+
+
+def _find_login_code(text: str) -> str | None:
+    pos = text.find(LOGIN_CODE_PREFIX)
+    while pos != -1:
+        match = LOGIN_CODE_REGEX.match(text, pos)
+        if match and match.group(2):
+            return match.group(2)
+        pos = text.find(LOGIN_CODE_PREFIX, pos + 1)
+    return None
+
+
+def _find_error_reason(text: str) -> ErrorReason:
+    if INCORRECT_CREDENTIALS in text:
+        return ErrorReason.INCORRECT_CREDENTIALS
+    if ACCOUNT_DISABLED in text:
+        return ErrorReason.ACCOUNT_DISABLED
+    if ACCOUNT_BANNED in text:
+        return ErrorReason.ACCOUNT_BANNED
+    return ErrorReason.UNKNOWN
+
+
+def classify(status_code: int, text: str) -> PtcResponse:
+    """
+    tell what kind of page a PTC response is. checks run in order of precedence and stop at the first one that
+    matches, so a body is never searched for something that doesn't matter anymore
+    """
+    if status_code == 403 or INCAPSULA_MARKER in text:
+        code, reason = get_imperva_error_code(text)
+        return ImpervaBlock(status_code, text, code, reason)
+
+    if status_code == 418:
+        return Banned(status_code, text)
+
+    if status_code != 200:
+        return UnexpectedStatus(status_code, text)
+
+    code = _find_login_code(text)
+    if code:
+        return LoginCode(status_code, text, code)
+
+    form = _find_form(text)
+
+    if "error-message" in text:
+        return ErrorPage(status_code, text, _find_error_reason(text), form)
+
+    if form:
+        return LoginForm(status_code, text, form)
+
+    return UnknownPage(status_code, text)
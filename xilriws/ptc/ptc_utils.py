@@ -40,8 +40,11 @@ IMPERVA_ERROR_CODES = {
 }
 
 
+EDET_REGEX = re.compile(r"edet=(\d*)&")
+
+
 def get_imperva_error_code(text: str) -> tuple[str, str]:
-    code_match = re.search(r"edet=(\d*)&", text)
+    code_match = EDET_REGEX.search(text)
     if code_match and code_match.group(1):
         code = code_match.group(1)
         error = IMPERVA_ERROR_CODES.get(code, "Unknown reason")
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator
+
+from curl_cffi import requests
+from loguru import logger
+
+from xilriws.ptc import ptc_utils
+from xilriws.task_creator import task_creator
+
+if TYPE_CHECKING:
+    from xilriws.reese_cookie import ReeseCookie
+
+logger = logger.bind(name="PTC")
+
+
+class SessionPool:
+    """
+    Idle curl sessions per cookie (and with that, per proxy). A session keeps its connections to PTC and the proxy
+    alive, so only the first request with a cookie pays for the TCP, TLS and CONNECT handshakes. The cookie jar is
+    reset every time a session is handed out, so nothing from the previous account is carried over.
+    """
+
+    def __init__(self):
+        self.idle: dict[ReeseCookie, list[requests.AsyncSession]] = {}
+
+    @asynccontextmanager
+    async def session(self, cookie: ReeseCookie) -> AsyncIterator[requests.AsyncSession]:
+        sessions = self.idle.setdefault(cookie, [])
+        session = sessions.pop() if sessions else self.__new_session(cookie)
+
+        session.cookies.clear()
+        session.cookies.update(cookie.cookies)
+
+        try:
+            yield session
+        finally:
+            if cookie in self.idle:
+                self.idle[cookie].append(session)
+            else:
+                task_creator.create_task(self.__close(session))
+
+    def discard(self, cookie: ReeseCookie) -> None:
+        """close all sessions of a cookie that won't be used anymore"""
+        for session in self.idle.pop(cookie, []):
+            task_creator.create_task(self.__close(session))
+
+    def __len__(self):
+        return sum(len(sessions) for sessions in self.idle.values())
+
+    def __new_session(self, cookie: ReeseCookie) -> requests.AsyncSession:
+        return requests.AsyncSession(
+            headers={
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "en-us",
+                "Connection": "keep-alive",
+                "Accept-Encoding": "gzip, deflate, br",
+                "User-Agent": ptc_utils.USER_AGENT,
+            },
+            allow_redirects=True,
+            verify=False,
+            timeout=10,
+            proxy=cookie.proxy.full_url,
+            impersonate="chrome",
+        )
+
+    async def __close(self, session: requests.AsyncSession) -> None:
+        try:
+            await session.close()
+        except Exception as e:
+            logger.debug(f"{str(e)} while closing session")
@@ -1,20 +1,39 @@
 from __future__ import annotations
 
-import re
+import time
+from functools import partial
 from typing import TYPE_CHECKING
 
-import httpx
 from loguru import logger
-from curl_cffi import requests
-
-from .constants import ACCESS_URL, COOKIE_STORAGE
-from xilriws.ptc import ptc_utils
+from prometheus_client import Counter, Histogram
+from .constants import ACCESS_URL, AUTH_TIMEOUT, COOKIE_STORAGE
+from .deadline import Deadline, DeadlineExceeded
+from .fair_queue import OTHER_CLIENT, FairQueue
+from .single_flight import SingleFlight
+from xilriws.ptc import ptc_response
+from xilriws.ptc.session_pool import SessionPool
 
 if TYPE_CHECKING:
     from .reese_cookie import CookieMonster, ReeseCookie
 
 logger = logger.bind(name="PTC")
 
+AUTH_STAGE_SECONDS = Histogram(
+    "xilriws_auth_stage_seconds", "Duration of the PTC requests during auth", labelnames=("stage",)
+)
+AUTH_ATTEMPTS = Histogram(
+    "xilriws_auth_attempts", "Cookies used per auth request", buckets=tuple(range(1, COOKIE_STORAGE + 2))
+)
+AUTH_RETRIES_SKIPPED = Counter(
+    "xilriws_auth_retries_skipped", "Retries that weren't started because they couldn't finish before the deadline"
+)
+AUTH_COALESCED = Counter(
+    "xilriws_auth_coalesced", "Auth requests that got the result of an identical one that was running already"
+)
+
+# timeout of a single PTC request, if the deadline leaves that much time
+STAGE_TIMEOUT = 10
+
 
 class LoginException(Exception):
     """generic login exception, don't log the traceback"""
@@ -34,10 +53,52 @@ class PtcBanned(Exception):
 
 
 class PtcAuth:
-    def __init__(self, cookie_monster: CookieMonster):
+    def __init__(
+        self, cookie_monster: CookieMonster, access_url: str = ACCESS_URL, fair_queue: FairQueue | None = None
+    ):
         self.cookie_monster = cookie_monster
-
-    async def auth(self, username: str, password: str, full_url: str) -> str:
+        self.access_url = access_url
+        self.fair_queue = fair_queue if fair_queue is not None else FairQueue()
+        self.sessions = SessionPool()
+        self.attempt_seconds = 0.0
+        """how long an attempt with one cookie usually takes"""
+        self.in_flight: SingleFlight[tuple[str, str, str], str] = SingleFlight()
+        cookie_monster.add_retire_listener(self.sessions.discard)
+        # requests queue for their turn before they lease, so they aren't counted by the cookie store itself
+        cookie_monster.count_queued(lambda: self.fair_queue.waiting)
+
+    async def auth(
+        self,
+        username: str,
+        password: str,
+        full_url: str,
+        deadline: Deadline | None = None,
+        client: str = OTHER_CLIENT,
+    ) -> str:
+        """
+        deadline is when the client gives up. attempts are only started if they can finish before it, their requests
+        don't wait past it. client is who sent the request, cookies are leased fairly between clients.
+        a duplicate of an auth that's still running (same account and url, like a client retrying after its own
+        timeout) waits for that one's result instead of using cookies of its own
+        """
+        if deadline is None:
+            deadline = Deadline(AUTH_TIMEOUT)
+
+        key = (username, password, full_url)
+        while True:
+            if key in self.in_flight:
+                logger.info(f"Auth for {username} is running already, waiting for its result")
+                AUTH_COALESCED.inc()
+            try:
+                return await self.in_flight.run(
+                    key, partial(self.__auth, username, password, full_url, deadline, client)
+                )
+            except DeadlineExceeded:
+                # the auth this one joined may have had less time left, then it's tried again
+                if not deadline.allows(self.attempt_seconds):
+                    raise
+
+    async def __auth(self, username: str, password: str, full_url: str, deadline: Deadline, client: str) -> str:
         logger.info(f"Starting auth for {username}")
 
         # proxies = None
@@ -45,138 +106,158 @@ class PtcAuth:
         #     proxies = {"http://": proxy, "https://": proxy}
 
         attempts = COOKIE_STORAGE + 1
-        while attempts > 0:
-            attempts -= 1
-            cookie = await self.cookie_monster.get_reese_cookie()
-
-            async with requests.AsyncSession(
-                headers={
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "Accept-Language": "en-us",
-                    "Connection": "keep-alive",
-                    "Accept-Encoding": "gzip, deflate, br",
-                    "User-Agent": ptc_utils.USER_AGENT,
-                },
-                allow_redirects=True,
-                verify=False,
-                timeout=10,
-                proxy=cookie.proxy.full_url.geturl(),
-                cookies=cookie.cookies,
-                impersonate="chrome",
-            ) as client:
-                logger.info("Calling OAUTH page")
-
+        used_attempts = 0
+        try:
+            while used_attempts < attempts:
+                if not deadline.allows(self.attempt_seconds):
+                    # leasing a cookie would use it up for nothing
+                    if used_attempts:
+                        AUTH_RETRIES_SKIPPED.inc()
+                    raise DeadlineExceeded(f"No time for another attempt, {deadline.remaining():.1f}s left")
+
+                used_attempts += 1
+                cookie = await self.lease_cookie(deadline, client)
+
+                started = time.monotonic()
                 try:
-                    resp = await client.get(full_url)
-                except Exception as e:
-                    logger.error(f"Error {str(e)} during OAUTH")
-                    continue
+                    login_code = await self.__attempt(cookie, username, password, full_url, deadline)
+                finally:
+                    self.cookie_monster.return_cookie(cookie)
+                    self.attempt_seconds = 0.8 * self.attempt_seconds + 0.2 * (time.monotonic() - started)
+                if login_code is not None:
+                    return login_code
+        finally:
+            AUTH_ATTEMPTS.observe(used_attempts)
 
-                if not await self.__check_status(resp, cookie):
-                    continue
-
-                csrf, challenge = self.__extract_csrf_and_challenge(resp.text)
-
-                logger.info("Calling LOGIN page")
+        raise LoginException("Exceeded max retries during PTC auth")
 
-                try:
+    async def lease_cookie(self, deadline: Deadline, client: str = OTHER_CLIENT) -> ReeseCookie:
+        """
+        wait for the client's turn and lease a cookie for an attempt. it has to be handed back using
+        cookie_monster.return_cookie once the attempt is done
+        """
+        return await deadline.run(self.fair_queue.run(client, partial(self.__lease, deadline)))
+
+    async def __lease(self, deadline: Deadline) -> ReeseCookie:
+        # waiting for the turn may have used up the time
+        if not deadline.allows(self.attempt_seconds):
+            raise DeadlineExceeded(f"No time left after waiting for a cookie, {deadline.remaining():.1f}s left")
+        return await self.cookie_monster.get_reese_cookie(deadline)
+
+    async def __attempt(
+        self, cookie: ReeseCookie, username: str, password: str, full_url: str, deadline: Deadline
+    ) -> str | None:
+        """run the PTC login flow with one cookie. returns None if it should be retried with another cookie"""
+        async with self.sessions.session(cookie) as client:
+            logger.info("Calling OAUTH page")
+
+            timeout = deadline.timeout(STAGE_TIMEOUT)
+            try:
+                with AUTH_STAGE_SECONDS.labels(stage="oauth").time():
+                    resp = await client.get(full_url, timeout=timeout)
+            except Exception as e:
+                logger.error(f"Error {str(e)} during OAUTH")
+                return None
+
+            oauth_page = ptc_response.classify(resp.status_code, resp.text)
+            if not await self.__check_status(oauth_page, cookie):
+                return None
+
+            if not isinstance(oauth_page, (ptc_response.LoginForm, ptc_response.ErrorPage)) or not oauth_page.form:
+                raise LoginException("Couldn't find CSRF or challenge in Auth response")
+
+            logger.info("Calling LOGIN page")
+
+            timeout = deadline.timeout(STAGE_TIMEOUT)
+            try:
+                with AUTH_STAGE_SECONDS.labels(stage="login").time():
                     login_resp = await client.post(
-                        ACCESS_URL + "login",
+                        self.access_url + "login",
+                        timeout=timeout,
                         headers={"Content-Type": "application/x-www-form-urlencoded"},
-                        data={"_csrf": csrf, "challenge": challenge, "email": username, "password": password},
+                        data={
+                            "_csrf": oauth_page.form.csrf,
+                            "challenge": oauth_page.form.challenge,
+                            "email": username,
+                            "password": password,
+                        },
                     )
-                except Exception as e:
-                    logger.error(f"Error {str(e)} during LOGIN")
-                    continue
-
-                if not await self.__check_status(login_resp, cookie):
-                    continue
-
-                login_code = self.__extract_login_code(login_resp.text)
-
-                if not login_code:
-                    if "error-message" in login_resp.text:
-                        self.check_error_on_login_page(login_resp.text)
-                        logger.error(
-                            f"Please send this to Malte on Discord (error page after login)\n{login_resp.text}"
-                        )
-                        raise LoginException("Login failed, probably invalid credentials")
-
-                    logger.info("Calling CONSENT page")
-
-                    try:
-                        logger.debug(login_resp.text)
-                        csrf_consent, challenge_consent = self.__extract_csrf_and_challenge(login_resp.text)
-                    except LoginException:
-                        logger.error(f"Could not find a CSRF token for account {username} - it's probably unactivated")
-                        raise InvalidCredentials()
-
-                    try:
-                        resp_consent = await client.post(
-                            ACCESS_URL + "consent",
-                            data={"challenge": challenge_consent, "_csrf": csrf_consent, "allow_submit": "Allow"},
-                        )
-                    except Exception as e:
-                        logger.error(f"Error {str(e)} during CONSENT")
-                        continue
-
-                    if not await self.__check_status(resp_consent, cookie):
-                        continue
-
-                    login_code = self.__extract_login_code(resp_consent.text)
-                    if not login_code:
-                        raise LoginException("No Login Code after consent, please check account")
-                return login_code
+            except Exception as e:
+                logger.error(f"Error {str(e)} during LOGIN")
+                return None
+
+            login_page = ptc_response.classify(login_resp.status_code, login_resp.text)
+            if not await self.__check_status(login_page, cookie):
+                return None
+
+            if isinstance(login_page, ptc_response.LoginCode):
+                return login_page.code
+
+            if isinstance(login_page, ptc_response.ErrorPage):
+                self.check_error_on_login_page(login_page)
+
+            logger.info("Calling CONSENT page")
+            logger.debug(login_page.text)
+
+            if not isinstance(login_page, ptc_response.LoginForm):
+                logger.error(f"Could not find a CSRF token for account {username} - it's probably unactivated")
+                raise InvalidCredentials()
+
+            timeout = deadline.timeout(STAGE_TIMEOUT)
+            try:
+                with AUTH_STAGE_SECONDS.labels(stage="consent").time():
+                    resp_consent = await client.post(
+                        self.access_url + "consent",
+                        timeout=timeout,
+                        data={
+                            "challenge": login_page.form.challenge,
+                            "_csrf": login_page.form.csrf,
+                            "allow_submit": "Allow",
+                        },
+                    )
+            except Exception as e:
+                logger.error(f"Error {str(e)} during CONSENT")
+                return None
 
-        raise LoginException("Exceeded max retries during PTC auth")
+            consent_page = ptc_response.classify(resp_consent.status_code, resp_consent.text)
+            if not await self.__check_status(consent_page, cookie):
+                return None
 
-    async def __check_status(self, resp: httpx.Response, cookie: ReeseCookie) -> bool:
-        if resp.status_code == 403 or "Request unsuccessful. Incapsula" in resp.text:
-            await self.handle_imperva_error(resp.text, cookie)
+            if not isinstance(consent_page, ptc_response.LoginCode):
+                raise LoginException("No Login Code after consent, please check account")
+            return consent_page.code
+
+    async def __check_status(self, page: ptc_response.PtcResponse, cookie: ReeseCookie) -> bool:
+        if isinstance(page, ptc_response.ImpervaBlock):
+            await self.handle_imperva_error(page, cookie)
             return False
 
-        logger.debug(f"PTC response: {resp.status_code} | {resp.text}")
+        logger.debug(f"PTC response: {page.status_code} | {page.text}")
 
-        if resp.status_code == 418:
+        if isinstance(page, ptc_response.Banned):
             raise PtcBanned()
 
-        if resp.status_code != 200:
-            raise LoginException(f"PTC: {resp.status_code} but expected 200 - {resp.text}")
+        if isinstance(page, ptc_response.UnexpectedStatus):
+            raise LoginException(f"PTC: {page.status_code} but expected 200 - {page.text}")
 
         return True
 
-    async def handle_imperva_error(self, html: str, cookie: ReeseCookie):
-        imp_code, imp_reason = ptc_utils.get_imperva_error_code(html)
+    async def handle_imperva_error(self, page: ptc_response.ImpervaBlock, cookie: ReeseCookie):
         await self.cookie_monster.remove_cookie(cookie)
         cookie.proxy.rate_limited()
         logger.warning(
-            f"Error code {imp_code} ({imp_reason}) during PTC request, trying again with another proxy (Proxy: {cookie.proxy.url})"
+            f"Error code {page.code} ({page.reason}) during PTC request, trying again with another proxy (Proxy: {cookie.proxy.url})"
         )
 
-    def check_error_on_login_page(self, content: str):
-        if "Your username or password is incorrect." in content:
+    def check_error_on_login_page(self, page: ptc_response.ErrorPage):
+        if page.reason == ptc_response.ErrorReason.INCORRECT_CREDENTIALS:
             logger.warning("BROWSER: Incorrect credentials")
             raise InvalidCredentials("Incorrect account credentials")
-        elif "your account has been disabled for" in content:
+        elif page.reason == ptc_response.ErrorReason.ACCOUNT_DISABLED:
             logger.error("BROWSER: Account is temporarily disabled")
             raise InvalidCredentials("Account temporarily disabled")
-        elif "We are unable to log you in to this account. Please contact Customer Service for additional details." in content:
+        elif page.reason == ptc_response.ErrorReason.ACCOUNT_BANNED:
             raise PtcBanned()
 
-    def __extract_login_code(self, html) -> str | None:
-        matches = re.search(r"pokemongo://state=(.*?)(?:,code=(.*?))?(?='|$)", html)
-
-        if matches and len(matches.groups()) == 2:
-            return matches.group(2)
-
-    def __extract_csrf_and_challenge(self, html: str) -> tuple[str, str]:
-        csrf_regex = re.compile(r'name="_csrf" value="(.*?)">')
-        challenge_regex = re.compile(r'name="challenge" value="(.*?)">')
-
-        csrf_matches = csrf_regex.search(html)
-        challenge_matches = challenge_regex.search(html)
-
-        if csrf_matches and challenge_matches:
-            return csrf_matches.group(1), challenge_matches.group(1)
-
-        raise LoginException("Couldn't find CSRF or challenge in Auth response")
+        logger.error(f"Please send this to Malte on Discord (error page after login)\n{page.text}")
+        raise LoginException("Login failed, probably invalid credentials")
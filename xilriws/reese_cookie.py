@@ -1,33 +1,54 @@
 from __future__ import annotations
 
 import asyncio
+import math
 import time
-from typing import TYPE_CHECKING
+from collections import deque
+from typing import TYPE_CHECKING, Callable
 
 from loguru import logger
+from prometheus_client import Gauge, Histogram
 
-from .constants import EXPIRATION, MAX_USES, COOKIE_STORAGE
-from .proxy import ProxyDistributor, Proxy
+from .constants import COOKIE_STORAGE_MAX, COOKIE_STORAGE_MIN, DEMAND_WINDOW, EXPIRATION, MAX_USES
+from .cookie_pool import CookiePool
+from .cookie_store import CookieStore
+from .cookie_snapshot import CookieSnapshot
+from .proxy import Proxy
 from .proxy_dispenser import ProxyDispenser
-from .task_creator import task_creator, AwaitableSet
+from .task_creator import task_creator
 
 if TYPE_CHECKING:
     from .browser.browser_auth import BrowserAuth
+    from .deadline import Deadline
 
 logger = logger.bind(name="Cookie")
 
+COOKIE_POOL_SIZE = Gauge("xilriws_cookie_pool_size", "Cookies in storage")
+COOKIE_POOL_TARGET = Gauge("xilriws_cookie_pool_target", "Cookies the storage is filled up to")
+COOKIE_DEMAND = Gauge("xilriws_cookie_demand", "Cookie uses per second over the last minute")
+COOKIE_WAIT_SECONDS = Histogram(
+    "xilriws_cookie_wait_seconds",
+    "Time spent waiting for a cookie from storage",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+
 
 class ReeseCookie:
     def __init__(self, cookies: dict[str, str], proxy: Proxy):
         self.value: str = "value"
         self.expiration: float = time.time() + EXPIRATION
         self.uses: int = 0
+        self.in_flight: int = 0
         self.cookies = cookies
         self.proxy = proxy
 
     def is_good(self) -> bool:
         return time.time() < self.expiration and self.uses < MAX_USES
 
+    @property
+    def remaining_uses(self) -> int:
+        return MAX_USES - self.uses
+
     def use(self) -> None:
         self.uses += 1
 
@@ -35,76 +56,185 @@ class ReeseCookie:
 class CookieMonster:
     fill_event: asyncio.Event
 
-    def __init__(self, browser: BrowserAuth, proxies: ProxyDistributor, proxy_dispenser: ProxyDispenser):
-        self.browser: BrowserAuth = browser
-        self.cookies: AwaitableSet[ReeseCookie] = AwaitableSet()
-        self.proxies = proxies
+    def __init__(
+        self,
+        browsers: list[BrowserAuth],
+        proxy_dispenser: ProxyDispenser,
+        min_storage: int = COOKIE_STORAGE_MIN,
+        max_storage: int = COOKIE_STORAGE_MAX,
+        snapshot_path: str | None = None,
+        store: CookieStore | None = None,
+    ):
+        self.browsers: list[BrowserAuth] = browsers
+        self.cookies: CookieStore = store if store is not None else CookiePool()
         self.proxy_dispenser = proxy_dispenser
+        self.min_storage = min_storage
+        self.max_storage = max(min_storage, max_storage)
+        self.acquiring = 0
+        self.seconds_per_cookie: float | None = None
+        self.__unproductive_seconds: dict[BrowserAuth, float] = {}
+        self.__leases: deque[float] = deque()
+        self.snapshot = CookieSnapshot(snapshot_path) if snapshot_path else None
+        self.cookies.add_change_listener(self.__store_changed)
+        COOKIE_POOL_SIZE.set_function(lambda: len(self.cookies))
+        COOKIE_POOL_TARGET.set_function(lambda: self.storage_target)
+        COOKIE_DEMAND.set_function(self.demand)
 
     async def prepare(self):
         self.fill_event = asyncio.Event()
-        task_creator.create_task(self.fill_task())
+        await self.cookies.prepare()
+        if self.snapshot:
+            restored = self.snapshot.load(self.proxy_dispenser)
+            for cookie in restored:
+                await self.cookies.add(cookie)
+            if restored:
+                logger.info(f"Restored {len(restored)} cookies from {self.snapshot.path}")
+            task_creator.create_task(self.snapshot.save_task(lambda: list(self.cookies)))
+
+        for browser in self.browsers:
+            task_creator.create_task(self.fill_task(browser))
+        task_creator.create_task(self.sweep_task())
+        task_creator.create_task(self.proxy_dispenser.reload_task())
         self.fill_event.set()
 
-    async def get_reese_cookie(self) -> ReeseCookie:
+    async def get_reese_cookie(self, deadline: Deadline | None = None) -> ReeseCookie:
+        """
+        lease a cookie from storage. it has to be handed back using return_cookie once the request is done.
+        with a deadline, DeadlineExceeded is raised if there's no cookie before it
+        """
         logger.info("Getting a reese cookie from storage")
-        cookie: ReeseCookie | None = None
 
-        while not cookie:
-            possible_cookie = await self.get_next_cookie()
-            if not possible_cookie.is_good():
-                await self.cookies.remove(possible_cookie)
-                self.fill_event.set()
+        if not self.cookies:
+            self.fill_event.set()
+
+        self.__leases.append(time.monotonic())
+
+        with COOKIE_WAIT_SECONDS.time():
+            if deadline is None:
+                cookie = await self.cookies.lease()
             else:
-                cookie = possible_cookie
+                cookie = await deadline.run(self.cookies.lease())
 
-        cookie.use()
+        if len(self.cookies) < self.storage_target:
+            self.fill_event.set()
+        self.__snapshot_changed()
         logger.info("Cookie selected")
 
         return cookie
 
+    @property
+    def storage_target(self) -> int:
+        """
+        enough cookies to serve the current demand for as long as it takes a browser to get a new one, plus the requests
+        that are waiting already and the next one. few cookies while it's quiet, so they don't expire unused
+        """
+        uses = self.cookies.waiting + 1
+        if self.seconds_per_cookie is not None:
+            uses += self.demand() * self.seconds_per_cookie
+        target = math.ceil(uses / MAX_USES)
+        return min(self.max_storage, max(self.min_storage, target))
+
+    def demand(self) -> float:
+        """cookie uses per second, measured over the last DEMAND_WINDOW seconds"""
+        now = time.monotonic()
+        while self.__leases and self.__leases[0] < now - DEMAND_WINDOW:
+            self.__leases.popleft()
+        if not self.__leases:
+            return 0.0
+
+        # don't extrapolate the first few requests of a burst to a huge rate
+        span = max(now - self.__leases[0], 1.0)
+        return len(self.__leases) / span
+
+    def refill_rate(self) -> float | None:
+        """cookies per second all browsers can acquire, None if we haven't acquired one yet"""
+        if not self.seconds_per_cookie:
+            return None
+        return len(self.browsers) / self.seconds_per_cookie
+
+    def return_cookie(self, cookie: ReeseCookie) -> None:
+        self.cookies.release(cookie)
+
+    def count_queued(self, queued: Callable[[], int]) -> None:
+        """queued counts the requests that wait for their turn to lease a cookie, they need one as much as the others"""
+        self.cookies.queued = queued
+
+    def add_retire_listener(self, listener: Callable[[ReeseCookie], None]) -> None:
+        """listener is called once a cookie has left storage and isn't used by any request anymore"""
+        self.cookies.retire_listeners.append(listener)
+
     async def remove_cookie(self, cookie: ReeseCookie) -> None:
         await self.cookies.remove(cookie)
         self.fill_event.set()
+        self.__snapshot_changed()
+
+    def save_snapshot(self) -> None:
+        if self.snapshot:
+            self.snapshot.save(self.cookies)
 
-    async def fill_task(self):
+    async def sweep_task(self):
+        while True:
+            next_expiration = self.cookies.next_expiration()
+            if next_expiration is None:
+                await asyncio.sleep(EXPIRATION)
+            else:
+                await asyncio.sleep(max(0.0, next_expiration - time.time()) + 0.1)
+
+            removed = await self.cookies.sweep()
+            if removed:
+                logger.info(f"Removed {removed} expired cookies from storage")
+                self.fill_event.set()
+                self.__snapshot_changed()
+
+    async def fill_task(self, browser: BrowserAuth):
+        """one of these runs per browser, so all browsers acquire cookies at the same time"""
         while True:
             await self.fill_event.wait()
             logger.info("Filling cookie storage in the background")
 
             try:
-                while len(self.cookies) < COOKIE_STORAGE:
-                    await self.__get_one_cookie()
-                    logger.info(f"Cookie storage at {len(self.cookies)}/{COOKIE_STORAGE}")
+                while len(self.cookies) + self.acquiring < self.storage_target:
+                    self.acquiring += 1
+                    try:
+                        await self.__get_one_cookie(browser)
+                    finally:
+                        self.acquiring -= 1
+                    logger.info(f"Cookie storage at {len(self.cookies)}/{self.storage_target}")
             except Exception as e:
                 logger.exception("unhandled exception while filling cookie storage, please report", e)
 
             self.fill_event.clear()
 
-    async def get_next_cookie(self) -> ReeseCookie:
-        async with self.cookies.cond:
-            while not len(self.cookies):
-                await self.cookies.cond.wait()
-
-            next_cookie: ReeseCookie | None = None
-            for potential_cookie in self.cookies.set:
-                if next_cookie is None:
-                    next_cookie = potential_cookie
-                elif potential_cookie.expiration < next_cookie.expiration:
-                    next_cookie = potential_cookie
-
-            return next_cookie
-
-    async def __get_one_cookie(self) -> ReeseCookie | None:
+    async def __get_one_cookie(self, browser: BrowserAuth) -> ReeseCookie | None:
         logger.info("Opening browser to get a cookie")
-        proxy = await self.proxy_dispenser.get_auth_proxy()
-        proxy_changed = self.proxies.set_next_proxy(proxy)
+        taken = {other.proxies.next_proxy for other in self.browsers if other is not browser}
+        proxy = await self.proxy_dispenser.get_auth_proxy(taken)
+        proxy_changed = browser.proxies.set_next_proxy(proxy)
 
-        cookie = await self.browser.get_reese_cookie(proxy_changed)
+        start = time.monotonic()
+        cookie = await browser.get_reese_cookie(proxy_changed)
 
+        # time spent on failed attempts counts towards the next cookie this browser gets
+        spent = self.__unproductive_seconds.pop(browser, 0) + time.monotonic() - start
         if not cookie:
+            self.__unproductive_seconds[browser] = spent
             return None
 
+        if self.seconds_per_cookie is None:
+            self.seconds_per_cookie = spent
+        else:
+            self.seconds_per_cookie = 0.8 * self.seconds_per_cookie + 0.2 * spent
+
         await self.cookies.add(cookie)
+        self.__snapshot_changed()
         return cookie
 
+    def __store_changed(self) -> None:
+        # another instance took cookies or is waiting for some
+        if len(self.cookies) + self.acquiring < self.storage_target:
+            self.fill_event.set()
+
+    def __snapshot_changed(self) -> None:
+        if self.snapshot:
+            self.snapshot.mark_changed()
+
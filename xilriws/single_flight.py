@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    def __init__(self, task: asyncio.Task[T]):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[K, T]):
+    """
+    Concurrent calls with the same key share one run of the function, and all get its result or exception.
+    A caller that's cancelled doesn't cancel the run for the others, it's only cancelled once nobody waits for it.
+    """
+
+    def __init__(self):
+        self.flights: dict[K, _Flight[T]] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.flights
+
+    def __len__(self):
+        return len(self.flights)
+
+    async def run(self, key: K, function: Callable[[], Awaitable[T]]) -> T:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(function()))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self.__land(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.task.done():
+                self.__land(key, flight)
+            elif not flight.waiters:
+                flight.task.cancel()
+
+    def __land(self, key: K, flight: _Flight[T]) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from loguru import logger
+
+from prometheus_client import CollectorRegistry, Counter
+
+logger = logger.bind(name="Supervisor")
+
+# a worker that exits sooner than this after starting is restarted with a delay, so a broken setup doesn't spin
+MIN_UPTIME = 30
+RESTART_DELAY = 10
+STOP_TIMEOUT = 15
+
+# the supervising process doesn't auth itself, it only reports these next to the metrics of its workers
+SUPERVISOR_REGISTRY = CollectorRegistry()
+
+WORKER_RESTARTS = Counter(
+    "xilriws_worker_restarts",
+    "Worker processes that exited and were started again",
+    ("worker",),
+    registry=SUPERVISOR_REGISTRY,
+)
+
+
+class Supervisor:
+    """Runs one process per command and starts it again whenever it exits"""
+
+    def __init__(self, commands: list[list[str]]):
+        self.commands = commands
+        self.processes: dict[int, asyncio.subprocess.Process] = {}
+        self.stopping = False
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self.__keep_running(index, command) for index, command in enumerate(self.commands)))
+
+    async def __keep_running(self, index: int, command: list[str]) -> None:
+        while not self.stopping:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(*command)
+            self.processes[index] = process
+            logger.info(f"Started worker {index} (pid {process.pid})")
+
+            returncode = await process.wait()
+            if self.stopping:
+                return
+
+            logger.error(f"Worker {index} exited with code {returncode}, restarting it")
+            WORKER_RESTARTS.labels(worker=str(index)).inc()
+            if time.monotonic() - started < MIN_UPTIME:
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def stop(self) -> None:
+        """ask all workers to shut down (so they save their cookies) and kill the ones that don't"""
+        self.stopping = True
+        running = [process for process in self.processes.values() if process.returncode is None]
+        for process in running:
+            process.terminate()
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in running)), timeout=STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    logger.warning(f"Worker with pid {process.pid} didn't stop, killing it")
+                    process.kill()